@@ -0,0 +1,128 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# ---------------------------
+# Answer Keys
+# ---------------------------
+# An exam's answer key is built once and shared by every submission graded
+# against it. Lookups go by question_id, then by question number, then by
+# position, each through a dict or list, so aligning a paper is O(1) per
+# question no matter how large the key is.
+MAX_CACHED_KEYS = int(os.environ.get("XAMINAI_MAX_CACHED_KEYS", "64"))
+
+# "3) answer", "Q3: answer", "Question 3. answer" (a space after the separator
+# keeps decimals like "3.5 m/s" from being read as numbering)
+NUMBERED_LINE_RE = re.compile(r"^\s*(?:Q(?:uestion)?\s*\.?\s*)?(?P<number>\d+)\s*[\).:]\s+(?P<answer>.+)$", re.IGNORECASE)
+
+
+class AnswerKey:
+    """Correct answers indexed by question_id, by question number and by position."""
+
+    def __init__(self, answers, ids=None, numbers=None):
+        self.answers = list(answers)
+        self.by_id = {qid: i for i, qid in enumerate(ids or []) if qid}
+        self.by_number = {str(n): i for i, n in enumerate(numbers or []) if n is not None}
+
+    def __len__(self):
+        return len(self.answers)
+
+    @classmethod
+    def from_lines(cls, lines):
+        """One answer per non-empty line; "3) ..." style prefixes become question numbers."""
+        answers, numbers = [], []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            match = NUMBERED_LINE_RE.match(line)
+            answers.append(match.group("answer").strip() if match else line)
+            numbers.append(match.group("number") if match else None)
+        return cls(answers, numbers=numbers)
+
+    @classmethod
+    def from_text(cls, text):
+        return cls.from_lines((text or "").split("\n"))
+
+    @classmethod
+    def from_records(cls, records):
+        """From [{"question_id": ..., "correct_answer": ...}, ...] (the JSON answer key format)."""
+        records = [r for r in records if isinstance(r, dict)]
+        return cls(
+            [r.get("correct_answer", "") for r in records],
+            ids=[r.get("question_id") for r in records],
+            numbers=[r.get("number") for r in records]
+        )
+
+    def answer_for(self, question, position):
+        """Correct answer for one question dict at position in its paper, or None."""
+        index = self.by_id.get(question.get("question_id"))
+        if index is None and question.get("number") is not None:
+            index = self.by_number.get(str(question["number"]))
+        if index is None and not self.by_id and position < len(self.answers):
+            index = position
+        return None if index is None else self.answers[index]
+
+    def apply(self, data):
+        """Copy of data with correct_answer filled in from the key wherever it has one."""
+        aligned = []
+        for position, q in enumerate(data):
+            answer = self.answer_for(q, position)
+            aligned.append(dict(q, correct_answer=answer) if answer is not None else q)
+        return aligned
+
+    def as_correct_answers(self):
+        """{question_id: correct_answer} for keys built from records."""
+        return {qid: self.answers[i] for qid, i in self.by_id.items()}
+
+# ---------------------------
+# Shared Key Cache
+# ---------------------------
+_keys_lock = threading.Lock()
+_keys = OrderedDict()
+
+
+def cached_answer_key(cache_key, build):
+    """AnswerKey for cache_key, built with build() on first use and shared by every session."""
+    with _keys_lock:
+        key = _keys.get(cache_key)
+        if key is not None:
+            _keys.move_to_end(cache_key)
+            return key
+    key = build()
+    with _keys_lock:
+        _keys[cache_key] = key
+        while len(_keys) > MAX_CACHED_KEYS:
+            _keys.popitem(last=False)
+    return key
+
+
+def answer_key_from_document(file, file_name):
+    """AnswerKey from an uploaded/downloaded PDF, DOCX or JSON file, cached by content hash."""
+    from doc_extract import content_digest, document_bytes, extract_docx_text, extract_pdf_text
+
+    data = document_bytes(file)
+
+    def build():
+        if file_name.endswith(".pdf"):
+            return AnswerKey.from_text(extract_pdf_text(data))
+        if file_name.endswith(".docx"):
+            return AnswerKey.from_text(extract_docx_text(data))
+        if file_name.endswith(".json"):
+            return AnswerKey.from_records(json.loads(bytes(data).decode("utf-8")))
+        raise ValueError(f"Unsupported answer key format: {file_name}")
+
+    return cached_answer_key(("document", content_digest(data)), build)
+
+
+def answer_key_from_file(path):
+    """AnswerKey from a JSON answer key on disk, re-read only when the file changes."""
+    stat = os.stat(path)
+
+    def build():
+        with open(path, "r", encoding="utf-8") as f:
+            return AnswerKey.from_records(json.load(f))
+
+    return cached_answer_key(("file", os.path.abspath(path), stat.st_mtime_ns, stat.st_size), build)
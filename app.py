@@ -1,30 +1,34 @@
 import streamlit as st
 import json
 import pandas as pd
-import re
-from io import BytesIO
-from day6_grader import evaluate, companion_feedback
-import fitz  # PyMuPDF for PDFs
-import docx  # python-docx for DOCX
-import os
-
-# Google Drive API
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
+from day6_grader import warm_up_model
+from grading_jobs import CANCELLED, DONE, FAILED, QUEUED, job_manager
+from drive_utils import FOLDER_MIME, get_drive_client
+from folder_grading import SUBMISSION_EXTENSIONS
+from answer_key import answer_key_from_document
+from doc_extract import extract_docx_text, extract_pdf_text, parse_document, smart_parse_text_to_json
+from metrics import STAGES, metrics
+from reports import generate_docx, generate_pdf
+import hashlib
+import threading
+import time
 
 st.set_page_config(page_title="AI Grading App", layout="wide")
 
+
+@st.cache_resource
+def start_model_warmup():
+    """Load the grading model in the background once per process, so the UI renders right away."""
+    thread = threading.Thread(target=warm_up_model, daemon=True)
+    thread.start()
+    return thread
+
+
+start_model_warmup()
+
 # ---------------------------
 # Google Drive Helpers (Updated)
 # ---------------------------
-SERVICE_ACCOUNT_FILE = 'service_account.json'
-SCOPES = ['https://www.googleapis.com/auth/drive']
 model_id = "microsoft/phi-3.5-mini-instruct"
 
 #https://www.googleapis.com/auth/drive https://www.googleapis.com/auth/drive.readonly
@@ -86,76 +90,10 @@ model_id = "microsoft/phi-3.5-mini-instruct"
 #         st.error(f"⚠️ Could not authenticate Google Drive: {e}")
 #         return None
 
-def get_drive_service():
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES
-    )
-    service = build('drive', 'v3', credentials=creds)
-    return service
-
-# Example: List first 10 files in the shared folder
-service = get_drive_service()
-results = service.files().list(
-    pageSize=10, fields="files(id, name)"
-).execute()
-items = results.get('files', [])
-
-if not items:
-    print("No files found.")
-else:
-    for item in items:
-        print(f"{item['name']} ({item['id']})")
-
-
-def download_drive_file(service, file_id):
-    """Download a file from Google Drive using its file ID."""
+def list_drive_files(refresh=False):
+    """List files from Google Drive as (name, id) pairs, from the shared listing cache."""
     try:
-        # Get file metadata
-        file = service.files().get(fileId=file_id, fields="id, name, mimeType").execute()
-        file_name = file["name"]
-        mime_type = file["mimeType"]
-
-        fh = BytesIO()
-
-        if mime_type == "application/vnd.google-apps.folder":
-            # It's a folder, not a file
-            return None, None, "Cannot download: Selected item is a folder."
-
-        elif mime_type.startswith("application/vnd.google-apps."):
-            # Google Docs/Sheets/Slides -> Export as PDF
-            export_mime = "application/pdf"
-            request = service.files().export_media(fileId=file_id, mimeType=export_mime)
-            file_name += ".pdf"
-        else:
-            # Normal file download (PDF, DOCX, etc.)
-            request = service.files().get_media(fileId=file_id)
-
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-            if status:
-                print(f"Downloading {file_name}: {int(status.progress() * 100)}%")
-
-        fh.seek(0)
-        return fh, file_name, None  # Success
-
-    except Exception as e:
-        return None, None, str(e)
-
-
-
-
-
-
-def list_drive_files(service, page_size=20):
-    """List files from Google Drive."""
-    try:
-        results = service.files().list(
-            pageSize=page_size,
-            fields="files(id, name)"
-        ).execute()
-        items = results.get('files', [])
+        items = get_drive_client().list_files(refresh=refresh)
         if not items:
             st.warning("⚠️ No files found in Google Drive.")
             return []
@@ -169,13 +107,7 @@ def list_drive_files(service, page_size=20):
 # ---------------------------
 def pdf_to_text(file):
     try:
-        text = ""
-        pdf_data = file.read()
-        pdf_file = BytesIO(pdf_data)
-        doc = fitz.open(stream=pdf_file, filetype="pdf")
-        for page in doc:
-            text += page.get_text() + "\n"
-        return text.strip()
+        return extract_pdf_text(file)
     except Exception as e:
         st.error(f"❌ PDF extraction failed: {e}")
         return ""
@@ -183,110 +115,332 @@ def pdf_to_text(file):
 
 def docx_to_text(file):
     try:
-        doc_obj = docx.Document(file)
-        return "\n".join([p.text for p in doc_obj.paragraphs if p.text.strip()]).strip()
+        return extract_docx_text(file)
     except Exception as e:
         st.error(f"❌ DOCX extraction failed: {e}")
         return ""
 
 
-def detect_question(line):
-    keywords = [
-        r'\bdefine\b', r'\bdescribe\b', r'\bshow\b', r'\billustrate\b',
-        r'\belaborate\b', r'\bexplain\b', r'\bgive\b',
-        r'\bwho\b', r'\bwhat\b', r'\bwhere\b', r'\bwhen\b', r'\bwhy\b', r'\bhow\b'
-    ]
-    pattern = r'(\?$|:\s*$|' + "|".join(keywords) + r')'
-    return re.search(pattern, line.strip(), flags=re.IGNORECASE)
-
-
-def smart_parse_text_to_json(raw_text):
-    raw_text = re.sub(r'\n+', '\n', raw_text.strip())
-    lines = raw_text.split("\n")
-    questions, current_q, current_a = [], None, []
-
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        if detect_question(line) or re.match(r'^\d+[\).]', line):
-            if current_q:
-                questions.append({
-                    "question_id": f"Q{len(questions)+1}",
-                    "question": current_q,
-                    "student_answer": " ".join(current_a).strip(),
-                    "correct_answer": "",
-                    "max_score": 5
-                })
-            current_q, current_a = line, []
-        else:
-            current_a.append(line)
-    if current_q:
-        questions.append({
-            "question_id": f"Q{len(questions)+1}",
-            "question": current_q,
-            "student_answer": " ".join(current_a).strip(),
-            "correct_answer": "",
-            "max_score": 5
-        })
-    return questions
+def parse_submission(file, file_name):
+    """Question records from a PDF/DOCX/JSON submission; raises ValueError for other formats."""
+    if file_name.endswith(".pdf"):
+        return smart_parse_text_to_json(pdf_to_text(file))
+    if file_name.endswith(".docx"):
+        return smart_parse_text_to_json(docx_to_text(file))
+    if file_name.endswith(".json"):
+        file.seek(0)
+        return json.load(file)
+    raise ValueError(f"Unsupported file format: {file_name}")
 
 
-# ---------------------------
-# Sidebar Navigation
-# ---------------------------
-mode = st.sidebar.radio("Choose Mode", ["Grading Mode", "Companion Mode"])
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from docx import Document
-from io import BytesIO
+def load_answer_key(file, file_name):
+    """Shared AnswerKey for an answer key file (built once per exam), or None if it can't be read."""
+    try:
+        return answer_key_from_document(file, file_name)
+    except Exception as e:
+        st.error(f"❌ Could not read answer key {file_name}: {e}")
+        return None
+
 
 # ---------------------------
-# HELPER: Generate DOCX
+# Sidebar Navigation
 # ---------------------------
-def generate_docx(results, max_score):
-    doc = Document()
-    doc.add_heading("Graded Results", 0)
-
-    for idx, q in enumerate(results, start=1):
-        doc.add_paragraph(f"Q{idx}: {q['question']}")
-        doc.add_paragraph(f"Student Answer: {q['student_answer']}")
-        doc.add_paragraph(f"Correct Answer: {q['correct_answer']}")
-        doc.add_paragraph(f"Model Score: {q['model_score']}")
-        doc.add_paragraph(f"Final Score: {q['final_score']} / {max_score}")
-        doc.add_paragraph(f"Feedback: {q.get('feedback', 'No feedback')}")
-        doc.add_paragraph("")
+def render_metrics_panel():
+    """Sidebar panel with per-stage timings, cache/retry rates and a Prometheus export."""
+    with st.sidebar.expander("📊 Pipeline Metrics", expanded=False):
+        snapshot = metrics.snapshot()
+        stages = snapshot["stages"]
+        if not stages:
+            st.caption("Nothing recorded yet.")
+        else:
+            order = {stage: i for i, stage in enumerate(STAGES)}
+            st.dataframe(pd.DataFrame([{
+                "stage": stage,
+                "runs": stats["count"],
+                "total_s": round(stats["seconds"], 2),
+                "mean_ms": stats["mean_ms"],
+                "tokens": stats["tokens"],
+                "tokens/s": stats["tokens_per_second"]
+            } for stage, stats in sorted(stages.items(), key=lambda item: order.get(item[0], len(order)))]),
+                hide_index=True, use_container_width=True)
+
+        collectors = snapshot["collectors"]
+        generation = collectors.get("generation", {})
+        st.markdown(
+            f"**Retry rate:** {snapshot['rates']['retry_rate']:.1%}  \n"
+            f"**Result cache hits:** {collectors.get('result_cache', {}).get('hit_rate', 0):.1%}  \n"
+            f"**Extraction cache hits:** {collectors.get('extract_cache', {}).get('hit_rate', 0):.1%}  \n"
+            f"**Prompt padding:** {generation.get('padding_ratio', 0):.1%}  \n"
+            f"**Jobs:** {', '.join(f'{k} {v}' for k, v in collectors.get('jobs', {}).items()) or 'none'}"
+        )
+        st.download_button(
+            label="⬇️ Prometheus metrics",
+            data=metrics.prometheus_text(),
+            file_name="xaminai_metrics.prom",
+            mime="text/plain"
+        )
+
+
+def describe_job_metrics(job_metrics):
+    """One line of throughput figures for a finished job's paper_metrics()."""
+    if not job_metrics:
+        return ""
+    return (f"🧮 {job_metrics['model_questions']} graded by the model "
+            f"({job_metrics['cache_hits']} from cache, {job_metrics['retries']} retries), "
+            f"{job_metrics['rule_questions']} by rules; {job_metrics['generated_tokens']} tokens generated"
+            f" at {job_metrics.get('tokens_per_second') or 0} tokens/s")
 
-    buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
 
+mode = st.sidebar.radio("Choose Mode", ["Grading Mode", "Companion Mode"])
+render_metrics_panel()
 
 # ---------------------------
-# HELPER: Generate PDF
+# HELPER: Background grading jobs
 # ---------------------------
-def generate_pdf(results, max_score):
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer)
-    styles = getSampleStyleSheet()
-    story = []
+SUMMARY_COLUMNS = ["question", "student_answer", "correct_answer", "model_score", "final_score", "feedback_short"]
+
+
+def shorten_feedback(feedback):
+    feedback = "" if feedback is None else str(feedback)
+    return feedback if len(feedback) <= 120 else feedback[:117] + "..."
+
+
+MAX_MEMOISED_QUESTIONS = 2000
+
+
+def question_digest(q, difficulty, max_score):
+    """Digest of everything that can change one question's grade."""
+    key = json.dumps([
+        q.get("question", ""), q.get("student_answer", ""), q.get("correct_answer", ""),
+        str(q.get("grading_mode", difficulty)).lower(), q.get("max_score", max_score)
+    ], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def submit_incremental_grading(session_key, data, difficulty, max_score):
+    """
+    Queue only the questions whose inputs changed since they were last graded
+    in this session; unchanged questions reuse their memoised entries. The
+    job previously stored under session_key is cancelled, as its inputs are stale.
+    """
+    previous = st.session_state.get(session_key)
+    if previous:
+        job_manager.cancel(previous)
+    memo = st.session_state.setdefault("graded_questions", {})
+    keys = [question_digest(q, difficulty, max_score) for q in data]
+    known = {idx: memo[key] for idx, key in enumerate(keys) if key in memo}
+    job_id = job_manager.submit_grading(data, difficulty=difficulty, max_score=max_score, known_results=known)
+    if job_id is None:
+        st.warning("⚠️ The grading queue is full right now. Please try again in a moment.")
+        return None
+    st.session_state[session_key] = job_id
+    st.session_state[f"{session_key}_question_keys"] = keys
+    return job_id
+
+
+def memoise_graded_questions(session_key, entries):
+    """Remember finished entries per question digest so later runs can skip them."""
+    keys = st.session_state.get(f"{session_key}_question_keys")
+    if not keys:
+        return
+    memo = st.session_state.setdefault("graded_questions", {})
+    for key, entry in zip(keys, entries):
+        if entry is not None:
+            memo[key] = entry
+    # Keep the per-session memo bounded; dicts preserve insertion order
+    while len(memo) > MAX_MEMOISED_QUESTIONS:
+        del memo[next(iter(memo))]
+
+
+def poll_until_finished(job, session_key):
+    """Offer a cancel button, then rerun the page shortly so the job status refreshes."""
+    if st.button("⏹️ Cancel", key=f"cancel_{session_key}"):
+        job_manager.cancel(job.id)
+    time.sleep(1)
+    st.rerun()
+
+
+def render_grading_job(session_key):
+    """
+    Show the grading job stored under session_key: summary table filled row by
+    row, progress bar with ETA, and a cancel button while it runs.
+
+    Returns the graded entries once the job has finished, otherwise None.
+    """
+    job_id = st.session_state.get(session_key)
+    if not job_id:
+        return None
+    job = job_manager.get(job_id)
+    if job is None:
+        st.warning("⚠️ This grading job has expired. Please grade again.")
+        del st.session_state[session_key]
+        # Forget what was submitted too, so the same inputs are graded again
+        st.session_state.pop(f"{session_key}_digest", None)
+        return None
+
+    entries = job.snapshot()
+    rows = []
+    for item, entry in zip(job.items, entries):
+        if entry is None:
+            rows.append({
+                "question": item.get("question", ""),
+                "student_answer": item.get("student_answer", ""),
+                "correct_answer": item.get("correct_answer", ""),
+                "model_score": None,
+                "final_score": None,
+                "feedback_short": "⏳ Grading..."
+            })
+        else:
+            rows.append({
+                "question": entry.get("question", ""),
+                "student_answer": entry.get("student_answer", ""),
+                "correct_answer": entry.get("correct_answer", ""),
+                "model_score": entry.get("model_score"),
+                "final_score": entry.get("final_score"),
+                "feedback_short": shorten_feedback(entry.get("feedback"))
+            })
+
+    st.subheader("🏷️ Grading Summary")
+    if job.status == QUEUED:
+        st.progress(0.0, text=f"Queued — waiting for a free grading worker ({job.total} questions)...")
+    elif not job.finished:
+        eta = job.eta_seconds()
+        eta_text = f" — about {eta:.0f}s left" if eta is not None else ""
+        st.progress(job.completed / max(1, job.total), text=f"Graded {job.completed}/{job.total} questions{eta_text}")
+    elif job.status == DONE:
+        st.progress(1.0, text=f"✅ Graded {job.total} questions in {job.finished_at - job.started_at:.1f}s")
+        st.caption(describe_job_metrics(job.metrics))
+    st.dataframe(pd.DataFrame(rows, columns=SUMMARY_COLUMNS), use_container_width=True)
+
+    if not job.finished:
+        poll_until_finished(job, session_key)
+    memoise_graded_questions(session_key, entries)
+    if job.status == FAILED:
+        st.error(f"❌ Grading failed: {job.error}")
+        return None
+    if job.status == CANCELLED:
+        st.warning(f"⏹️ Grading cancelled after {job.completed}/{job.total} questions.")
+    return [entry for entry in entries if entry is not None]
+
+
+def render_detailed_feedback(results):
+    st.subheader("🔎 Detailed Feedback")
+    for idx, q in enumerate(results, start=1):
+        q_text = q.get("question", f"Question {idx}")
+        with st.expander(f"Question {idx}: {q_text}", expanded=False):
+            st.markdown(f"**Student Answer:** {q.get('student_answer', '')}")
+            st.markdown(f"**Correct Answer:** {q.get('correct_answer', '')}")
+            st.markdown(f"**Model Score:** {q.get('model_score', '')}  —  **Final Score:** {q.get('final_score', '')}")
+            st.markdown(f"**Feedback:** {q.get('feedback', 'No feedback available')}")
+            if q.get("improvement_steps"):
+                st.markdown("**🚀 Steps to Improve:**")
+                for step in q.get("improvement_steps", []):
+                    st.markdown(f"- {step}")
+            if q.get("keywords"):
+                st.markdown(f"**🔑 Keywords:** {', '.join(q.get('keywords', []))}")
+            if q.get("rule_score") is not None:
+                st.markdown(f"**Rule-based Score:** {q.get('rule_score')}")
 
-    story.append(Paragraph("Graded Results", styles["Title"]))
-    story.append(Spacer(1, 20))
 
-    for idx, q in enumerate(results, start=1):
-        story.append(Paragraph(f"Q{idx}: {q['question']}", styles["Heading3"]))
-        story.append(Paragraph(f"Student Answer: {q['student_answer']}", styles["Normal"]))
-        story.append(Paragraph(f"Correct Answer: {q['correct_answer']}", styles["Normal"]))
-        story.append(Paragraph(f"Model Score: {q['model_score']}", styles["Normal"]))
-        story.append(Paragraph(f"Final Score: {q['final_score']} / {max_score}", styles["Normal"]))
-        story.append(Paragraph(f"Feedback: {q.get('feedback', 'No feedback')}", styles["Normal"]))
-        story.append(Spacer(1, 12))
+def render_export_buttons(results, max_score):
+    st.subheader("📥 Export Results")
+    try:
+        with metrics.timer("report"):
+            docx_buffer = generate_docx(results, max_score)
+        st.download_button(
+            label="📘 Download DOCX Report",
+            data=docx_buffer,
+            file_name="graded_results.docx",
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        )
+    except Exception as e:
+        st.warning(f"⚠️ DOCX generation skipped: {e}")
 
-    doc.build(story)
-    buffer.seek(0)
-    return buffer
+    try:
+        with metrics.timer("report"):
+            pdf_buffer = generate_pdf(results, max_score)
+        st.download_button(
+            label="📄 Download PDF Report",
+            data=pdf_buffer,
+            file_name="graded_results.pdf",
+            mime="application/pdf"
+        )
+    except Exception as e:
+        st.warning(f"⚠️ PDF generation skipped: {e}")
+
+
+STUDENT_COLUMNS = ["student", "file_name", "status", "total_score", "max_total", "percentage", "error"]
+
+
+def render_folder_job(session_key):
+    """
+    Show the folder job stored under session_key: one row per student as they
+    finish, then the class summary and a per-student breakdown.
+    """
+    job_id = st.session_state.get(session_key)
+    if not job_id:
+        return
+    job = job_manager.get(job_id)
+    if job is None:
+        st.warning("⚠️ This grading job has expired. Please grade again.")
+        del st.session_state[session_key]
+        return
+
+    students = job.snapshot()
+    rows = []
+    for item, result in zip(job.items, students):
+        if result is None:
+            rows.append({"student": item.get("name", ""), "file_name": item.get("name", ""), "status": "⏳ Pending"})
+        else:
+            rows.append({column: result.get(column) for column in STUDENT_COLUMNS})
+
+    st.subheader("🏷️ Class Results")
+    if job.status == QUEUED:
+        st.progress(0.0, text=f"Queued — waiting for a free grading worker ({job.total} submissions)...")
+    elif not job.finished:
+        eta = job.eta_seconds()
+        eta_text = f" — about {eta:.0f}s left" if eta is not None else ""
+        st.progress(job.completed / max(1, job.total), text=f"Graded {job.completed}/{job.total} submissions{eta_text}")
+    elif job.status == DONE:
+        st.progress(1.0, text=f"✅ Graded {job.total} submissions in {job.finished_at - job.started_at:.1f}s")
+        st.caption(describe_job_metrics(job.metrics))
+    table = pd.DataFrame(rows, columns=STUDENT_COLUMNS)
+    st.dataframe(table, use_container_width=True)
+
+    if not job.finished:
+        poll_until_finished(job, session_key)
+    if job.status == FAILED:
+        st.error(f"❌ Grading failed: {job.error}")
+        return
+    if job.status == CANCELLED:
+        st.warning(f"⏹️ Grading cancelled after {job.completed}/{job.total} submissions.")
+
+    summary = job.summary or {}
+    st.subheader("📊 Class Summary")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Graded", f"{summary.get('graded', 0)}/{summary.get('students', 0)}")
+    col2.metric("Mean %", summary.get("mean_percentage"))
+    col3.metric("Median %", summary.get("median_percentage"))
+    col4.metric("Range %", f"{summary.get('min_percentage')} – {summary.get('max_percentage')}")
+    if summary.get("questions"):
+        st.dataframe(pd.DataFrame(summary["questions"]), use_container_width=True)
+
+    st.download_button(
+        label="📊 Download Class Results (CSV)",
+        data=table.to_csv(index=False).encode("utf-8"),
+        file_name="class_results.csv",
+        mime="text/csv"
+    )
+    st.subheader("🔎 Per-student Feedback")
+    for result in students:
+        if result and result["results"]:
+            with st.expander(f"{result['student']} — {result['total_score']}/{result['max_total']}", expanded=False):
+                st.dataframe(pd.DataFrame([{
+                    "question": e.get("question", ""),
+                    "student_answer": e.get("student_answer", ""),
+                    "final_score": e.get("final_score"),
+                    "feedback_short": shorten_feedback(e.get("feedback"))
+                } for e in result["results"]]), use_container_width=True)
 
 
 # ---------------------------
@@ -298,8 +452,7 @@ if mode == "Grading Mode":
 
     max_score = st.number_input("Set Max Score per Question", min_value=1, max_value=20, value=5, step=1)
 
-    upload_option = st.radio("Choose Input Mode:",["✍️ Enter Text", "📂 Upload File", "☁️ Google Drive"],horizontal=True)
-    correct_answers_text = None
+    upload_option = st.radio("Choose Input Mode:",["✍️ Enter Text", "📂 Upload File", "☁️ Google Drive", "🗂️ Drive Folder"],horizontal=True)
     uploaded_file = None
     file_name = None
     correct_file = None
@@ -322,55 +475,11 @@ if mode == "Grading Mode":
                   "correct_answer": correct_answer,
                   "grading_mode": difficulty
               }]
+              submit_incremental_grading("text_job", data, difficulty, max_score)
 
-              # Save the input locally
-              with open("uploaded.json", "w", encoding="utf-8") as f:
-                  json.dump(data, f, indent=2, ensure_ascii=False)
-
-              # Spinner while grading
-              with st.spinner("Grading in progress..."):
-                  evaluate("uploaded.json", "graded_results.json", difficulty=difficulty, max_score=max_score)
-
-              # Read the results and display
-              try:
-                  with open("graded_results.json", "r", encoding="utf-8") as f:
-                      results = json.load(f)
-
-                  # Convert to DataFrame for summary
-                  import pandas as pd
-                  df = pd.DataFrame(results)
-
-                  # Create 'feedback_short' if missing
-                  if "feedback_short" not in df.columns:
-                      df["feedback_short"] = df["feedback"].apply(lambda x: x[:100] + "..." if x else "")
-
-                  # Grading Summary
-                  summary_cols = ["question", "student_answer", "correct_answer", "model_score", "final_score", "feedback_short"]
-                  st.subheader("🏷️ Grading Summary")
-                  st.dataframe(df[summary_cols], use_container_width=True)
-
-                  # Detailed Feedback
-                  st.subheader("🔎 Detailed Feedback")
-                  for idx, q in enumerate(results, start=1):
-                      q_text = q.get("question", f"Question {idx}")
-                      with st.expander(f"Question {idx}: {q_text}", expanded=False):
-                          st.markdown(f"**Student Answer:** {q.get('student_answer', '')}")
-                          st.markdown(f"**Correct Answer:** {q.get('correct_answer', '')}")
-                          st.markdown(f"**Model Score:** {q.get('model_score', '')}  —  **Final Score:** {q.get('final_score', '')}")
-                          st.markdown(f"**Feedback:** {q.get('feedback', 'No feedback available')}")
-                          if q.get("improvement_steps"):
-                              st.markdown("**🚀 Steps to Improve:**")
-                              for step in q.get("improvement_steps", []):
-                                  st.markdown(f"- {step}")
-                          if q.get("keywords"):
-                              st.markdown(f"**🔑 Keywords:** {', '.join(q.get('keywords', []))}")
-                          if q.get("rule_score") is not None:
-                              st.markdown(f"**Rule-based Score:** {q.get('rule_score')}")
-
-              except Exception as e:
-                  st.error(f"Could not load graded results: {e}")
-
-
+      results = render_grading_job("text_job")
+      if results:
+          render_detailed_feedback(results)
 
 
     elif upload_option == "📂 Upload File":
@@ -383,79 +492,56 @@ if mode == "Grading Mode":
       if uploaded_file:
           file_name = uploaded_file.name
 
-          # Parse student answers
-          if file_name.endswith(".pdf"):
-              raw_text = pdf_to_text(uploaded_file)
-              data = smart_parse_text_to_json(raw_text)
-          elif file_name.endswith(".docx"):
-              raw_text = docx_to_text(uploaded_file)
-              data = smart_parse_text_to_json(raw_text)
-          elif file_name.endswith(".json"):
-              uploaded_file.seek(0)
-              data = json.load(uploaded_file)
-          else:
-              st.error("Unsupported file format.")
-              st.stop()
-
-          # Parse optional correct answers file
+          # Digest of both uploads; extraction and parsing only rerun when the bytes change
+          files_digest = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
           if correct_file:
-              if correct_file.name.endswith(".pdf"):
-                  correct_answers_text = pdf_to_text(correct_file)
-              elif correct_file.name.endswith(".docx"):
-                  correct_answers_text = docx_to_text(correct_file)
+              files_digest += ":" + hashlib.sha256(correct_file.getvalue()).hexdigest()
 
-              correct_answers = [line.strip() for line in correct_answers_text.split("\n") if line.strip()]
-
-              # attach correct answers to data
-              for i, q in enumerate(data):
-                  if i < len(correct_answers):
-                      q["correct_answer"] = correct_answers[i]
+          parsed_upload = st.session_state.get("parsed_upload")
+          if parsed_upload and parsed_upload[0] == files_digest:
+              data = parsed_upload[1]
+          else:
+              # Parse student answers
+              if file_name.endswith(".pdf"):
+                  raw_text = pdf_to_text(uploaded_file)
+                  data = smart_parse_text_to_json(raw_text, max_score=max_score)
+              elif file_name.endswith(".docx"):
+                  raw_text = docx_to_text(uploaded_file)
+                  data = smart_parse_text_to_json(raw_text, max_score=max_score)
+              elif file_name.endswith(".json"):
+                  uploaded_file.seek(0)
+                  data = json.load(uploaded_file)
+              else:
+                  st.error("Unsupported file format.")
+                  st.stop()
+
+              # Parse optional correct answers file
+              if correct_file:
+                  answer_key = load_answer_key(correct_file, correct_file.name)
+                  if answer_key:
+                      # attach correct answers to data
+                      data = answer_key.apply(data)
+
+              st.session_state["parsed_upload"] = (files_digest, data)
 
           st.success(f"✅ Loaded {len(data)} questions")
 
-          with open("uploaded.json", "w", encoding="utf-8") as f:
-              json.dump(data, f, indent=2, ensure_ascii=False)
-
-          evaluate("uploaded.json", "graded_results.json", difficulty=difficulty, max_score=max_score)
-
-          with open("graded_results.json", "r", encoding="utf-8") as f:
-              results = json.load(f)
-
-          # --- Display results in a friendly table ---
-          df = pd.DataFrame(results)
-          if "feedback" not in df.columns:
-              df["feedback"] = ""
-          df["feedback_short"] = df["feedback"].astype(str).apply(
-              lambda x: x if len(x) <= 120 else x[:117] + "..."
-          )
-
-          st.subheader("🏷️ Grading Summary")
-          st.dataframe(
-              df[["question", "student_answer", "correct_answer", "model_score", "final_score", "feedback_short"]],
-              use_container_width=True
-          )
-
-          st.subheader("🔎 Detailed Feedback")
-          for idx, q in enumerate(results, start=1):
-              q_text = q.get("question", f"Question {idx}")
-              with st.expander(f"Question {idx}: {q_text}", expanded=False):
-                  st.markdown(f"**Student Answer:** {q.get('student_answer', '')}")
-                  st.markdown(f"**Correct Answer:** {q.get('correct_answer', '')}")
-                  st.markdown(f"**Model Score:** {q.get('model_score', '')}  —  **Final Score:** {q.get('final_score', '')}")
-                  st.markdown(f"**Feedback:** {q.get('feedback', 'No feedback available')}")
-                  if q.get("improvement_steps"):
-                      st.markdown("**🚀 Steps to Improve:**")
-                      for step in q.get("improvement_steps", []):
-                          st.markdown(f"- {step}")
-                  if q.get("keywords"):
-                      st.markdown(f"**🔑 Keywords:** {', '.join(q.get('keywords', []))}")
-                  if q.get("rule_score") is not None:
-                      st.markdown(f"**Rule-based Score:** {q.get('rule_score')}")
+          # --- Grade once per (uploads, difficulty, max_score); reruns just poll the job ---
+          upload_digest = f"{files_digest}:{difficulty}:{max_score}"
+          if st.session_state.get("upload_job_digest") != upload_digest:
+              if submit_incremental_grading("upload_job", data, difficulty, max_score):
+                  st.session_state["upload_job_digest"] = upload_digest
+
+          results = render_grading_job("upload_job")
+          if results:
+              render_detailed_feedback(results)
 
     elif upload_option == "☁️ Google Drive":
-      service = get_drive_service()
-      if service:
-          files = list_drive_files(service)
+      drive = get_drive_client()
+      if drive:
+          # One cached listing feeds both pickers; Refresh forces a full resync
+          refresh = st.button("🔄 Refresh file list")
+          files = list_drive_files(refresh=refresh)
           if not files:
               st.info("📂 No files found in your Google Drive folder. Please upload a file and refresh.")
           else:
@@ -463,7 +549,7 @@ if mode == "Grading Mode":
               selected_file = st.selectbox("Select a file from Google Drive", list(file_dict.keys()))
 
               st.subheader("Optional: Upload Correct Answers File (from Drive)")
-              files_correct = list_drive_files(service)
+              files_correct = files
               correct_file_id = None
               correct_selected = None
               if files_correct:
@@ -477,24 +563,23 @@ if mode == "Grading Mode":
 
               if st.button("Download & Evaluate from Drive"):
                   file_id = file_dict[selected_file]
-                  fh, downloaded_name, error = download_drive_file(service, file_id)
+                  # Student file and answer key are fetched concurrently, straight into memory
+                  downloads = drive.download_many([file_id, correct_file_id])
+                  fh, downloaded_name, error = downloads[file_id]
 
                   if fh:
-                      # Save & rewind
-                      with open(downloaded_name, "wb") as f:
-                          f.write(fh.read())
-                      fh.seek(0)
                       uploaded_file = fh
                       file_name = downloaded_name
                       st.success(f"✅ Downloaded {downloaded_name} successfully!")
 
                       # Parse student answers
+                      data = None
                       if file_name.endswith(".pdf"):
                           raw_text = pdf_to_text(uploaded_file)
-                          data = smart_parse_text_to_json(raw_text)
+                          data = smart_parse_text_to_json(raw_text, max_score=max_score)
                       elif file_name.endswith(".docx"):
                           raw_text = docx_to_text(uploaded_file)
-                          data = smart_parse_text_to_json(raw_text)
+                          data = smart_parse_text_to_json(raw_text, max_score=max_score)
                       elif file_name.endswith(".json"):
                           uploaded_file.seek(0)
                           data = json.load(uploaded_file)
@@ -502,201 +587,77 @@ if mode == "Grading Mode":
                           st.error("Unsupported file format.")
                           st.stop()
 
-                      # If optional correct answers file chosen
-                      if correct_file_id:
-                          fh_correct, correct_name, _ = download_drive_file(service, correct_file_id)
-                          if fh_correct:
-                              if correct_name.endswith(".pdf"):
-                                  correct_answers_text = pdf_to_text(fh_correct)
-                              elif correct_name.endswith(".docx"):
-                                  correct_answers_text = docx_to_text(fh_correct)
-
-                              correct_answers = [line.strip() for line in correct_answers_text.split("\n") if line.strip()]
-                              for i, q in enumerate(data):
-                                  if i < len(correct_answers):
-                                      q["correct_answer"] = correct_answers[i]
-
-                      # Save & evaluate using selected difficulty/max_score
-                      # Save & evaluate using selected difficulty/max_score
-                      with open("uploaded.json", "w", encoding="utf-8") as f:
-                          json.dump(data, f, indent=2, ensure_ascii=False)
-
-                      evaluate("uploaded.json", "graded_results.json",
-                              difficulty=difficulty, max_score=max_score)
-
-                      with open("graded_results.json", "r", encoding="utf-8") as f:
-                          results = json.load(f)
-
-                      # --- Display results in a friendly table ---
-                      df = pd.DataFrame(results)
-                      if "feedback" not in df.columns:
-                          df["feedback"] = ""
-                      df["feedback_short"] = df["feedback"].astype(str).apply(
-                          lambda x: x if len(x) <= 120 else x[:117] + "..."
-                      )
-
-                      st.subheader("🏷️ Grading Summary")
-                      st.dataframe(
-                          df[["question", "student_answer", "correct_answer", "model_score", "final_score", "feedback_short"]],
-                          use_container_width=True
-                      )
-
-                      st.subheader("🔎 Detailed Feedback")
-                      for idx, q in enumerate(results, start=1):
-                          q_text = q.get("question", f"Question {idx}")
-                          with st.expander(f"Question {idx}: {q_text}", expanded=False):
-                              st.markdown(f"**Student Answer:** {q.get('student_answer', '')}")
-                              st.markdown(f"**Correct Answer:** {q.get('correct_answer', '')}")
-                              st.markdown(f"**Model Score:** {q.get('model_score', '')}  —  **Final Score:** {q.get('final_score', '')}")
-                              st.markdown(f"**Feedback:** {q.get('feedback', 'No feedback available')}")
-                              if q.get("improvement_steps"):
-                                  st.markdown("**🚀 Steps to Improve:**")
-                                  for step in q.get("improvement_steps", []):
-                                      st.markdown(f"- {step}")
-                              if q.get("keywords"):
-                                  st.markdown(f"**🔑 Keywords:** {', '.join(q.get('keywords', []))}")
-                              if q.get("rule_score") is not None:
-                                  st.markdown(f"**Rule-based Score:** {q.get('rule_score')}")
-
-
-
-
-                          # Process file
-                      if uploaded_file and file_name:
-                          st.success(f"✅ Loaded: {file_name}")
-
-                          # --- Reset pointer and parse student file ---
-                          try:
-                              uploaded_file.seek(0)
-                          except Exception:
-                              pass
-
-                          raw_text = None
-                          data = None
-                          if file_name.endswith(".pdf"):
-                              raw_text = pdf_to_text(uploaded_file)
-                              data = smart_parse_text_to_json(raw_text)
-                          elif file_name.endswith(".docx"):
-                              raw_text = docx_to_text(uploaded_file)
-                              data = smart_parse_text_to_json(raw_text)
-                          elif file_name.endswith(".json"):
-                              data = json.load(uploaded_file)
-                          else:
-                              st.error("❌ Unsupported file format.")
-                              st.stop()
-
-                          if not data:
-                              st.error("⚠️ No questions found in the uploaded file.")
-                              st.stop()
-
-                          st.write(f"📄 Found **{len(data)} questions** in file.")
-                          if st.checkbox("🔍 Show raw extracted text") and raw_text:
-                              st.text_area("Extracted Text", raw_text, height=200)
-
-                          # --- Parse optional correct answers file ---
-                          correct_answers_json_path = None
-                          if correct_file:
-                              try:
-                                  correct_file.seek(0)
-                              except Exception:
-                                  pass
-
-                              if correct_file.name.endswith(".pdf"):
-                                  correct_answers_text = pdf_to_text(correct_file)
-                              elif correct_file.name.endswith(".docx"):
-                                  correct_answers_text = docx_to_text(correct_file)
-                              else:
-                                  st.error("❌ Unsupported correct answers file format.")
-                                  st.stop()
-
-                              correct_answers_list = []
-                              for i, line in enumerate(correct_answers_text.split("\n")):
-                                  line = line.strip()
-                                  if line:
-                                      correct_answers_list.append({
-                                          "question_id": f"Q{i+1}",
-                                          "correct_answer": line
-                                      })
-
-                              correct_answers_json_path = "correct_answers.json"
-                              with open(correct_answers_json_path, "w", encoding="utf-8") as f:
-                                  json.dump(correct_answers_list, f, indent=2, ensure_ascii=False)
-
-                              # Attach correct answers to student data in memory
-                              for q in data:
-                                  for ca in correct_answers_list:
-                                      if q["question_id"] == ca["question_id"]:
-                                          q["correct_answer"] = ca["correct_answer"]
-
-                          # --- Save student answers for evaluation ---
-                          input_path, output_path = "uploaded.json", "graded_results.json"
-                          with open(input_path, "w", encoding="utf-8") as f:
-                              json.dump(data, f, indent=2, ensure_ascii=False)
-
-                          # --- Run evaluation ---
-                          if correct_answers_json_path:
-                              evaluate(input_path, output_path, difficulty=difficulty, max_score=max_score, correct_answers_file=correct_answers_json_path)
-                          else:
-                              evaluate(input_path, output_path, difficulty=difficulty, max_score=max_score)
-
-                          # --- Load results and display ---
-                          with open(output_path, "r", encoding="utf-8") as f:
-                              results = json.load(f)
-
-                          df = pd.DataFrame(results)
-                          if "feedback" not in df.columns:
-                              df["feedback"] = ""
-                          df["feedback_short"] = df["feedback"].astype(str).apply(
-                              lambda x: x if len(x) <= 120 else x[:117] + "..."
-                          )
-
-                          st.subheader("🏷️ Grading Summary")
-                          st.dataframe(
-                              df[["question", "student_answer", "correct_answer", "model_score", "final_score", "feedback_short"]],
-                              use_container_width=True
-                          )
-
-                          st.subheader("🔎 Detailed Feedback")
-                          for idx, q in enumerate(results, start=1):
-                              q_text = q.get("question", f"Question {idx}")
-                              with st.expander(f"Question {idx}: {q_text}", expanded=False):
-                                  st.markdown(f"**Student Answer:** {q.get('student_answer', '')}")
-                                  st.markdown(f"**Correct Answer:** {q.get('correct_answer', '')}")
-                                  st.markdown(f"**Model Score:** {q.get('model_score', '')}  —  **Final Score:** {q.get('final_score', '')}")
-                                  st.markdown(f"**Feedback:** {q.get('feedback', 'No feedback available')}")
-                                  if q.get("improvement_steps"):
-                                      st.markdown("**🚀 Steps to Improve:**")
-                                      for step in q.get("improvement_steps", []):
-                                          st.markdown(f"- {step}")
-                                  if q.get("keywords"):
-                                      st.markdown(f"**🔑 Keywords:** {', '.join(q.get('keywords', []))}")
-                                  if q.get("rule_score") is not None:
-                                      st.markdown(f"**Rule-based Score:** {q.get('rule_score')}")
-
-                          st.subheader("📥 Export Results")
-                          try:
-                              docx_buffer = generate_docx(results, max_score)
-                              st.download_button(
-                                  label="📘 Download DOCX Report",
-                                  data=docx_buffer,
-                                  file_name="graded_results.docx",
-                                  mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                              )
-                          except Exception as e:
-                              st.warning(f"⚠️ DOCX generation skipped: {e}")
-
-                          try:
-                              pdf_buffer = generate_pdf(results, max_score)
-                              st.download_button(
-                                  label="📄 Download PDF Report",
-                                  data=pdf_buffer,
-                                  file_name="graded_results.pdf",
-                                  mime="application/pdf"
-                              )
-                          except Exception as e:
-                              st.warning(f"⚠️ PDF generation skipped: {e}")
+                      if not data:
+                          st.error("⚠️ No questions found in the uploaded file.")
+                          st.stop()
 
+                      st.write(f"📄 Found **{len(data)} questions** in file.")
 
+                      # If optional correct answers file chosen
+                      if correct_file_id:
+                          fh_correct, correct_name, _ = downloads[correct_file_id]
+                          answer_key = load_answer_key(fh_correct, correct_name) if fh_correct else None
+                          if answer_key:
+                              data = answer_key.apply(data)
+
+                      # Queue evaluation using selected difficulty/max_score
+                      submit_incremental_grading("drive_job", data, difficulty, max_score)
+                  elif error:
+                      st.error(f"❌ Download failed: {error}")
+
+              # The job outlives this button click, so results survive reruns
+              results = render_grading_job("drive_job")
+              if results:
+                  render_detailed_feedback(results)
+                  render_export_buttons(results, max_score)
+
+    elif upload_option == "🗂️ Drive Folder":
+      drive = get_drive_client()
+      refresh = st.button("🔄 Refresh folder list")
+      try:
+          folders = [f for f in drive.list_files(refresh=refresh) if f.get("mimeType") == FOLDER_MIME]
+      except Exception as e:
+          st.error(f"⚠️ Could not list folders: {e}")
+          folders = []
+      if not folders:
+          st.info("📂 No folders found in your Google Drive. Share a folder of submissions and refresh.")
+      else:
+          folder_dict = {f["name"]: f["id"] for f in folders}
+          selected_folder = st.selectbox("Select the folder of student submissions", list(folder_dict.keys()))
+          documents = [
+              f for f in drive.list_files(folder_id=folder_dict[selected_folder], refresh=refresh)
+              if f.get("name", "").lower().endswith(SUBMISSION_EXTENSIONS)
+          ]
+          st.write(f"📄 Found **{len(documents)} submissions** in folder.")
+
+          key_names = {f["name"]: f["id"] for f in documents if not f["name"].lower().endswith(".json")}
+          key_selected = st.selectbox("Answer key in this folder (optional)", ["None"] + list(key_names.keys()))
+          answer_key_id = key_names.get(key_selected)
+
+          if st.button("Grade Whole Folder") and documents:
+              answer_key = None
+              if answer_key_id:
+                  # Built once per exam and shared by every submission
+                  fh_key, key_name, error = drive.download(answer_key_id)
+                  if error:
+                      st.error(f"❌ Answer key download failed: {error}")
+                      st.stop()
+                  answer_key = load_answer_key(fh_key, key_name)
+                  if answer_key is None:
+                      st.stop()
+              submissions = [f for f in documents if f["id"] != answer_key_id]
+              # Parsed on worker threads, so use the parser without Streamlit calls:
+              # its errors are reported per paper in the job's results
+              job_id = job_manager.submit_folder(
+                  drive, submissions, parse_document, answer_key=answer_key,
+                  difficulty=difficulty, max_score=max_score
+              )
+              if job_id is None:
+                  st.warning("⚠️ The grading queue is full right now. Please try again in a moment.")
+              else:
+                  st.session_state["folder_job"] = job_id
+
+          render_folder_job("folder_job")
 
 
 # ---------------------------
@@ -721,15 +682,10 @@ elif mode == "Companion Mode":
         file = st.file_uploader("Upload a JSON, PDF, or DOCX file", type=["json", "pdf", "docx"])
         if file:
             st.success(f"✅ Uploaded: {file.name}")
-            if file.name.endswith(".pdf"):
-                raw_text = pdf_to_text(file)
-                parsed = smart_parse_text_to_json(raw_text)
-            elif file.name.endswith(".docx"):
-                raw_text = docx_to_text(file)
-                parsed = smart_parse_text_to_json(raw_text)
-            elif file.name.endswith(".json"):
-                parsed = json.load(file)
-            else:
+            # Extraction and parsing are served from the document cache on reruns
+            try:
+                parsed = parse_submission(file, file.name)
+            except ValueError:
                 parsed = []
 
             if parsed:
@@ -748,8 +704,23 @@ elif mode == "Companion Mode":
         if not question or not student_answer:
             st.warning("Please provide a question and your answer.")
         else:
-            with st.spinner("Generating feedback..."):
-                result = companion_feedback(question, student_answer, correct_answer, max_score)
+            job_id = job_manager.submit_companion(question, student_answer, correct_answer, max_score)
+            if job_id is None:
+                st.warning("⚠️ The grading queue is full right now. Please try again in a moment.")
+            else:
+                st.session_state["companion_job"] = job_id
+
+    companion_job = job_manager.get(st.session_state.get("companion_job", ""))
+    if companion_job is not None:
+        if not companion_job.finished:
+            st.info("⏳ Generating feedback...")
+            poll_until_finished(companion_job, "companion_job")
+        elif companion_job.status == FAILED:
+            st.error(f"❌ Feedback generation failed: {companion_job.error}")
+        elif companion_job.status == DONE:
+            result = companion_job.results[0]
+            question = companion_job.items[0]["question"]
+            student_answer = companion_job.items[0]["student_answer"]
 
             feedback = result.get("feedback", "").replace(question, "").replace(student_answer, "")
             st.subheader("📢 Feedback")
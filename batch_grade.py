@@ -0,0 +1,166 @@
+"""
+Headless batch grading of a directory of submissions.
+
+    python batch_grade.py submissions/ --answer-key key.pdf --output results.jsonl --workers 2
+
+Every PDF/DOCX/JSON file in the directory is one student's submission.
+Submissions are graded on worker processes (each loads its own copy of the
+model) and one JSON line per student is written as soon as it is graded,
+so partial results survive an interrupted run. A throughput summary is
+printed to stderr at the end; --metrics also writes the per-stage timings
+(from every worker) in the Prometheus text format.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from answer_key import answer_key_from_document
+from folder_grading import SUBMISSION_EXTENSIONS, class_summary, summarise_student
+from metrics import metrics
+
+# Set in each worker process by _init_worker
+_settings = None
+
+
+def _init_worker(settings):
+    global _settings
+    _settings = settings
+
+
+def grade_submission(path, settings=None):
+    """Grade one submission file; returns the per-student result (never raises)."""
+    from day6_grader import evaluate_records
+    from doc_extract import parse_document
+
+    settings = settings or _settings
+    file = {"id": path, "name": os.path.basename(path)}
+    try:
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            data = parse_document(f, file["name"].lower(), max_score=settings["max_score"])
+        if not data:
+            raise ValueError("No questions found in the file.")
+        if settings["answer_key"] is not None:
+            data = settings["answer_key"].apply(data)
+        parsed_at = time.perf_counter()
+        entries = evaluate_records(data, settings["difficulty"], settings["max_score"], batch_size=settings["batch_size"])
+        return summarise_student(file, entries, elapsed_seconds=time.perf_counter() - parsed_at,
+                                 parse_seconds=parsed_at - start)
+    except Exception as e:
+        return summarise_student(file, None, str(e))
+
+
+def _grade_in_worker(path):
+    """grade_submission on a worker process, plus that worker's metrics since its last submission."""
+    return grade_submission(path), metrics.drain()
+
+
+def find_submissions(directory, exclude=None):
+    exclude = os.path.abspath(exclude) if exclude else None
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and name.lower().endswith(SUBMISSION_EXTENSIONS) and os.path.abspath(path) != exclude:
+            paths.append(path)
+    return paths
+
+
+def run(paths, settings, output, workers):
+    """Grade paths, streaming one JSON line per student to output; returns the per-student results."""
+    results = []
+
+    def write(result):
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+        results.append(result)
+        if result["status"] == "graded":
+            outcome = f"✅ {result['total_score']}/{result['max_total']}"
+        else:
+            outcome = f"❌ {result['error']}"
+        print(f"[{len(results)}/{len(paths)}] {result['file_name']}: {outcome}", file=sys.stderr)
+
+    if workers <= 1:
+        for path in paths:
+            write(grade_submission(path, settings))
+        return results
+
+    # spawn: every worker initialises CUDA/torch on its own
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(settings,)) as pool:
+        futures = [pool.submit(_grade_in_worker, path) for path in paths]
+        for future in as_completed(futures):
+            result, worker_metrics = future.result()
+            metrics.merge(worker_metrics)
+            write(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade a directory of submissions to JSONL.")
+    parser.add_argument("submissions", help="directory of PDF/DOCX/JSON submissions, one per student")
+    parser.add_argument("--answer-key", help="answer key file (PDF/DOCX/JSON); skipped if it is inside the directory")
+    parser.add_argument("--output", default="graded_results.jsonl", help="JSONL file, one line per student")
+    parser.add_argument("--summary", help="optional JSON file for the class summary and throughput")
+    parser.add_argument("--metrics", help="optional file for per-stage metrics in the Prometheus text format")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (each loads the model)")
+    parser.add_argument("--difficulty", default="medium", choices=["easy", "medium", "hard"])
+    parser.add_argument("--max-score", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=8, help="questions per model.generate call")
+    args = parser.parse_args(argv)
+
+    answer_key = None
+    if args.answer_key:
+        with open(args.answer_key, "rb") as f:
+            answer_key = answer_key_from_document(f, args.answer_key.lower())
+
+    paths = find_submissions(args.submissions, exclude=args.answer_key)
+    if not paths:
+        print(f"🚨 No submissions found in {args.submissions}", file=sys.stderr)
+        return 1
+
+    settings = {
+        "answer_key": answer_key,
+        "difficulty": args.difficulty,
+        "max_score": args.max_score,
+        "batch_size": args.batch_size
+    }
+    start = time.time()
+    with open(args.output, "w", encoding="utf-8") as output:
+        results = run(paths, settings, output, args.workers)
+    elapsed = time.time() - start
+
+    questions = sum(len(r["results"]) for r in results)
+    failed = sum(1 for r in results if r["status"] == "failed")
+    summary = class_summary(results)
+    summary["throughput"] = {
+        "submissions": len(results),
+        "failed": failed,
+        "questions": questions,
+        "workers": args.workers,
+        "elapsed_seconds": round(elapsed, 2),
+        "submissions_per_minute": round(60 * len(results) / elapsed, 2) if elapsed else None,
+        "questions_per_second": round(questions / elapsed, 3) if elapsed else None,
+        "generated_tokens": sum((r["metrics"] or {}).get("generated_tokens", 0) for r in results),
+        "stages": metrics.snapshot()["stages"]
+    }
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(metrics.prometheus_text())
+
+    t = summary["throughput"]
+    print(f"✅ Graded {t['submissions'] - failed}/{t['submissions']} submissions ({questions} questions) "
+          f"in {t['elapsed_seconds']}s with {args.workers} worker(s): "
+          f"{t['submissions_per_minute']} submissions/min, {t['questions_per_second']} questions/s. "
+          f"Class mean: {summary['mean_percentage']}%. Results: {args.output}", file=sys.stderr)
+    return 0 if not failed else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
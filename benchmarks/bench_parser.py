@@ -0,0 +1,131 @@
+"""
+Benchmark the question parser on large synthetic answer scripts.
+
+Compares question_parser against the original line-by-line parser (kept
+here as a reference), checks both produce the same questions, and reports
+throughput per size so non-linear growth shows up immediately.
+
+    python benchmarks/bench_parser.py --questions 100 1000 10000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from question_parser import iter_questions, parse_questions  # noqa: E402
+
+CORE_KEYS = ("question_id", "question", "student_answer")
+
+
+def legacy_detect_question(line):
+    keywords = [
+        r'\bdefine\b', r'\bdescribe\b', r'\bshow\b', r'\billustrate\b',
+        r'\belaborate\b', r'\bexplain\b', r'\bgive\b',
+        r'\bwho\b', r'\bwhat\b', r'\bwhere\b', r'\bwhen\b', r'\bwhy\b', r'\bhow\b'
+    ]
+    pattern = r'(\?$|:\s*$|' + "|".join(keywords) + r')'
+    return re.search(pattern, line.strip(), flags=re.IGNORECASE)
+
+
+def legacy_parse(raw_text):
+    raw_text = re.sub(r'\n+', '\n', raw_text.strip())
+    questions, current_q, current_a = [], None, []
+    for line in raw_text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if legacy_detect_question(line) or re.match(r'^\d+[\).]', line):
+            if current_q:
+                questions.append({"question_id": f"Q{len(questions)+1}", "question": current_q,
+                                  "student_answer": " ".join(current_a).strip()})
+            current_q, current_a = line, []
+        else:
+            current_a.append(line)
+    if current_q:
+        questions.append({"question_id": f"Q{len(questions)+1}", "question": current_q,
+                          "student_answer": " ".join(current_a).strip()})
+    return questions
+
+
+FILLER = (
+    "the force acting on the body is equal to mass times acceleration",
+    "energy is conserved in a closed system so the total remains constant",
+    "photosynthesis converts light energy into chemical energy in plants",
+    "the reaction is exothermic because heat is released to the surroundings",
+)
+
+
+def synthetic_paper(num_questions, answer_lines=4, seed=0):
+    """Numbered questions, each followed by a few answer lines, split into pages of ~20 questions."""
+    rng = random.Random(seed)
+    pages, lines = [], []
+    for n in range(1, num_questions + 1):
+        lines.append(f"{n}) Explain concept number {n} in your own words?")
+        lines.extend(rng.choice(FILLER) + f" ({n}.{i})" for i in range(answer_lines))
+        lines.append("")
+        if n % 20 == 0:
+            pages.append("\n".join(lines))
+            lines = []
+    if lines:
+        pages.append("\n".join(lines))
+    return pages
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run(sizes, repeat):
+    rows = []
+    for size in sizes:
+        pages = synthetic_paper(size)
+        text = "\n".join(pages)
+        mb = len(text.encode("utf-8")) / (1024 * 1024)
+
+        legacy_time, legacy = best_of(lambda: legacy_parse(text), repeat)
+        new_time, parsed = best_of(lambda: parse_questions(text), repeat)
+        stream_time, streamed = best_of(lambda: list(iter_questions(pages)), repeat)
+
+        same = [{k: q[k] for k in CORE_KEYS} for q in parsed] == legacy and streamed == parsed
+        rows.append({
+            "questions": size,
+            "mb": round(mb, 3),
+            "legacy_s": round(legacy_time, 4),
+            "parser_s": round(new_time, 4),
+            "streaming_s": round(stream_time, 4),
+            "parser_mb_per_s": round(mb / new_time, 1) if new_time else None,
+            "speedup": round(legacy_time / new_time, 2) if new_time else None,
+            "same_output": same
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--questions", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rows = run(args.questions, args.repeat)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'questions':>10} {'MB':>8} {'legacy s':>10} {'parser s':>10} {'stream s':>10} {'MB/s':>8} {'speedup':>8} same")
+    for r in rows:
+        print(f"{r['questions']:>10} {r['mb']:>8} {r['legacy_s']:>10} {r['parser_s']:>10} {r['streaming_s']:>10} "
+              f"{r['parser_mb_per_s']:>8} {r['speedup']:>8} {r['same_output']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""
+Benchmark the whole grading pipeline on synthetic exams with a fake model.
+
+Generates papers of a configurable size, plus their answer key, as JSON,
+PDF and DOCX. Every stage then runs on them:
+
+- PDF/DOCX text extraction
+- question parsing (extracted text and JSON submissions)
+- answer key alignment
+- grading with evaluate(), backed by the deterministic fake model from
+  fake_backend.py instead of Phi-3.5. By default this runs the app's own
+  decoding path: prefix KV cache, continuous batching scheduler and
+  schema-constrained decoding. --no-scheduler and --unconstrained switch
+  to the padded generate() path and to free-form output, so each path
+  gets its own baseline
+- DOCX/PDF report generation
+
+Each stage records throughput, latency percentiles and peak Python memory.
+The internal stage timings from metrics.py go into the same JSON file.
+With --compare, the run fails when a stage is slower than an earlier
+baseline by more than --max-regression.
+
+    python benchmarks/bench_pipeline.py --papers 20 --questions 25 --output baseline.json
+    python benchmarks/bench_pipeline.py --compare baseline.json --output latest.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE_VERSION = 2
+# The fake tokenizer has one token per character, about four times as many as Phi-3.5's
+FAKE_TOKENS_PER_TOKEN = 4
+
+TOPICS = (
+    ("the unit of force", "newton"),
+    ("the chemical symbol of sodium", "Na"),
+    ("the value of g in m/s2", "9.8"),
+    ("the boiling point of water in celsius", "100"),
+    ("the powerhouse of the cell", "mitochondria"),
+    ("the process plants use to make food", "photosynthesis"),
+)
+FILLER = (
+    "the force acting on the body is equal to mass times acceleration",
+    "energy is conserved in a closed system so the total remains constant",
+    "photosynthesis converts light energy into chemical energy in plants",
+    "the reaction is exothermic because heat is released to the surroundings",
+)
+
+
+# ---------------------------
+# Synthetic Exams
+# ---------------------------
+def synthetic_exam(num_questions, seed=0):
+    """Questions with their key answers: short facts, numbers and open explanations."""
+    rng = random.Random(seed)
+    exam = []
+    for n in range(1, num_questions + 1):
+        if rng.random() < 0.5:
+            topic, answer = rng.choice(TOPICS)
+            exam.append((f"{n}) What is {topic}?", answer))
+        else:
+            exam.append((f"{n}) Explain concept number {n} in your own words?", " ".join(rng.sample(FILLER, 2))))
+    return exam
+
+
+def synthetic_answers(exam, seed):
+    """One student's answers: some exact, some numeric near misses, some free text of varying length."""
+    rng = random.Random(seed)
+    answers = []
+    for _, key in exam:
+        roll = rng.random()
+        if roll < 0.3:
+            answers.append(key)
+        elif roll < 0.45 and key.replace(".", "").isdigit():
+            answers.append(str(round(float(key) * rng.uniform(0.9, 1.1), 2)))
+        else:
+            answers.append(" ".join(rng.choice(FILLER) for _ in range(rng.randint(1, 6))))
+    return answers
+
+
+def paper_text(exam, answers):
+    return "\n".join(f"{question}\n{answer}\n" for (question, _), answer in zip(exam, answers))
+
+
+def key_text(exam):
+    return "\n".join(f"{question.split(')')[0]}) {answer}" for question, answer in exam)
+
+
+def paper_records(exam, answers):
+    return [
+        {"question_id": f"Q{n}", "question": question, "student_answer": answer}
+        for n, ((question, _), answer) in enumerate(zip(exam, answers), start=1)
+    ]
+
+
+def text_to_pdf(text):
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate
+
+    buffer = BytesIO()
+    styles = getSampleStyleSheet()
+    SimpleDocTemplate(buffer).build([Paragraph(line or "&nbsp;", styles["Normal"]) for line in text.split("\n")])
+    return buffer.getvalue()
+
+
+def text_to_docx(text):
+    from docx import Document
+
+    doc = Document()
+    for line in text.split("\n"):
+        doc.add_paragraph(line)
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def build_papers(num_papers, num_questions, seed):
+    exam = synthetic_exam(num_questions, seed)
+    papers = []
+    for idx in range(num_papers):
+        answers = synthetic_answers(exam, seed * 100_003 + idx)
+        text = paper_text(exam, answers)
+        papers.append({
+            "name": f"student_{idx + 1:03d}",
+            "json": json.dumps(paper_records(exam, answers)).encode("utf-8"),
+            "pdf": text_to_pdf(text),
+            "docx": text_to_docx(text)
+        })
+    return exam, papers
+
+# ---------------------------
+# Measurement
+# ---------------------------
+def percentile(values, pct):
+    """Nearest-rank percentile of values."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def run_stage(name, items, fn, memory_items=2, before_memory=None):
+    """
+    Time fn(item) for every item, then trace Python allocations over the first memory_items.
+
+    Returns (stage stats, list of fn results). before_memory() runs ahead of the traced
+    pass (e.g. to clear a cache the timed pass has filled).
+    """
+    outputs, latencies = [], []
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        outputs.append(fn(item))
+        latencies.append(time.perf_counter() - item_start)
+    total = time.perf_counter() - start
+
+    peak = None
+    if memory_items:
+        if before_memory:
+            before_memory()
+        tracemalloc.start()
+        for item in items[:memory_items]:
+            fn(item)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    stats = {
+        "items": len(items),
+        "total_seconds": round(total, 4),
+        "items_per_second": round(len(items) / total, 3) if total else None,
+        "latency_ms": {
+            f"p{pct}": round(1000 * percentile(latencies, pct), 3) for pct in (50, 90, 99)
+        },
+        "max_latency_ms": round(1000 * max(latencies), 3) if latencies else None,
+        "peak_python_mb": round(peak / (1024 * 1024), 3) if peak is not None else None
+    }
+    print(f"  {name:<14} {stats['items_per_second']:>10} items/s  p50 {stats['latency_ms']['p50']:>9} ms  "
+          f"p99 {stats['latency_ms']['p99']:>9} ms  peak {stats['peak_python_mb']} MB", file=sys.stderr)
+    return stats, outputs
+
+
+def run(args, workdir):
+    from fake_backend import configure
+
+    configure(token_ms=args.token_ms, prefill_us=args.prefill_us, malformed_rate=args.malformed_rate, seed=args.seed)
+
+    from answer_key import AnswerKey
+    from day6_grader import TOKEN_BUDGETS, evaluate, generation_stats, get_model, result_cache
+    from doc_extract import extract_docx_text, extract_pdf_text, parse_document, smart_parse_text_to_json
+    from metrics import metrics
+    from reports import generate_docx, generate_pdf
+
+    print(f"Generating {args.papers} papers x {args.questions} questions...", file=sys.stderr)
+    exam, papers = build_papers(args.papers, args.questions, args.seed)
+    answer_key = AnswerKey.from_text(key_text(exam))
+    get_model()  # load up front, so it doesn't count as grading time
+    for budget_class in TOKEN_BUDGETS:
+        TOKEN_BUDGETS[budget_class] *= FAKE_TOKENS_PER_TOKEN
+
+    stages = {}
+    mem = args.memory_papers
+    stages["extract_pdf"], pdf_texts = run_stage(
+        "extract_pdf", papers, lambda p: extract_pdf_text(p["pdf"], use_cache=False), mem)
+    stages["extract_docx"], _ = run_stage(
+        "extract_docx", papers, lambda p: extract_docx_text(p["docx"], use_cache=False), mem)
+    stages["parse"], parsed = run_stage(
+        "parse", pdf_texts, lambda text: smart_parse_text_to_json(text, use_cache=False), mem)
+    stages["parse_json"], _ = run_stage(
+        "parse_json", papers, lambda p: parse_document(BytesIO(p["json"]), "paper.json"), mem)
+    stages["answer_key"], aligned = run_stage("answer_key", parsed, answer_key.apply, mem)
+
+    def grade(data):
+        path = os.path.join(workdir, "paper.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        return evaluate(path, os.path.join(workdir, "graded.json"), difficulty=args.difficulty, max_score=args.max_score,
+                        batch_size=args.batch_size)
+
+    metrics.drain()  # only grading-related internal timings from here on
+    stages["grade"], graded = run_stage("grade", aligned, grade, mem, before_memory=result_cache.clear)
+    questions = sum(len(entries) for entries in graded)
+    stages["grade"]["questions_per_second"] = round(questions / stages["grade"]["total_seconds"], 3)
+    pipeline = metrics.snapshot()
+    generation = generation_stats()
+
+    stages["report_docx"], _ = run_stage("report_docx", graded, lambda r: generate_docx(r, args.max_score), mem)
+    stages["report_pdf"], _ = run_stage("report_pdf", graded, lambda r: generate_pdf(r, args.max_score), mem)
+
+    return {
+        "version": BASELINE_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "papers": args.papers,
+            "questions": args.questions,
+            "token_ms": args.token_ms,
+            "prefill_us": args.prefill_us,
+            "malformed_rate": args.malformed_rate,
+            "batch_size": args.batch_size,
+            "difficulty": args.difficulty,
+            "seed": args.seed,
+            "continuous_batching": not args.no_scheduler,
+            "constrained_decoding": not args.unconstrained
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "peak_rss_mb": _peak_rss_mb()
+        },
+        "stages": stages,
+        "pipeline_stages": pipeline["stages"],
+        "pipeline_rates": pipeline["rates"],
+        "generation": {
+            "padding_ratio": generation["padding_ratio"],
+            "budgets": generation["budgets"],
+            "scheduler": generation.get("scheduler")
+        }
+    }
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    except Exception:
+        return None
+
+
+def compare(current, baseline, max_regression):
+    """Stages whose throughput dropped or p90 latency grew by more than max_regression (a fraction)."""
+    if baseline.get("config") != current["config"]:
+        print("⚠️ Baseline was recorded with a different configuration; comparing anyway.", file=sys.stderr)
+    regressions = []
+    for name, stats in current["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old:
+            continue
+        if old["items_per_second"] and stats["items_per_second"] < old["items_per_second"] * (1 - max_regression):
+            regressions.append(f"{name}: {stats['items_per_second']} items/s vs {old['items_per_second']} in the baseline")
+        old_p90, new_p90 = old["latency_ms"]["p90"], stats["latency_ms"]["p90"]
+        if old_p90 and new_p90 > old_p90 * (1 + max_regression):
+            regressions.append(f"{name}: p90 {new_p90} ms vs {old_p90} ms in the baseline")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--papers", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=25, help="questions per paper")
+    parser.add_argument("--token-ms", type=float, default=1.0, help="fake model decode latency per token")
+    parser.add_argument("--prefill-us", type=float, default=20.0, help="fake model prefill latency per prompt token")
+    parser.add_argument("--malformed-rate", type=float, default=0.05, help="fraction of fake outputs that are not JSON")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--difficulty", default="medium", choices=["easy", "medium", "hard"])
+    parser.add_argument("--max-score", type=int, default=5)
+    parser.add_argument("--memory-papers", type=int, default=2, help="papers re-run under tracemalloc per stage (0 = skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-scheduler", action="store_true", help="padded generate() calls instead of continuous batching")
+    parser.add_argument("--unconstrained", action="store_true", help="turn off schema-constrained decoding")
+    parser.add_argument("--output", default="bench_pipeline.json", help="machine-readable results (baseline) file")
+    parser.add_argument("--compare", help="earlier results file to check for regressions")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed slowdown per stage, as a fraction")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own output (raw model output etc.)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="xaminai-bench-") as workdir:
+        # Before any pipeline import: fake model, and a cold cache that is thrown away afterwards
+        os.environ["XAMINAI_BACKEND"] = "fake"
+        os.environ["XAMINAI_CACHE_DIR"] = os.path.join(workdir, "cache")
+        os.environ["XAMINAI_CONTINUOUS_BATCHING"] = "0" if args.no_scheduler else "1"
+        os.environ["XAMINAI_CONSTRAINED_DECODING"] = "0" if args.unconstrained else "1"
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            results = run(args, workdir)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"✅ Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"❌ Regression in {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"✅ No stage regressed by more than {args.max_regression:.0%} against {args.compare}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
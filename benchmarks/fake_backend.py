@@ -0,0 +1,198 @@
+"""
+Deterministic stand-in for Phi-3.5, so the pipeline can be benchmarked without downloading weights.
+
+Importing this module registers FakeBackend as the "fake" inference
+backend; select it with XAMINAI_BACKEND=fake (set before day6_grader is
+imported). Its model answers each prompt with a grading or companion JSON
+derived from a hash of the prompt. A configurable fraction of answers is
+malformed prose, so the retry path (or, with constrained decoding, the
+schema processor) gets exercised too.
+
+The model implements forward() with a stub KV cache (one layer that
+stores the token ids seen so far and whether each was prompt or output),
+so it goes through the same code as a real model: the prefix KV cache,
+the continuous batching scheduler and the schema logits processor.
+generate() is a plain greedy loop over forward() that honours
+logits_processor and stopping_criteria. forward() sleeps a configurable
+time per prefilled prompt token, and once per decode step for the whole
+batch (as on a memory-bound CPU).
+"""
+import hashlib
+import random
+import re
+import string
+import time
+from types import SimpleNamespace
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+
+from inference_backends import BACKENDS, Backend
+from inference_scheduler import cache_to_layers, layers_to_cache
+
+MAX_SCORE_RE = re.compile(r"Max Score:\s*(\d+)")
+FEEDBACK_PHRASES = (
+    "The answer covers the main idea",
+    "but misses a key step in the reasoning",
+    "and the units are used correctly",
+    "though the definition could be more precise",
+    "with a clear and well structured explanation",
+    "and mentions the relevant law by name",
+)
+PROMPT, OUTPUT = 1.0, 2.0  # role of each position in the stub KV cache
+TARGET_LOGIT = 10.0
+# When the schema processor rules out the answer's next character, prefer closing the object
+CLOSING_LOGIT = 1.0
+
+
+def fake_tokenizer():
+    """One token per printable ASCII character; left padding like the real tokenizer."""
+    vocab = {"<pad>": 0, "<eos>": 1, "<unk>": 2}
+    for ch in string.printable:
+        vocab.setdefault(ch, len(vocab))
+    tok = Tokenizer(models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    tok.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    tok.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tok, pad_token="<pad>", eos_token="<eos>", unk_token="<unk>")
+    tokenizer.padding_side = "left"
+    return tokenizer
+
+
+class FakeModel:
+    """Stands in for AutoModelForCausalLM: forward() and greedy generate() with canned, deterministic answers."""
+
+    def __init__(self, tokenizer, token_latency, prefill_latency, malformed_rate, seed):
+        self.tokenizer = tokenizer
+        self.token_latency = token_latency
+        self.prefill_latency = prefill_latency
+        self.malformed_rate = malformed_rate
+        self.seed = seed
+        self.generation_config = SimpleNamespace(eos_token_id=tokenizer.eos_token_id)
+        self.vocab_size = len(tokenizer)
+        self._answers = {}
+        self._base_logits = torch.zeros(self.vocab_size)
+        for ch in '"}':
+            self._base_logits[tokenizer.convert_tokens_to_ids(ch)] = CLOSING_LOGIT
+
+    def respond(self, prompt):
+        """The model's full answer to prompt."""
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        feedback = " ".join(rng.sample(FEEDBACK_PHRASES, rng.randint(1, 3))) + "."
+
+        if rng.random() < self.malformed_rate:
+            # Prose instead of JSON: safe_json_extract fails and the question is retried
+            return f"Score: {rng.randint(0, 5)}. {feedback}"
+
+        if "improvement_steps" in prompt:
+            return (f'{{"feedback": "{feedback}", "keywords": ["concept", "units"], '
+                    f'"improvement_steps": ["Revise the definition"]}}')
+        scores = MAX_SCORE_RE.findall(prompt)
+        max_score = int(scores[-1]) if scores else 5
+        return f'{{"score": {rng.randint(0, max_score)}, "feedback": "{feedback}"}}'
+
+    def _answer_ids(self, prompt_ids):
+        key = tuple(prompt_ids)
+        ids = self._answers.get(key)
+        if ids is None:
+            prompt = self.tokenizer.decode(prompt_ids, skip_special_tokens=True)
+            ids = self.tokenizer(self.respond(prompt), add_special_tokens=False)["input_ids"]
+            ids = self._answers[key] = ids + [self.tokenizer.eos_token_id]
+        return ids
+
+    def __call__(self, **kwargs):
+        return self.forward(**kwargs)
+
+    def forward(self, input_ids, attention_mask=None, past_key_values=None, use_cache=True, **kwargs):
+        """
+        Logits for the next token of every row, plus the stub KV cache extended by input_ids.
+
+        A call feeding a single token on top of a cache is a decode step; any
+        other call (no cache, or several tokens after a cached prefix) is prefill.
+        """
+        batch, width = input_ids.shape
+        if past_key_values is not None:
+            (past_ids, past_roles), = cache_to_layers(past_key_values)
+        else:
+            past_ids = past_roles = torch.zeros((batch, 1, 0, 1))
+        decoding = past_ids.shape[2] > 0 and width == 1
+
+        ids = torch.cat([past_ids, input_ids.float()[:, None, :, None]], dim=2)
+        roles = torch.cat([past_roles, torch.full((batch, 1, width, 1), OUTPUT if decoding else PROMPT)], dim=2)
+        if attention_mask is None:
+            attention_mask = torch.ones((batch, ids.shape[2]), dtype=torch.long)
+
+        logits = torch.zeros((batch, width, self.vocab_size))
+        for row in range(batch):
+            real = attention_mask[row].bool()
+            row_ids = ids[row, 0, :, 0][real].long().tolist()
+            row_roles = roles[row, 0, :, 0][real].tolist()
+            answer = self._answer_ids([t for t, role in zip(row_ids, row_roles) if role == PROMPT])
+            written = sum(1 for role in row_roles if role == OUTPUT)
+            logits[row, -1] = self._base_logits
+            logits[row, -1, answer[min(written, len(answer) - 1)]] = TARGET_LOGIT
+
+        if decoding:
+            time.sleep(self.token_latency)
+        else:
+            time.sleep(self.prefill_latency * int(attention_mask[:, -width:].sum()))
+        return SimpleNamespace(logits=logits, past_key_values=layers_to_cache([(ids, roles)]) if use_cache else None)
+
+    def generate(self, input_ids, attention_mask=None, max_new_tokens=200, logits_processor=None,
+                 stopping_criteria=None, past_key_values=None, pad_token_id=None, **kwargs):
+        """Greedy decoding over forward(), like model.generate(do_sample=False)."""
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        pad_token_id = self.tokenizer.pad_token_id if pad_token_id is None else pad_token_id
+        cached = cache_to_layers(past_key_values)[0][0].shape[2] if past_key_values is not None else 0
+
+        outputs = self.forward(input_ids=input_ids[:, cached:], attention_mask=attention_mask,
+                               past_key_values=past_key_values)
+        sequences = input_ids
+        unfinished = torch.ones(input_ids.shape[0], dtype=torch.bool)
+        for _ in range(max_new_tokens):
+            scores = outputs.logits[:, -1, :]
+            if logits_processor:
+                scores = logits_processor(sequences, scores)
+            next_tokens = torch.where(unfinished, scores.argmax(-1), torch.full_like(unfinished, pad_token_id, dtype=torch.long))
+            sequences = torch.cat([sequences, next_tokens[:, None]], dim=1)
+            unfinished &= next_tokens != self.tokenizer.eos_token_id
+            if stopping_criteria:
+                unfinished &= ~stopping_criteria(sequences, scores)
+            if not unfinished.any():
+                break
+            attention_mask = torch.cat([attention_mask, attention_mask.new_ones((attention_mask.shape[0], 1))], dim=1)
+            outputs = self.forward(input_ids=next_tokens[:, None], attention_mask=attention_mask,
+                                   past_key_values=outputs.past_key_values)
+        return sequences
+
+
+class FakeBackend(Backend):
+    """Backend whose model is FakeModel; configure the class attributes (or configure()) before loading."""
+
+    name = "fake"
+    token_latency = 0.001     # seconds per decode step (the whole batch)
+    prefill_latency = 0.00002  # seconds per prompt token
+    malformed_rate = 0.0
+    seed = 0
+
+    def load(self, model_id):
+        tokenizer = fake_tokenizer()
+        model = FakeModel(tokenizer, self.token_latency, self.prefill_latency, self.malformed_rate, self.seed)
+        return tokenizer, model
+
+
+def configure(token_ms=None, prefill_us=None, malformed_rate=None, seed=None):
+    """Set FakeBackend's latencies, malformed-output rate and seed (only the arguments given)."""
+    if token_ms is not None:
+        FakeBackend.token_latency = token_ms / 1000
+    if prefill_us is not None:
+        FakeBackend.prefill_latency = prefill_us / 1_000_000
+    if malformed_rate is not None:
+        FakeBackend.malformed_rate = malformed_rate
+    if seed is not None:
+        FakeBackend.seed = seed
+
+
+BACKENDS[FakeBackend.name] = FakeBackend
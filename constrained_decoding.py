@@ -0,0 +1,315 @@
+import threading
+
+import torch
+from transformers import LogitsProcessor
+
+# ---------------------------
+# Output Schemas
+# ---------------------------
+# A schema is a flat sequence of segments: literal text, or one typed slot.
+# The literals pin down key order and spacing, so every accepted output is
+# exactly one JSON object that json.loads can read.
+GRADING_SCHEMA = [
+    ("literal", '{"score": '),
+    ("number", None),
+    ("literal", ', "feedback": '),
+    ("string", None),
+    ("literal", "}"),
+]
+
+COMPANION_SCHEMA = [
+    ("literal", '{"feedback": '),
+    ("string", None),
+    ("literal", ', "keywords": '),
+    ("string_array", None),
+    ("literal", ', "improvement_steps": '),
+    ("string_array", None),
+    ("literal", "}"),
+]
+
+MAX_NUMBER_CHARS = 5
+STRING_ESCAPES = '"\\/bfnrt'
+
+# ---------------------------
+# Character-level Schema Matcher
+# ---------------------------
+# Sub-states inside a string / string array slot
+_STR_OPEN, _STR_BODY, _STR_ESCAPE = 0, 1, 2
+_ARR_OPEN, _ARR_FIRST, _ARR_BODY, _ARR_ESCAPE, _ARR_AFTER_ITEM, _ARR_AFTER_COMMA, _ARR_AFTER_SPACE = range(7)
+
+
+class SchemaMatcher:
+    """
+    Tiny grammar engine for one of the schemas above.
+
+    feed() advances the state one character at a time and returns False as
+    soon as the text can no longer be completed into a valid object.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.segment = 0
+        self.pos = 0          # offset inside a literal
+        self.sub = 0          # sub-state inside a slot
+        self.number = ""      # characters of the current number slot
+
+    def copy(self):
+        other = SchemaMatcher.__new__(SchemaMatcher)
+        other.schema = self.schema
+        other.segment = self.segment
+        other.pos = self.pos
+        other.sub = self.sub
+        other.number = self.number
+        return other
+
+    @property
+    def complete(self):
+        return self.segment >= len(self.schema)
+
+    def _next_segment(self):
+        self.segment += 1
+        self.pos = 0
+        self.sub = 0
+        self.number = ""
+
+    def _number_valid(self):
+        return bool(self.number) and self.number[-1].isdigit()
+
+    def feed(self, text):
+        for ch in text:
+            if not self._feed_char(ch):
+                return False
+        return True
+
+    def _feed_char(self, ch):
+        if self.complete:
+            return False
+        kind, value = self.schema[self.segment]
+
+        if kind == "literal":
+            if value[self.pos] != ch:
+                return False
+            self.pos += 1
+            if self.pos == len(value):
+                self._next_segment()
+            return True
+
+        if kind == "number":
+            if ch.isdigit():
+                # No leading zeros ("05" is not valid JSON)
+                if self.number == "0" or len(self.number) >= MAX_NUMBER_CHARS:
+                    return False
+                self.number += ch
+                return True
+            if ch == "." and self.number and "." not in self.number and len(self.number) < MAX_NUMBER_CHARS - 1:
+                self.number += ch
+                return True
+            if self._number_valid():
+                # The number ends where the next literal begins
+                self._next_segment()
+                return self._feed_char(ch)
+            return False
+
+        if kind == "string":
+            if self.sub == _STR_OPEN:
+                if ch != '"':
+                    return False
+                self.sub = _STR_BODY
+            elif self.sub == _STR_BODY:
+                if ch == '"':
+                    self._next_segment()
+                elif ch == "\\":
+                    self.sub = _STR_ESCAPE
+                elif ord(ch) < 32:
+                    return False
+            else:
+                if ch not in STRING_ESCAPES:
+                    return False
+                self.sub = _STR_BODY
+            return True
+
+        # string_array
+        if self.sub == _ARR_OPEN:
+            if ch != "[":
+                return False
+            self.sub = _ARR_FIRST
+        elif self.sub == _ARR_FIRST:
+            if ch == "]":
+                self._next_segment()
+            elif ch == '"':
+                self.sub = _ARR_BODY
+            else:
+                return False
+        elif self.sub == _ARR_BODY:
+            if ch == '"':
+                self.sub = _ARR_AFTER_ITEM
+            elif ch == "\\":
+                self.sub = _ARR_ESCAPE
+            elif ord(ch) < 32:
+                return False
+        elif self.sub == _ARR_ESCAPE:
+            if ch not in STRING_ESCAPES:
+                return False
+            self.sub = _ARR_BODY
+        elif self.sub == _ARR_AFTER_ITEM:
+            if ch == "]":
+                self._next_segment()
+            elif ch == ",":
+                self.sub = _ARR_AFTER_COMMA
+            else:
+                return False
+        elif self.sub == _ARR_AFTER_COMMA:
+            if ch == " ":
+                self.sub = _ARR_AFTER_SPACE
+            elif ch == '"':
+                self.sub = _ARR_BODY
+            else:
+                return False
+        else:
+            if ch != '"':
+                return False
+            self.sub = _ARR_BODY
+        return True
+
+    def closing_text(self):
+        """Shortest text that completes the object from the current state."""
+        if self.complete:
+            return ""
+        kind, value = self.schema[self.segment]
+        if kind == "literal":
+            text = value[self.pos:]
+        elif kind == "number":
+            text = "" if self._number_valid() else "0"
+        elif kind == "string":
+            text = {_STR_OPEN: '""', _STR_BODY: '"', _STR_ESCAPE: '""'}[self.sub]
+        else:
+            text = {
+                _ARR_OPEN: "[]", _ARR_FIRST: "]", _ARR_BODY: '"]', _ARR_ESCAPE: '""]',
+                _ARR_AFTER_ITEM: "]", _ARR_AFTER_COMMA: '""]', _ARR_AFTER_SPACE: '""]'
+            }[self.sub]
+
+        for kind, value in self.schema[self.segment + 1:]:
+            text += {"literal": value, "number": "0", "string": '""', "string_array": "[]"}.get(kind, value)
+        return text
+
+# ---------------------------
+# Token Text Table
+# ---------------------------
+_token_text_lock = threading.Lock()
+_token_text_tables = {}
+
+
+def get_token_texts(tokenizer):
+    """
+    Surface text of every vocabulary id (None for special tokens), built once per tokenizer.
+
+    Each id is decoded after an anchor token so leading spaces of
+    sentencepiece pieces ("▁the" → " the") are preserved.
+    """
+    key = id(tokenizer)
+    table = _token_text_tables.get(key)
+    if table is not None:
+        return table
+
+    with _token_text_lock:
+        table = _token_text_tables.get(key)
+        if table is None:
+            special_ids = set(tokenizer.all_special_ids)
+            anchor = tokenizer("a", add_special_tokens=False)["input_ids"][-1]
+            anchor_text = tokenizer.decode([anchor], clean_up_tokenization_spaces=False)
+            table = []
+            for token_id in range(len(tokenizer)):
+                if token_id in special_ids:
+                    table.append(None)
+                    continue
+                text = tokenizer.decode([anchor, token_id], clean_up_tokenization_spaces=False)
+                table.append(text[len(anchor_text):] if text.startswith(anchor_text) else text)
+            _token_text_tables[key] = table
+    return table
+
+# ---------------------------
+# Logits Processor
+# ---------------------------
+class JsonSchemaLogitsProcessor(LogitsProcessor):
+    """
+    Restrict greedy decoding to outputs that match a schema.
+
+    At every step each row keeps only its highest-scoring token whose text
+    keeps the schema matcher valid (everything else is set to -inf), and EOS
+    once the object is complete. Near the end of the token budget only
+    tokens that close the object are allowed, so the result always parses.
+    Because only the best valid token survives, this is meant for
+    do_sample=False.
+
+    Matcher state is kept per generated token, so a call with a shorter or
+    different continuation (speculative decoding verifying and then
+    rejecting draft tokens) rewinds to the last token both share.
+    """
+
+    def __init__(self, tokenizer, schema, prompt_len, max_new_tokens, top_k=64):
+        self.tokenizer = tokenizer
+        self.schema = schema
+        self.prompt_len = prompt_len
+        self.max_new_tokens = max_new_tokens
+        self.top_k = top_k
+        self.token_texts = get_token_texts(tokenizer)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.matchers = None
+        self.consumed = None  # per row: generated token ids fed so far
+        self.history = None   # per row: matcher state after each of those tokens
+
+    def _advance(self, input_ids):
+        if self.history is None:
+            self.history = [[SchemaMatcher(self.schema)] for _ in range(input_ids.shape[0])]
+            self.consumed = [[] for _ in range(input_ids.shape[0])]
+        for row, tokens in enumerate(input_ids[:, self.prompt_len:].tolist()):
+            consumed, history = self.consumed[row], self.history[row]
+            shared = len(consumed)
+            if tokens[:shared] != consumed:
+                # Rewind to the longest common prefix
+                shared = next((i for i, (a, b) in enumerate(zip(tokens, consumed)) if a != b),
+                              min(len(tokens), len(consumed)))
+            del consumed[shared:]
+            del history[shared + 1:]
+            for token_id in tokens[shared:]:
+                matcher = history[-1].copy()
+                text = self.token_texts[token_id] if token_id < len(self.token_texts) else None
+                if text and not matcher.complete:
+                    matcher.feed(text)
+                consumed.append(token_id)
+                history.append(matcher)
+        self.matchers = [history[-1] for history in self.history]
+
+    def _is_allowed(self, matcher, token_id, closing):
+        text = self.token_texts[token_id] if token_id < len(self.token_texts) else None
+        if not text:
+            return False
+        if closing is not None and not closing.startswith(text):
+            return False
+        return matcher.copy().feed(text)
+
+    def _pick(self, matcher, row_scores, closing):
+        k = min(self.top_k, row_scores.shape[-1])
+        for candidates in (torch.topk(row_scores, k).indices, torch.argsort(row_scores, descending=True)):
+            for token_id in candidates.tolist():
+                if self._is_allowed(matcher, token_id, closing):
+                    return token_id
+        return None
+
+    def __call__(self, input_ids, scores):
+        self._advance(input_ids)
+        remaining = self.max_new_tokens - (input_ids.shape[1] - self.prompt_len)
+        masked = torch.full_like(scores, float("-inf"))
+
+        for row, matcher in enumerate(self.matchers):
+            if matcher.complete:
+                choice = self.eos_token_id
+            else:
+                closing = matcher.closing_text()
+                # Every token adds at least one character, so switch to closing once the budget is that tight
+                choice = self._pick(matcher, scores[row], closing if remaining <= len(closing) else None)
+            if choice is None:
+                choice = self.eos_token_id
+            masked[row, choice] = 0.0
+
+        return masked
@@ -1,28 +1,209 @@
 
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+import copy
 import json
+import logging
 import re
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from constrained_decoding import COMPANION_SCHEMA, GRADING_SCHEMA, JsonSchemaLogitsProcessor, get_token_texts
+from disk_cache import CACHE_DIR, DiskLRUCache, make_cache_key
+from rule_engine import parse_numeric_answer, rule_based_score
+from answer_key import answer_key_from_file
+from inference_backends import get_backend
+from inference_scheduler import ContinuousBatchingScheduler, cache_to_layers, length_buckets
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 # ---------------------------
-# Load Model in 4-bit
+# Load Model (lazily, once per process)
 # ---------------------------
 model_id = "microsoft/phi-3.5-mini-instruct"
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# 4-bit NF4 on CUDA, int8 on CPU-only hosts (XAMINAI_BACKEND overrides)
+backend = get_backend()
+device = backend.device
 
-bnb_config = BitsAndBytesConfig(
-    load_in_4bit=True,
-    bnb_4bit_compute_dtype=torch.float16,   # or bfloat16 if supported
-    bnb_4bit_use_double_quant=True,
-    bnb_4bit_quant_type="nf4"
-)
+# Restrict decoding to the grading/companion JSON schemas so output parses first time
+CONSTRAINED_DECODING = os.environ.get("XAMINAI_CONSTRAINED_DECODING", "1") != "0"
+# Route every generate through the shared continuous batching scheduler
+CONTINUOUS_BATCHING = os.environ.get("XAMINAI_CONTINUOUS_BATCHING", "1") != "0"
+MAX_BATCH_ROWS = int(os.environ.get("XAMINAI_MAX_BATCH_ROWS", "16"))
+# Prompts whose token lengths differ by more than this ratio are not padded into one batch
+LENGTH_BUCKET_RATIO = float(os.environ.get("XAMINAI_LENGTH_BUCKET_RATIO", "1.5"))
+
+# Decode budget (max_new_tokens) per request class; the schema processor closes
+# the JSON object before the budget runs out, so a smaller budget only shortens feedback.
+# Override with e.g. XAMINAI_TOKEN_BUDGETS='{"grade_numeric": 48}'
+TOKEN_BUDGETS = {
+    "grade_numeric": 64,   # numeric answers: a score and a one-line verdict
+    "grade_short": 120,    # short answers (up to SHORT_ANSWER_WORDS words)
+    "grade_long": 200,     # essays
+    "companion": 250
+}
+TOKEN_BUDGETS.update(json.loads(os.environ.get("XAMINAI_TOKEN_BUDGETS", "{}")))
+SHORT_ANSWER_WORDS = int(os.environ.get("XAMINAI_SHORT_ANSWER_WORDS", "40"))
+
+# Speculative decoding for single requests (get_model_score, companion_feedback):
+# feedback quotes the question and answers, so draft tokens found by n-gram
+# lookup into the prompt (or proposed by a small draft model sharing the
+# Phi-3.5 tokenizer) are verified several at a time in one forward pass.
+# Decoding stays greedy, so the output is the same as without it.
+PROMPT_LOOKUP_TOKENS = int(os.environ.get("XAMINAI_PROMPT_LOOKUP_TOKENS", "0"))  # 0 = off; ~10 works well
+DRAFT_MODEL_ID = os.environ.get("XAMINAI_DRAFT_MODEL", "")  # takes precedence over prompt lookup
+SPECULATIVE_DECODING = bool(PROMPT_LOOKUP_TOKENS or DRAFT_MODEL_ID)
+
+_model_lock = threading.Lock()
+_tokenizer = None
+_model = None
+
+
+def _process_memory_mb():
+    """Peak resident memory of this process in MB (ru_maxrss is KB on Linux)."""
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except Exception:
+        return None
+
+
+def get_model():
+    """
+    Return the shared (tokenizer, model) pair, loading it on first use.
+
+    The handle lives at module level, so every Streamlit session in the
+    process reuses the same weights; the lock makes sure concurrent first
+    calls only load once.
+    """
+    global _tokenizer, _model
+    if _model is not None:
+        return _tokenizer, _model
+
+    with _model_lock:
+        if _model is None:
+            start = time.perf_counter()
+            rss_before = _process_memory_mb()
+
+            tokenizer, model = backend.load(model_id)
+
+            elapsed = time.perf_counter() - start
+            # ONNX Runtime models don't report a footprint; dynamically quantized ones undercount it
+            footprint = getattr(model, "get_memory_footprint", None)
+            weights_text = f"weights {footprint() / (1024 ** 2):.0f} MB" if footprint else "weights n/a"
+            rss_after = _process_memory_mb()
+            rss_text = f", process RSS {rss_before:.0f} → {rss_after:.0f} MB" if rss_after is not None else ""
+            print(f"✅ Loaded {model_id} with the {backend.name} backend in {elapsed:.1f}s ({weights_text}{rss_text})")
+
+            _tokenizer = tokenizer
+            _model = model
+
+    return _tokenizer, _model
+
+
+_draft_lock = threading.Lock()
+_draft_model = None
+
+
+def get_draft_model():
+    """The draft model for speculative decoding (XAMINAI_DRAFT_MODEL), loaded on first use."""
+    global _draft_model
+    if _draft_model is None:
+        with _draft_lock:
+            if _draft_model is None:
+                _, _draft_model = backend.load(DRAFT_MODEL_ID)
+                print(f"✅ Loaded draft model {DRAFT_MODEL_ID} with the {backend.name} backend")
+    return _draft_model
+
+
+def speculative_generate_kwargs():
+    """Extra generate() arguments for speculative decoding, or {} when it is off."""
+    if DRAFT_MODEL_ID:
+        return {"assistant_model": get_draft_model()}
+    if PROMPT_LOOKUP_TOKENS:
+        return {"prompt_lookup_num_tokens": PROMPT_LOOKUP_TOKENS}
+    return {}
+
+
+def is_model_loaded():
+    """True once get_model() has finished loading the weights."""
+    return _model is not None
+
+
+def warm_up_model():
+    """Load the model, prefill the static prompt prefixes and build the token table ahead of the first request."""
+    tokenizer, _ = get_model()
+    warm_up_prefix_caches()
+    if CONSTRAINED_DECODING:
+        get_token_texts(tokenizer)
 
-tokenizer = AutoTokenizer.from_pretrained(model_id)
-model = AutoModelForCausalLM.from_pretrained(
-    model_id,
-    quantization_config=bnb_config,
-    device_map="auto"
+# ---------------------------
+# Grading Result Cache
+# ---------------------------
+# Bump whenever a prompt template changes so stale cached grades are not reused
+PROMPT_VERSION = "2"
+
+result_cache = DiskLRUCache(
+    os.path.join(CACHE_DIR, "grading_results.sqlite3"),
+    max_bytes=int(os.environ.get("XAMINAI_RESULT_CACHE_MB", "256")) * 1024 * 1024
 )
+metrics.register_collector("result_cache", result_cache.stats)
+
+
+def result_cache_key(kind, question, student_answer, correct_answer, max_score=5, difficulty="medium", budget=None):
+    """Content hash of everything that can change a grading or companion result."""
+    return make_cache_key(
+        kind, question, student_answer, correct_answer,
+        str(difficulty).lower(), max_score, model_id, backend.name, budget, PROMPT_VERSION
+    )
+
+# ---------------------------
+# Decode Budgets & Generation Metrics
+# ---------------------------
+def grading_budget_class(student_answer, correct_answer):
+    """Budget class for a grading request, from the expected size of its feedback."""
+    if parse_numeric_answer(correct_answer) is not None or parse_numeric_answer(student_answer) is not None:
+        return "grade_numeric"
+    if len(str(student_answer or "").split()) <= SHORT_ANSWER_WORDS:
+        return "grade_short"
+    return "grade_long"
+
+
+_stats_lock = threading.Lock()
+_generation_stats = {"prompt_tokens": 0, "padding_tokens": 0, "budgets": {}}
+
+
+def _record_generation(budget_class, budget, generated_tokens):
+    with _stats_lock:
+        stats = _generation_stats["budgets"].setdefault(
+            budget_class, {"requests": 0, "budget_tokens": 0, "generated_tokens": 0, "hit_budget": 0}
+        )
+        stats["requests"] += 1
+        stats["budget_tokens"] += budget
+        stats["generated_tokens"] += generated_tokens
+        stats["hit_budget"] += generated_tokens >= budget
+
+
+def generation_stats():
+    """Token budgets and how they were used per request class, plus prompt padding."""
+    with _stats_lock:
+        stats = json.loads(json.dumps(_generation_stats))
+    if _scheduler is not None:
+        scheduler_stats = _scheduler.stats()
+        stats["prompt_tokens"] += scheduler_stats["prefill_tokens"]
+        stats["padding_tokens"] += scheduler_stats["prefill_padding"]
+        stats["scheduler"] = scheduler_stats
+    stats["padding_ratio"] = round(stats["padding_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0
+    for budget_stats in stats["budgets"].values():
+        budget_stats["budget_utilisation"] = round(budget_stats["generated_tokens"] / budget_stats["budget_tokens"], 3)
+    stats["token_budgets"] = dict(TOKEN_BUDGETS)
+    return stats
+
+
+metrics.register_collector("generation", generation_stats)
 
 # ---------------------------
 # JSON Validator
@@ -43,52 +224,132 @@ def validate_and_fix_json(filename):
 # ---------------------------
 # JSON Extraction Helper
 # ---------------------------
-import json
-import re
+class JsonObjectScanner:
+    """
+    Incremental scanner that notices when the first top-level JSON object closes.
+
+    Feed it generated text piece by piece; braces inside string literals
+    (and escaped quotes) are ignored. `end` is the offset just past the
+    closing brace once the object is complete.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.start = None
+        self.end = None
+        self.offset = 0
+
+    @property
+    def done(self):
+        return self.end is not None
+
+    def feed(self, text):
+        for ch in text:
+            if self.end is not None:
+                break
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.depth > 0:
+                self.in_string = True
+            elif ch == "{":
+                if self.depth == 0:
+                    self.start = self.offset
+                self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self.offset + 1
+            self.offset += 1
+        return self.done
+
+
+def extract_first_json_object(text):
+    """Return the first balanced top-level {...} block in text, or None."""
+    scanner = JsonObjectScanner()
+    if scanner.feed(text):
+        return text[scanner.start:scanner.end]
+    return None
+
+
+class JsonObjectStoppingCriteria(StoppingCriteria):
+    """Stop each row as soon as its generated continuation has closed a JSON object."""
+
+    def __init__(self, tokenizer, prompt_len):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.seen = 0
+        self.scanners = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.scanners is None:
+            self.scanners = [JsonObjectScanner() for _ in range(input_ids.shape[0])]
+            self.seen = self.prompt_len
+
+        # Only scan tokens added since the last call
+        new_tokens = input_ids[:, self.seen:].tolist()
+        self.seen = input_ids.shape[1]
+        for scanner, tokens in zip(self.scanners, new_tokens):
+            if not scanner.done:
+                scanner.feed(self.tokenizer.decode(tokens, skip_special_tokens=True))
+
+        return torch.tensor([scanner.done for scanner in self.scanners], device=input_ids.device)
+
 
 def safe_json_extract(text):
     """Extract and parse JSON from model output safely."""
-    try:
-        # Find all JSON-like objects
-        matches = re.findall(r"\{.*?\}", text, re.DOTALL)
-        if not matches:
-            raise ValueError("No JSON found")
+    with metrics.timer("json_extraction"):
+        try:
+            # Generation stops right after the object closes, so the first balanced block is usually it
+            first_object = extract_first_json_object(text)
+            if first_object:
+                try:
+                    return json.loads(first_object)
+                except json.JSONDecodeError:
+                    pass
 
-        # Pick the longest block (most complete JSON)
-        best_match = max(matches, key=len)
+            # Find all JSON-like objects
+            matches = re.findall(r"\{.*?\}", text, re.DOTALL)
+            if not matches:
+                raise ValueError("No JSON found")
 
-        # Try parsing directly
-        try:
-            return json.loads(best_match)
-        except json.JSONDecodeError:
-            # Attempt auto-fix: balance braces
-            open_count = best_match.count("{")
-            close_count = best_match.count("}")
-            if open_count > close_count:
-                best_match += "}" * (open_count - close_count)
+            # Pick the longest block (most complete JSON)
+            best_match = max(matches, key=len)
 
-            return json.loads(best_match)
+            # Try parsing directly
+            try:
+                return json.loads(best_match)
+            except json.JSONDecodeError:
+                # Attempt auto-fix: balance braces
+                open_count = best_match.count("{")
+                close_count = best_match.count("}")
+                if open_count > close_count:
+                    best_match += "}" * (open_count - close_count)
 
-    except Exception:
-        return {"score": 0, "feedback": f"Parsing error. Raw output: {text}"}
+                return json.loads(best_match)
+
+        except Exception:
+            return {"score": 0, "feedback": f"Parsing error. Raw output: {text}"}
 
 
 # ---------------------------
 # Companion Feedback Function
 # ---------------------------
-def companion_feedback(question, student_answer, correct_answer, max_score=5):
-    """
-    Companion mode: acts like a tutor, explaining what’s missing and guiding improvement.
-    """
-    prompt = f"""
+COMPANION_PROMPT = """
 You are a helpful tutor. A student has answered a question, and you must guide them to a perfect answer.
 
 Return ONLY valid JSON in this exact format:
-{{
+{
   "feedback": "<string>",
   "keywords": ["<keyword1>", "<keyword2>", ...],
   "improvement_steps": ["<step1>", "<step2>", ...]
-}}
+}
 
 Instructions:
 1. Summarize the student's answer and politely highlight what they did well.
@@ -98,12 +359,33 @@ Instructions:
 5. Avoid scoring; this is only feedback and guidance.
 """
 
-    inputs = tokenizer(prompt + f"\nQuestion: {question}\nStudent Answer: {student_answer}\nCorrect Answer: {correct_answer}\n",
-                       return_tensors="pt").to(device)
-    outputs = model.generate(**inputs, max_new_tokens=250)
-    raw_output = tokenizer.decode(outputs[0], skip_special_tokens=True)
 
-    return safe_json_extract(raw_output)
+def build_companion_prompt(question, student_answer, correct_answer):
+    """Tutor prompt for companion mode; COMPANION_PROMPT is its static prefix."""
+    return COMPANION_PROMPT + f"\nQuestion: {question}\nStudent Answer: {student_answer}\nCorrect Answer: {correct_answer}\n"
+
+
+def companion_feedback(question, student_answer, correct_answer, max_score=5):
+    """
+    Companion mode: acts like a tutor, explaining what’s missing and guiding improvement.
+    """
+    cache_key = result_cache_key("companion", question, student_answer, correct_answer, max_score,
+                                 budget=TOKEN_BUDGETS["companion"])
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    raw_output = _generate_batch(
+        [build_companion_prompt(question, student_answer, correct_answer)],
+        max_new_tokens=TOKEN_BUDGETS["companion"],
+        schema=COMPANION_SCHEMA,
+        budget_class="companion"
+    )[0]
+
+    result = safe_json_extract(raw_output)
+    if not is_parse_error(result):
+        result_cache.set(cache_key, result)
+    return result
 
 
 def build_system_prompt(difficulty):
@@ -154,92 +436,489 @@ Difficulty Level:
 # ---------------------------
 # Model-based Scoring
 # ---------------------------
-def get_model_score(question, student_answer, correct_answer, max_score=5, difficulty="medium"):
-    """Ask the model to score and retry if it fails."""
-    difficulty_text = {
+def get_difficulty_text(difficulty):
+    """Short difficulty instruction used inside the per-question grading prompt."""
+    return {
         "easy": "Lenient grading. Award partial credit generously.",
         "hard": "Strict grading. Full marks only for exact correctness.",
         "medium": "Balanced grading. Award partial credit fairly."
     }.get(difficulty.lower(), "Balanced grading. Award partial credit fairly.")
 
-    # First attempt prompt
-    base_prompt = f"""
+
+def grading_prompt_prefix(difficulty="medium"):
+    """Static head of the grading prompt; identical for every question at one difficulty."""
+    return f"""
 You are a grading assistant. Your ONLY output should be a single valid JSON object.
 No explanations, no text outside JSON, no markdown.
 JSON format:
 {{"score": <int>, "feedback": "<1-2 short sentences>"}}
-Question: {question}
+Difficulty: {get_difficulty_text(difficulty)}
+"""
+
+
+def retry_prompt_prefix(difficulty="medium"):
+    """Static head of the retry prompt."""
+    return f"""
+ONLY return JSON like this: {{"score": 0-5, "feedback": "short feedback"}}
+Difficulty: {get_difficulty_text(difficulty)}
+"""
+
+
+def build_question_block(question, student_answer, correct_answer, max_score=5):
+    """Per-question tail shared by the grading and retry prompts."""
+    return f"""Question: {question}
 Student Answer: {student_answer}
 Correct Answer: {correct_answer}
 Max Score: {max_score}
-Difficulty: {difficulty_text}
 """
 
-    for attempt in range(2):  # Retry up to 2 times
-        # Move tensors to device
-        inputs = tokenizer(base_prompt, return_tensors="pt")
-        inputs = {k: v.to(device) for k, v in inputs.items()}
 
-        # Generate response
-        outputs = model.generate(**inputs, max_new_tokens=200, do_sample=False)
-        raw_output = tokenizer.decode(outputs[0], skip_special_tokens=True)
+def build_grading_prompt(question, student_answer, correct_answer, max_score=5, difficulty="medium"):
+    """First-attempt grading prompt for a single question."""
+    return grading_prompt_prefix(difficulty) + build_question_block(question, student_answer, correct_answer, max_score)
+
 
-        print(f"\n--- RAW MODEL OUTPUT (Attempt {attempt+1}) ---\n{raw_output}\n-----------------------\n")
+def build_retry_prompt(question, student_answer, correct_answer, max_score=5, difficulty="medium"):
+    """Stricter, shorter prompt used when the first attempt could not be parsed."""
+    return retry_prompt_prefix(difficulty) + build_question_block(question, student_answer, correct_answer, max_score)
+
+
+def is_parse_error(parsed):
+    """True if safe_json_extract could not recover a usable grading JSON."""
+    return "Parsing error" in str(parsed.get("feedback", ""))
+
+
+def _score_with_prompts(prompts, budget_class="grade_long"):
+    """Try each prompt in turn until the model output parses."""
+    raw_output = ""
+    for attempt, prompt in enumerate(prompts):
+        if attempt:
+            metrics.increment("retries")
+        with metrics.timer("retry") if attempt else nullcontext():
+            raw_output = _generate_batch([prompt], max_new_tokens=TOKEN_BUDGETS[budget_class],
+                                         schema=GRADING_SCHEMA, budget_class=budget_class)[0]
+
+        logger.debug("Raw model output (attempt %d): %s", attempt + 1, raw_output)
 
         # Try parsing
         parsed = safe_json_extract(raw_output)
-        if "Parsing error" not in parsed["feedback"]:
+        if not is_parse_error(parsed):
             return parsed
 
-        # If parsing failed, adjust the prompt for retry
-        base_prompt = f"""
-ONLY return JSON like this: {{"score": 0-5, "feedback": "short feedback"}}
-Question: {question}
-Student Answer: {student_answer}
-Correct Answer: {correct_answer}
-Max Score: {max_score}
-Difficulty: {difficulty_text}
-"""
-
-    # If both attempts fail, return fallback
+    # If every attempt fails, return fallback
     return {"score": 0, "feedback": f"Parsing error. Raw output: {raw_output}"}
 
+
+def get_model_score(question, student_answer, correct_answer, max_score=5, difficulty="medium"):
+    """Ask the model to score and retry if it fails."""
+    budget_class = grading_budget_class(student_answer, correct_answer)
+    cache_key = result_cache_key("grade", question, student_answer, correct_answer, max_score, difficulty,
+                                 TOKEN_BUDGETS[budget_class])
+    metrics.increment("model_questions")
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        metrics.increment("result_cache_hits")
+        return cached
+
+    args = (question, student_answer, correct_answer, max_score, difficulty)
+    prompts = [build_grading_prompt(*args)]
+    if not CONSTRAINED_DECODING:
+        # Unconstrained output may not parse, so keep the stricter retry prompt in reserve
+        prompts.append(build_retry_prompt(*args))
+    parsed = _score_with_prompts(prompts, budget_class)
+    if not is_parse_error(parsed):
+        result_cache.set(cache_key, parsed)
+    return parsed
+
+# ---------------------------
+# Prompt Prefix KV Cache
+# ---------------------------
+_prefix_lock = threading.Lock()
+_prefix_caches = {}  # prefix text -> (prefix token ids, past_key_values)
+
+
+def static_prompt_prefixes():
+    """Every fixed prompt head worth prefilling once: companion, plus grading and retry per difficulty."""
+    prefixes = [COMPANION_PROMPT]
+    for difficulty in ("easy", "medium", "hard"):
+        prefixes.append(grading_prompt_prefix(difficulty))
+        prefixes.append(retry_prompt_prefix(difficulty))
+    return prefixes
+
+
+def _get_prefix_cache(prefix):
+    """Prefill a static prompt prefix once and keep its past_key_values for reuse."""
+    entry = _prefix_caches.get(prefix)
+    if entry is not None:
+        return entry
+
+    tokenizer, model = get_model()
+    with _prefix_lock:
+        entry = _prefix_caches.get(prefix)
+        if entry is None:
+            prefix_ids = tokenizer(prefix)["input_ids"]
+            with torch.no_grad():
+                outputs = model(input_ids=torch.tensor([prefix_ids], device=device), use_cache=True)
+            entry = (prefix_ids, outputs.past_key_values)
+            _prefix_caches[prefix] = entry
+    return entry
+
+
+def _expand_prefix_cache(past_key_values, batch_size):
+    """Private copy of a prefix cache (generate appends to it), repeated across the batch."""
+    past_key_values = copy.deepcopy(past_key_values)
+    if batch_size == 1:
+        return past_key_values
+    if hasattr(past_key_values, "batch_repeat_interleave"):
+        past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+    # Legacy tuple-of-tuples cache format
+    return tuple(tuple(t.repeat_interleave(batch_size, dim=0) for t in layer) for layer in past_key_values)
+
+
+def warm_up_prefix_caches():
+    """Prefill every static prompt prefix ahead of the first grading request."""
+    if not backend.supports_prefix_cache:
+        return
+    for prefix in static_prompt_prefixes():
+        _get_prefix_cache(prefix)
+
+
+def _build_prefixed_inputs(prompts):
+    """
+    Build generate() inputs that reuse a cached prefix, or None if the prompts don't share one.
+
+    Rows are laid out as [prefix][padding][suffix] with the padding masked out, so
+    the cached prefix keys/values sit at the same positions for every row and
+    only the per-question suffix tokens are prefilled.
+    """
+    if not backend.supports_prefix_cache:
+        return None
+    prefix = next((p for p in static_prompt_prefixes() if all(prompt.startswith(p) for prompt in prompts)), None)
+    if prefix is None:
+        return None
+
+    tokenizer, _ = get_model()
+    prefix_ids, past_key_values = _get_prefix_cache(prefix)
+    rows = tokenizer(prompts)["input_ids"]
+
+    # Only reuse the cache if the full prompt tokenizes to the same leading tokens
+    if any(row[:len(prefix_ids)] != prefix_ids for row in rows):
+        return None
+
+    suffixes = [row[len(prefix_ids):] for row in rows]
+    width = max(len(suffix) for suffix in suffixes)
+    if width == 0:
+        return None
+
+    input_ids, attention_mask = [], []
+    for suffix in suffixes:
+        pad = width - len(suffix)
+        input_ids.append(prefix_ids + [tokenizer.pad_token_id] * pad + suffix)
+        attention_mask.append([1] * len(prefix_ids) + [0] * pad + [1] * len(suffix))
+
+    return {
+        "input_ids": torch.tensor(input_ids, device=device),
+        "attention_mask": torch.tensor(attention_mask, device=device),
+        "past_key_values": _expand_prefix_cache(past_key_values, len(prompts))
+    }
+
+
+def _prefill_inputs(prompts):
+    """Model inputs for prompts: prefix-cached if they share a static prefix, plain left padding otherwise."""
+    with metrics.timer("tokenization") as record:
+        inputs = _build_prefixed_inputs(prompts)
+        if inputs is None:
+            tokenizer, _ = get_model()
+            inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+        record.tokens = int(inputs["attention_mask"].sum())
+    return inputs
+
+
+def _prompt_prefix(prompt):
+    return next((p for p in static_prompt_prefixes() if prompt.startswith(p)), None)
+
+
+def _schema_processor(schema, max_new_tokens):
+    """Per-request schema processor for the scheduler (it only sees that request's generated ids)."""
+    if schema is None or not CONSTRAINED_DECODING:
+        return None
+    tokenizer, _ = get_model()
+    return JsonSchemaLogitsProcessor(tokenizer, schema, 0, max_new_tokens)
+
+
+_scheduler_lock = threading.Lock()
+_scheduler = None
+
+
+def get_scheduler():
+    """The process-wide continuous batching scheduler, created on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ContinuousBatchingScheduler(
+                load=get_model,
+                prefill_inputs=_prefill_inputs,
+                make_processor=_schema_processor,
+                make_scanner=JsonObjectScanner,
+                group_key=_prompt_prefix,
+                length_key=_prompt_token_length,
+                max_rows=MAX_BATCH_ROWS,
+                bucket_ratio=LENGTH_BUCKET_RATIO
+            )
+    return _scheduler
+
+
+def _prompt_token_length(prompt):
+    tokenizer, _ = get_model()
+    return len(tokenizer(prompt)["input_ids"])
+
+
+def _generate_batch(prompts, max_new_tokens=200, schema=None, budget_class=None):
+    """Generated text for each prompt (see _generate_with_counts)."""
+    return _generate_with_counts(prompts, max_new_tokens, schema, budget_class)[0]
+
+
+def _generate_with_counts(prompts, max_new_tokens=200, schema=None, budget_class=None):
+    """
+    Generate a completion for each prompt.
+
+    A single prompt with SPECULATIVE_DECODING on runs as its own generate
+    call with draft tokens verified in bulk (assisted generation only
+    supports one row). Otherwise, with CONTINUOUS_BATCHING the prompts join
+    the shared scheduler, where they decode alongside requests from every
+    other session and job; without it they run as padded generate calls,
+    one per length bucket and budget. If the prompts share a static prefix its cached KV state is
+    reused, so only the per-question tokens are prefilled. Each row stops as
+    soon as it has closed a JSON object. With a schema (and
+    CONSTRAINED_DECODING on) only tokens that keep the output valid for that
+    schema are allowed.
+
+    max_new_tokens and budget_class may be single values or one per prompt;
+    budget usage is recorded per class for generation_stats().
+    Returns (texts, generated token counts): only the newly generated text
+    for each row, in input order, and how many tokens each one took.
+    """
+    budgets = max_new_tokens if isinstance(max_new_tokens, (list, tuple)) else [max_new_tokens] * len(prompts)
+    classes = budget_class if isinstance(budget_class, (list, tuple)) else [budget_class or "other"] * len(prompts)
+    tokenizer, model = get_model()
+
+    if SPECULATIVE_DECODING and len(prompts) == 1:
+        outputs = _generate_padded(prompts, budgets[0], schema, speculative=True)
+    elif CONTINUOUS_BATCHING and backend.supports_prefix_cache:
+        scheduler = get_scheduler()
+        futures = [scheduler.submit(prompt, budget, schema) for prompt, budget in zip(prompts, budgets)]
+        outputs = [future.result() for future in futures]
+    else:
+        outputs = [None] * len(prompts)
+        lengths = [len(ids) for ids in tokenizer(list(prompts))["input_ids"]]
+        for budget in sorted(set(budgets)):
+            positions = [p for p, b in enumerate(budgets) if b == budget]
+            for bucket in length_buckets([lengths[p] for p in positions], LENGTH_BUCKET_RATIO):
+                rows = [positions[b] for b in bucket]
+                for row, text in zip(rows, _generate_padded([prompts[row] for row in rows], budget, schema)):
+                    outputs[row] = text
+
+    token_counts = [len(tokenizer(text, add_special_tokens=False)["input_ids"]) for text in outputs]
+    for count, budget, budget_class in zip(token_counts, budgets, classes):
+        _record_generation(budget_class, budget, count)
+    return outputs, token_counts
+
+
+class _FirstStepTimer(StoppingCriteria):
+    """Notes when generate() finishes its first step, to split its time into prefill and decode."""
+
+    def __init__(self):
+        self.first_step_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_step_at is None:
+            self.first_step_at = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+
+def _truncate_after_json(tokenizer, token_ids):
+    """Generated ids up to the token that closes the first JSON object, where plain greedy decoding stops."""
+    scanner = JsonObjectScanner()
+    for idx, token_id in enumerate(token_ids):
+        if scanner.feed(tokenizer.decode([token_id], skip_special_tokens=True)):
+            return token_ids[:idx + 1]
+    return token_ids
+
+
+def _generate_padded(prompts, max_new_tokens, schema, speculative=False):
+    """One padded model.generate call over prompts (the path without the scheduler)."""
+    tokenizer, model = get_model()
+    inputs = _prefill_inputs(prompts)
+    prompt_len = inputs["input_ids"].shape[1]
+    # Padding is only paid for on the tokens that are actually prefilled (not the cached prefix)
+    cached = cache_to_layers(inputs["past_key_values"])[0][0].shape[2] if "past_key_values" in inputs else 0
+    prefilled = inputs["attention_mask"][:, cached:]
+    with _stats_lock:
+        _generation_stats["prompt_tokens"] += prefilled.numel()
+        _generation_stats["padding_tokens"] += int((prefilled == 0).sum())
+
+    logits_processor = LogitsProcessorList()
+    if schema is not None and CONSTRAINED_DECODING:
+        logits_processor.append(JsonSchemaLogitsProcessor(tokenizer, schema, prompt_len, max_new_tokens))
+
+    step_timer = _FirstStepTimer()
+    start = time.perf_counter()
+    outputs = backend.generate(
+        model,
+        inputs,
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        pad_token_id=tokenizer.pad_token_id,
+        logits_processor=logits_processor,
+        stopping_criteria=StoppingCriteriaList([JsonObjectStoppingCriteria(tokenizer, prompt_len), step_timer]),
+        **(speculative_generate_kwargs() if speculative else {})
+    )
+    end = time.perf_counter()
+    first_step_at = step_timer.first_step_at or end
+    metrics.observe("prefill", first_step_at - start, int(prefilled.sum()))
+    metrics.observe("decode", end - first_step_at, int((outputs[:, prompt_len:] != tokenizer.pad_token_id).sum()))
+    if speculative:
+        # A verified draft can run past the closing brace; drop what greedy decoding would not have produced
+        return [tokenizer.decode(_truncate_after_json(tokenizer, row[prompt_len:].tolist()), skip_special_tokens=True)
+                for row in outputs]
+    return tokenizer.batch_decode(outputs[:, prompt_len:], skip_special_tokens=True)
+
+
+def get_model_scores_batch(items, batch_size=8):
+    """
+    Grade several questions with one padded generate call per batch.
+
+    Items already in the result cache are answered from disk. The rest are
+    grouped by difficulty (so a batch shares a cached prompt prefix), then
+    bucketed by tokenized prompt length so short answers are never padded
+    to an essay. Each item gets the decode budget of its class (see
+    grading_budget_class). Rows whose output cannot be parsed (only
+    possible with CONSTRAINED_DECODING off) are retried one by one with the
+    stricter retry prompt; everything else costs a single shared generate.
+
+    Args:
+        items (list): Dicts with question_id, question, student_answer,
+            correct_answer, max_score and difficulty.
+        batch_size (int): Number of prompts padded into one generate call.
+
+    Returns:
+        list: One {"question_id", "score", "feedback", "metrics"} dict per item, in input order;
+            metrics holds cache_hit, generated_tokens, retries and the batch's latency.
+    """
+    results = [None] * len(items)
+    misses = []  # (index, cache key, prompt args, budget class) for items not in the result cache
+    for idx, item in enumerate(items):
+        args = (
+            item.get("question", ""),
+            item.get("student_answer", ""),
+            item.get("correct_answer"),
+            item.get("max_score", 5),
+            item.get("difficulty", "medium")
+        )
+        budget_class = grading_budget_class(args[1], args[2])
+        cache_key = result_cache_key("grade", *args, budget=TOKEN_BUDGETS[budget_class])
+        metrics.increment("model_questions")
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            metrics.increment("result_cache_hits")
+            results[idx] = {
+                "question_id": item.get("question_id", ""),
+                **cached,
+                "metrics": {"graded_by": "model", "cache_hit": True, "generated_tokens": 0, "retries": 0}
+            }
+        else:
+            misses.append((idx, cache_key, args, budget_class))
+
+    # Keep questions of one difficulty together so each batch shares a cached prompt prefix,
+    # then bucket each difficulty by prompt length
+    batches = []
+    by_difficulty = {}
+    for miss in misses:
+        by_difficulty.setdefault(get_difficulty_text(miss[2][4]), []).append(miss)
+    for group in by_difficulty.values():
+        prompts = [build_grading_prompt(*args) for _, _, args, _ in group]
+        lengths = [_prompt_token_length(prompt) for prompt in prompts]
+        for bucket in length_buckets(lengths, LENGTH_BUCKET_RATIO, max_size=max(1, batch_size)):
+            batches.append([(group[p], prompts[p]) for p in bucket])
+
+    for batch in batches:
+        start = time.perf_counter()
+        raw_outputs, token_counts = _generate_with_counts(
+            [prompt for _, prompt in batch],
+            max_new_tokens=[TOKEN_BUDGETS[miss[3]] for miss, _ in batch],
+            schema=GRADING_SCHEMA,
+            budget_class=[miss[3] for miss, _ in batch]
+        )
+        latency = time.perf_counter() - start
+
+        for ((idx, cache_key, args, budget_class), _), raw_output, generated_tokens in zip(batch, raw_outputs, token_counts):
+            question_id = items[idx].get("question_id", "")
+            logger.debug("Raw model output (%s, batched): %s", question_id, raw_output)
+            parsed = safe_json_extract(raw_output)
+            retries = 0
+            if is_parse_error(parsed):
+                # Only the rows that failed to parse pay for a second generation
+                retries = 1
+                metrics.increment("retries")
+                with metrics.timer("retry"):
+                    parsed = _score_with_prompts([build_retry_prompt(*args)], budget_class)
+            if not is_parse_error(parsed):
+                result_cache.set(cache_key, parsed)
+            results[idx] = {
+                "question_id": question_id,
+                "score": parsed.get("score", 0),
+                "feedback": parsed.get("feedback", "No feedback"),
+                "metrics": {
+                    "graded_by": "model",
+                    "cache_hit": False,
+                    "generated_tokens": generated_tokens,
+                    "retries": retries,
+                    "batch_size": len(batch),
+                    "latency_seconds": round(latency, 3),
+                    "tokens_per_second": round(generated_tokens / latency, 1) if latency else None
+                }
+            }
+
+    return results
+
 # ---------------------------
 # Main Pipeline
 # ---------------------------
-def evaluate(input_file, output_file, difficulty="medium", max_score=5, correct_answers_file=None):
+def load_correct_answers(correct_answers_file):
+    """Read a correct answers JSON file into a {question_id: correct_answer} dict (cached until the file changes)."""
+    try:
+        return answer_key_from_file(correct_answers_file).as_correct_answers()
+    except Exception as e:
+        print(f"⚠️ Failed to load correct answers file: {e}")
+        return {}
+
+
+def iter_evaluate(data, difficulty="medium", max_score=5, correct_answers=None, batch_size=8):
     """
-    Evaluates questions in the input JSON file and writes results.
-    If a correct answers file is provided, it is used as the authoritative reference.
+    Generator version of evaluate_records that yields each entry as soon as it is graded.
+
+    Questions settled by exact match or a conclusive rule come out first;
+    model-graded questions follow one batch at a time. Entries are yielded
+    in completion order, so each comes with its position in data.
 
     Args:
-        input_file (str): Path to the input JSON file.
-        output_file (str): Path to save results.
+        data (list): Question dicts (question_id, question, student_answer, ...).
         difficulty (str): Grading difficulty (easy/medium/hard).
-        max_score (int): Default maximum score (overridden if JSON has max_score).
-        correct_answers_file (str, optional): Path to JSON file with correct answers.
-    """
-    data = validate_and_fix_json(input_file)
-    if not data:
-        print("🚨 Exiting due to invalid JSON.")
-        return
+        max_score (int): Default maximum score (overridden if a record has max_score).
+        correct_answers (dict, optional): {question_id: correct_answer}, authoritative if given.
+        batch_size (int): Number of questions graded per model.generate call.
 
-    # Load correct answers if provided
-    correct_answers = {}
-    if correct_answers_file:
-        try:
-            with open(correct_answers_file, "r", encoding="utf-8") as f:
-                ca_data = json.load(f)
-                for q in ca_data:
-                    qid = q.get("question_id")
-                    answer = q.get("correct_answer", "")
-                    if qid:
-                        correct_answers[qid] = answer
-        except Exception as e:
-            print(f"⚠️ Failed to load correct answers file: {e}")
-            correct_answers = {}
+    Yields:
+        tuple: (index in data, graded entry dict).
+    """
+    if isinstance(data, dict):
+        data = [data]
+    correct_answers = correct_answers or {}
 
     results = []
+    pending = []  # (result index, model item) for questions the model has to grade
     for q in data:
         question_id = q.get("question_id", "")
         question = q.get("question", "")
@@ -252,25 +931,6 @@ def evaluate(input_file, output_file, difficulty="medium", max_score=5, correct_
         # Override correct answer from external file if available
         correct_answer = correct_answers.get(question_id, q.get("correct_answer", ""))
 
-        # Case 1: Exact match → full marks
-        if correct_answer and student_answer.strip().lower() == correct_answer.strip().lower():
-            model_score = question_max_score
-            model_feedback = "✅ Perfect! Answer matches the correct answer exactly."
-        # Case 2: Correct answer exists but not an exact match → let model grade
-        elif correct_answer:
-            model_result = get_model_score(
-                question, student_answer, correct_answer, question_max_score, grading_mode
-            )
-            model_score = model_result.get("score", 0)
-            model_feedback = model_result.get("feedback", "No feedback")
-        # Case 3: No correct answer provided → fallback to model general knowledge
-        else:
-            model_result = get_model_score(
-                question, student_answer, None, question_max_score, grading_mode
-            )
-            model_score = model_result.get("score", 0)
-            model_feedback = model_result.get("feedback", "No feedback")
-
         graded_entry = {
             "question_id": question_id,
             "question": question,
@@ -278,18 +938,116 @@ def evaluate(input_file, output_file, difficulty="medium", max_score=5, correct_
             "student_answer": student_answer,
             "grading_mode": grading_mode,
             "rule_score": q.get("rule_score", None),
-            "model_score": model_score,
-            "feedback": model_feedback,
+            "rule": None,
+            "model_score": None,
+            "feedback": None,
             "max_score": question_max_score,
-            "final_score": model_score
+            "final_score": None,
+            "metrics": None
         }
 
+        # Deterministic rules (numeric tolerance, chemical symbols; keyword coverage is only a hint)
+        verdict = rule_based_score(student_answer, correct_answer, question_max_score)
+        if verdict is not None:
+            graded_entry["rule_score"] = verdict["score"]
+            graded_entry["rule"] = verdict["rule"]
+
+        # Case 1: Exact match → full marks
+        if correct_answer and student_answer.strip().lower() == correct_answer.strip().lower():
+            graded_entry["model_score"] = question_max_score
+            graded_entry["feedback"] = "✅ Perfect! Answer matches the correct answer exactly."
+            graded_entry["final_score"] = question_max_score
+            graded_entry["metrics"] = {"graded_by": "exact match"}
+        # Case 2: Conclusive rule verdict → no model call needed
+        elif verdict is not None and verdict["conclusive"]:
+            graded_entry["model_score"] = verdict["score"]
+            graded_entry["feedback"] = verdict["feedback"]
+            graded_entry["final_score"] = verdict["score"]
+            graded_entry["metrics"] = {"graded_by": "rule"}
+        # Case 3/4: let the model grade, against the correct answer if there is one,
+        # otherwise from its general knowledge
+        else:
+            pending.append((len(results), {
+                "question_id": question_id,
+                "question": question,
+                "student_answer": student_answer,
+                "correct_answer": correct_answer or None,
+                "max_score": question_max_score,
+                "difficulty": grading_mode
+            }))
+
         results.append(graded_entry)
 
+    # Anything that didn't need the model is ready straight away
+    pending_indexes = {idx for idx, _ in pending}
+    for idx, graded_entry in enumerate(results):
+        if idx not in pending_indexes:
+            yield idx, graded_entry
+
+    # Grade every remaining question in padded batches, one difficulty at a time
+    pending.sort(key=lambda p: get_difficulty_text(p[1]["difficulty"]))
+    step = max(1, batch_size)
+    for start in range(0, len(pending), step):
+        chunk = pending[start:start + step]
+        model_results = get_model_scores_batch([item for _, item in chunk], batch_size=batch_size)
+        for (idx, _), model_result in zip(chunk, model_results):
+            results[idx]["model_score"] = model_result.get("score", 0)
+            results[idx]["feedback"] = model_result.get("feedback", "No feedback")
+            results[idx]["final_score"] = results[idx]["model_score"]
+            results[idx]["metrics"] = model_result.get("metrics")
+            yield idx, results[idx]
+
+
+def evaluate_records(data, difficulty="medium", max_score=5, correct_answers=None, batch_size=8):
+    """
+    Evaluates a list of question records in memory and returns the graded entries.
+    Nothing is read from or written to disk, so concurrent sessions can't clash.
+
+    Args:
+        data (list): Question dicts (question_id, question, student_answer, ...).
+        difficulty (str): Grading difficulty (easy/medium/hard).
+        max_score (int): Default maximum score (overridden if a record has max_score).
+        correct_answers (dict, optional): {question_id: correct_answer}, authoritative if given.
+        batch_size (int): Number of questions graded per model.generate call.
+
+    Returns:
+        list: One graded entry dict per input record, in input order.
+    """
+    graded = dict(iter_evaluate(data, difficulty, max_score, correct_answers, batch_size))
+    return [graded[idx] for idx in sorted(graded)]
+
+
+def evaluate(input_file, output_file, difficulty="medium", max_score=5, correct_answers_file=None, batch_size=8):
+    """
+    Evaluates questions in the input JSON file and writes results.
+    If a correct answers file is provided, it is used as the authoritative reference.
+
+    Args:
+        input_file (str): Path to the input JSON file.
+        output_file (str): Path to save results.
+        difficulty (str): Grading difficulty (easy/medium/hard).
+        max_score (int): Default maximum score (overridden if JSON has max_score).
+        correct_answers_file (str, optional): Path to JSON file with correct answers.
+        batch_size (int): Number of questions graded per model.generate call.
+
+    Returns:
+        list: The graded entries that were written to output_file.
+    """
+    data = validate_and_fix_json(input_file)
+    if not data:
+        print("🚨 Exiting due to invalid JSON.")
+        return
+
+    # Load correct answers if provided
+    correct_answers = load_correct_answers(correct_answers_file) if correct_answers_file else {}
+
+    results = evaluate_records(data, difficulty, max_score, correct_answers, batch_size)
+
     with open(output_file, "w", encoding="utf-8") as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
 
     print(f"✅ Evaluation complete! Results saved to {output_file}")
+    return results
 
 
 
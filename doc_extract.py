@@ -0,0 +1,188 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import docx  # python-docx for DOCX
+import fitz  # PyMuPDF for PDFs
+
+from disk_cache import CACHE_DIR, DiskLRUCache, make_cache_key
+from metrics import metrics
+from question_parser import DEFAULT_MAX_SCORE, is_question_line, iter_questions, parse_questions
+
+# ---------------------------
+# Document Text Extraction
+# ---------------------------
+# PDFs are opened from the upload's buffer; bytes() is only made when the
+# installed PyMuPDF rejects it. Long documents (scanned answer booklets)
+# are split into page ranges that are extracted in parallel on a process
+# pool, since PyMuPDF holds the GIL. Each worker gets a small PDF holding
+# only its own pages, not a pickled copy of the whole document.
+PARALLEL_MIN_PAGES = int(os.environ.get("XAMINAI_PARALLEL_MIN_PAGES", "24"))
+EXTRACT_WORKERS = int(os.environ.get("XAMINAI_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Bump when extraction or parsing output changes, so stale cache entries are ignored
+EXTRACTOR_VERSION = "1"
+PARSER_VERSION = "3"
+EXTRACT_CACHE_MB = int(os.environ.get("XAMINAI_EXTRACT_CACHE_MB", "128"))
+
+# Extracted text by document content hash, parsed questions by text hash
+extract_cache = DiskLRUCache(os.path.join(CACHE_DIR, "extracted_text.sqlite3"), max_bytes=EXTRACT_CACHE_MB * 1024 * 1024)
+metrics.register_collector("extract_cache", extract_cache.stats)
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded Streamlit server is not safe
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def document_bytes(file):
+    """
+    Contents of an uploaded or downloaded file without copying where possible.
+
+    BytesIO-like objects (Streamlit uploads, Drive downloads) expose their
+    buffer directly; anything else is read once.
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return file
+    if hasattr(file, "getbuffer"):
+        return file.getbuffer()
+    file.seek(0)
+    return file.read()
+
+
+def content_digest(data):
+    """SHA-256 of a document's bytes (or of a text)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _open_pdf(data):
+    try:
+        return fitz.open(stream=data, filetype="pdf")
+    except (TypeError, ValueError):
+        # Older PyMuPDF builds only accept bytes
+        return fitz.open(stream=bytes(data), filetype="pdf")
+
+
+def _page_range_pdf(doc, start, stop):
+    """Pages [start, stop) of doc as a standalone PDF's bytes."""
+    with fitz.open() as part:
+        part.insert_pdf(doc, from_page=start, to_page=stop - 1)
+        return part.tobytes()
+
+
+def _extract_pdf_part(data):
+    """Worker: text of every page of a PDF given as bytes."""
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return [page.get_text() for page in doc]
+
+
+def iter_pdf_pages(file):
+    """Yield the text of each PDF page in order, for parsers that consume pages as they come."""
+    with _open_pdf(document_bytes(file)) as doc:
+        for page in doc:
+            yield page.get_text()
+
+
+def extract_pdf_pages(file, parallel_min_pages=PARALLEL_MIN_PAGES):
+    """Text of every PDF page, extracted on the process pool for long documents."""
+    data = document_bytes(file)
+    with _open_pdf(data) as doc:
+        page_count = doc.page_count
+        if page_count < parallel_min_pages or EXTRACT_WORKERS < 2:
+            return [page.get_text() for page in doc]
+
+        # Ship each worker only the pages it extracts
+        step = -(-page_count // EXTRACT_WORKERS)
+        parts = [_page_range_pdf(doc, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    futures = [_get_pool().submit(_extract_pdf_part, part) for part in parts]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+def extract_pdf_text(file, use_cache=True):
+    """Whole PDF text, pages joined by newlines; cached by content hash."""
+    data = document_bytes(file)
+    key = make_cache_key("pdf", EXTRACTOR_VERSION, content_digest(data)) if use_cache else None
+    if key:
+        cached = extract_cache.get(key)
+        if cached is not None:
+            return cached
+    with metrics.timer("extraction"):
+        text = "\n".join(extract_pdf_pages(data)).strip()
+    if key:
+        extract_cache.set(key, text)
+    return text
+
+
+def extract_docx_text(file, use_cache=True):
+    """Non-empty DOCX paragraphs joined by newlines; cached by content hash."""
+    data = document_bytes(file)
+    key = make_cache_key("docx", EXTRACTOR_VERSION, content_digest(data)) if use_cache else None
+    if key:
+        cached = extract_cache.get(key)
+        if cached is not None:
+            return cached
+    with metrics.timer("extraction"):
+        doc_obj = docx.Document(BytesIO(data) if not hasattr(file, "read") else file)
+        text = "\n".join(p.text for p in doc_obj.paragraphs if p.text.strip()).strip()
+    if key:
+        extract_cache.set(key, text)
+    return text
+
+# ---------------------------
+# Question Parsing
+# ---------------------------
+def detect_question(line):
+    """True if a line starts a new question (see question_parser); False for blank lines."""
+    line = (line or "").strip()
+    return bool(line) and is_question_line(line)
+
+
+def smart_parse_text_to_json(raw_text, use_cache=True, max_score=DEFAULT_MAX_SCORE):
+    """Split extracted text into question records worth max_score each; cached by text hash."""
+    key = make_cache_key("questions", PARSER_VERSION, max_score, content_digest(raw_text)) if use_cache else None
+    if key:
+        cached = extract_cache.get(key)
+        if cached is not None:
+            return cached
+    with metrics.timer("parsing"):
+        questions = parse_questions(raw_text, max_score)
+    if key:
+        extract_cache.set(key, questions)
+    return questions
+
+
+def iter_pdf_questions(file, max_score=DEFAULT_MAX_SCORE):
+    """Yield question records while the PDF is still being extracted, page by page."""
+    return iter_questions(iter_pdf_pages(file), max_score)
+
+
+def parse_document(file, file_name, max_score=DEFAULT_MAX_SCORE):
+    """
+    Question records from a PDF/DOCX/JSON submission; raises ValueError for other formats.
+
+    Questions parsed from PDF/DOCX text are worth max_score; JSON records keep their own max_score.
+    """
+    if file_name.endswith(".pdf"):
+        return smart_parse_text_to_json(extract_pdf_text(file), max_score=max_score)
+    if file_name.endswith(".docx"):
+        return smart_parse_text_to_json(extract_docx_text(file), max_score=max_score)
+    if file_name.endswith(".json"):
+        with metrics.timer("parsing"):
+            return json.loads(bytes(document_bytes(file)).decode("utf-8"))
+    raise ValueError(f"Unsupported file format: {file_name}")
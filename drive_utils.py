@@ -0,0 +1,374 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from io import BytesIO
+
+# ---------------------------
+# Google Drive Client
+# ---------------------------
+SERVICE_ACCOUNT_FILE = 'service_account.json'
+SCOPES = ['https://www.googleapis.com/auth/drive']
+
+# Point this at a local directory to use LocalDriveService instead of the real API
+LOCAL_DRIVE_DIR = os.environ.get("XAMINAI_DRIVE_LOCAL_DIR")
+
+LIST_TTL = 60                    # seconds a listing is served from memory
+FULL_RESYNC_INTERVAL = 10 * 60   # seconds between full listings (incremental in between)
+LIST_PAGE_SIZE = 100
+MAX_CONNECTIONS = 4
+DOWNLOAD_CHUNK_SIZE = int(float(os.environ.get("XAMINAI_DRIVE_CHUNK_MB", "4")) * 1024 * 1024)
+DOWNLOAD_CACHE_BYTES = int(os.environ.get("XAMINAI_DRIVE_DOWNLOAD_CACHE_MB", "128")) * 1024 * 1024
+FILE_FIELDS = "id, name, mimeType, modifiedTime, size, trashed"
+FOLDER_MIME = "application/vnd.google-apps.folder"
+
+
+def build_service_account_service():
+    """Drive v3 service authenticated with the service account file."""
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
+    creds = service_account.Credentials.from_service_account_file(
+        SERVICE_ACCOUNT_FILE, scopes=SCOPES
+    )
+    return build('drive', 'v3', credentials=creds, cache_discovery=False)
+
+
+class DriveClient:
+    """
+    Process-wide Drive client.
+
+    Keeps a small pool of authenticated service objects (each holds its own
+    keep-alive HTTP connection, and httplib2 is not thread-safe), and a
+    TTL cache of folder listings shared by every caller. Expired listings
+    are refreshed incrementally (only files modified since the last fetch),
+    with a full resync every FULL_RESYNC_INTERVAL to catch deletions.
+    Downloaded content is kept in a bounded in-memory LRU keyed by file id
+    and modifiedTime, so an unchanged file is only fetched once.
+    """
+
+    def __init__(self, service_factory, max_connections=MAX_CONNECTIONS, list_ttl=LIST_TTL,
+                 chunk_size=DOWNLOAD_CHUNK_SIZE, cache_bytes=DOWNLOAD_CACHE_BYTES):
+        self.service_factory = service_factory
+        self.max_connections = max_connections
+        self.list_ttl = list_ttl
+        self.chunk_size = chunk_size
+        self.cache_bytes = cache_bytes
+        self._downloads = OrderedDict()
+        self._downloads_size = 0
+        self._download_lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._list_lock = threading.Lock()
+        self._listings = {}
+
+    @contextmanager
+    def connection(self):
+        """Borrow a service object from the pool, building one if none is idle."""
+        with self._slots:
+            try:
+                service = self._idle.get_nowait()
+            except queue.Empty:
+                service = self.service_factory()
+            try:
+                yield service
+            finally:
+                self._idle.put(service)
+
+    def _fetch_all(self, query):
+        files, page_token = [], None
+        with self.connection() as service:
+            while True:
+                response = service.files().list(
+                    q=query,
+                    pageSize=LIST_PAGE_SIZE,
+                    pageToken=page_token,
+                    orderBy="modifiedTime desc",
+                    fields=f"nextPageToken, files({FILE_FIELDS})"
+                ).execute()
+                files.extend(response.get("files", []))
+                page_token = response.get("nextPageToken")
+                if not page_token:
+                    return files
+
+    def list_files(self, folder_id=None, refresh=False):
+        """
+        All files visible to the client (or inside folder_id), newest first.
+
+        Served from memory for list_ttl seconds; refresh=True forces a full listing.
+        """
+        key = folder_id or ""
+        scope = f"'{folder_id}' in parents" if folder_id else None
+        with self._list_lock:
+            now = time.time()
+            entry = self._listings.get(key)
+            if entry and not refresh and now - entry["fetched_at"] < self.list_ttl:
+                return self._sorted(entry)
+
+            if entry is None or refresh or now - entry["full_at"] > FULL_RESYNC_INTERVAL:
+                query = " and ".join(filter(None, [scope, "trashed = false"]))
+                files = self._fetch_all(query)
+                entry = {"files": {f["id"]: f for f in files}, "full_at": now}
+            else:
+                # Trashed files are included here so they can be dropped from the cache
+                query = " and ".join(filter(None, [scope, f"modifiedTime > '{entry['cursor']}'"]))
+                for f in self._fetch_all(query):
+                    if f.get("trashed"):
+                        entry["files"].pop(f["id"], None)
+                    else:
+                        entry["files"][f["id"]] = f
+
+            entry["fetched_at"] = now
+            entry["cursor"] = max(
+                (f.get("modifiedTime", "") for f in entry["files"].values()),
+                default=entry.get("cursor", "1970-01-01T00:00:00.000Z")
+            ) or "1970-01-01T00:00:00.000Z"
+            self._listings[key] = entry
+            return self._sorted(entry)
+
+    @staticmethod
+    def _sorted(entry):
+        return sorted(entry["files"].values(), key=lambda f: f.get("modifiedTime", ""), reverse=True)
+
+    def invalidate(self, folder_id=None):
+        with self._list_lock:
+            self._listings.pop(folder_id or "", None)
+
+    def _cached_download(self, key):
+        with self._download_lock:
+            entry = self._downloads.get(key)
+            if entry is not None:
+                self._downloads.move_to_end(key)
+            return entry
+
+    def _store_download(self, key, name, content):
+        if len(content) > self.cache_bytes:
+            return
+        with self._download_lock:
+            if key in self._downloads:
+                return
+            self._downloads[key] = (name, content)
+            self._downloads_size += len(content)
+            while self._downloads_size > self.cache_bytes:
+                _, (_, evicted) = self._downloads.popitem(last=False)
+                self._downloads_size -= len(evicted)
+
+    def download(self, file_id):
+        """
+        Fetch one file into memory; returns (BytesIO, name, error) like download_drive_file.
+
+        Only the metadata is requested when the same revision was downloaded before.
+        """
+        try:
+            with self.connection() as service:
+                meta = service.files().get(fileId=file_id, fields="id, name, mimeType, modifiedTime").execute()
+                key = (file_id, meta.get("modifiedTime"))
+                cached = self._cached_download(key)
+                if cached is not None:
+                    name, content = cached
+                    return BytesIO(content), name, None
+                fh, name, error = download_drive_file(service, file_id, chunk_size=self.chunk_size, metadata=meta)
+        except Exception as e:
+            return None, None, str(e)
+        if fh is not None:
+            self._store_download(key, name, fh.getvalue())
+        return fh, name, error
+
+    def download_many(self, file_ids):
+        """Download several files concurrently; returns {file_id: (BytesIO, name, error)}."""
+        file_ids = list(dict.fromkeys(f for f in file_ids if f))
+        if not file_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_connections, len(file_ids))) as pool:
+            return dict(zip(file_ids, pool.map(self.download, file_ids)))
+
+
+_client_lock = threading.Lock()
+_client = None
+
+
+def get_drive_client():
+    """Shared DriveClient, created on first use (LocalDriveService if XAMINAI_DRIVE_LOCAL_DIR is set)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            if LOCAL_DRIVE_DIR:
+                _client = DriveClient(lambda: LocalDriveService(LOCAL_DRIVE_DIR))
+            else:
+                _client = DriveClient(build_service_account_service)
+    return _client
+
+
+def download_drive_file(service, file_id, chunk_size=DOWNLOAD_CHUNK_SIZE, metadata=None, progress=None):
+    """
+    Download a file from Google Drive using its file ID.
+
+    The content is streamed in chunk_size requests into memory; progress, if
+    given, is called with (file_name, fraction) after each chunk.
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+
+    try:
+        # Get file metadata (unless the caller already has it)
+        file = metadata or service.files().get(fileId=file_id, fields="id, name, mimeType").execute()
+        file_name = file["name"]
+        mime_type = file["mimeType"]
+
+        fh = BytesIO()
+
+        if mime_type == FOLDER_MIME:
+            # It's a folder, not a file
+            return None, None, "Cannot download: Selected item is a folder."
+
+        elif mime_type.startswith("application/vnd.google-apps."):
+            # Google Docs/Sheets/Slides -> Export as PDF
+            export_mime = "application/pdf"
+            request = service.files().export_media(fileId=file_id, mimeType=export_mime)
+            file_name += ".pdf"
+        else:
+            # Normal file download (PDF, DOCX, etc.)
+            request = service.files().get_media(fileId=file_id)
+
+        downloader = MediaIoBaseDownload(fh, request, chunksize=chunk_size)
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
+            if status and progress:
+                progress(file_name, status.progress())
+
+        fh.seek(0)
+        return fh, file_name, None  # Success
+
+    except Exception as e:
+        return None, None, str(e)
+
+# ---------------------------
+# Local Drive Stand-in
+# ---------------------------
+# Mimics the small slice of the Drive v3 API used above, backed by a local
+# directory: file ids are paths relative to the root, sub-directories are
+# folders. Useful for running and testing the Drive flow offline.
+_MIME_BY_EXTENSION = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".json": "application/json",
+    ".txt": "text/plain",
+}
+
+
+class _LocalResponse(dict):
+    def __init__(self, status, headers):
+        super().__init__(headers)
+        self.status = status
+
+
+class _LocalHttp:
+    """Answers the ranged GETs issued by MediaIoBaseDownload."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        start, end = 0, len(data) - 1
+        range_header = (headers or {}).get("range") or (headers or {}).get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].partition("-")
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+        chunk = data[start:end + 1]
+        return _LocalResponse(206, {"content-range": f"bytes {start}-{end}/{len(data)}"}), chunk
+
+
+class _LocalRequest:
+    def __init__(self, result=None, path=None, uri=""):
+        self._result = result
+        self.uri = uri
+        self.headers = {}
+        self.http = _LocalHttp(path) if path else None
+
+    def execute(self):
+        return self._result
+
+
+class _LocalFiles:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, file_id):
+        path = os.path.normpath(os.path.join(self.root, file_id))
+        if not path.startswith(os.path.normpath(self.root)):
+            raise ValueError(f"File not found: {file_id}")
+        return path
+
+    def _metadata(self, file_id):
+        path = self._path(file_id)
+        stat = os.stat(path)
+        is_dir = os.path.isdir(path)
+        return {
+            "id": file_id,
+            "name": os.path.basename(path),
+            "mimeType": FOLDER_MIME if is_dir else _MIME_BY_EXTENSION.get(os.path.splitext(path)[1].lower(), "application/octet-stream"),
+            "modifiedTime": datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+            "size": str(0 if is_dir else stat.st_size),
+            "trashed": False,
+            "parents": [os.path.dirname(file_id) or "root"],
+        }
+
+    def _matches(self, meta, query):
+        for clause in filter(None, (c.strip() for c in (query or "").split(" and "))):
+            if clause.endswith(" in parents"):
+                if clause.split("'")[1] not in meta["parents"]:
+                    return False
+            elif clause.startswith("modifiedTime >"):
+                if not meta["modifiedTime"] > clause.split("'")[1]:
+                    return False
+            elif clause.startswith("mimeType !="):
+                if meta["mimeType"] == clause.split("'")[1]:
+                    return False
+            elif clause.startswith("mimeType ="):
+                if meta["mimeType"] != clause.split("'")[1]:
+                    return False
+            elif clause == "trashed = false":
+                continue
+        return True
+
+    def list(self, q=None, pageSize=100, pageToken=None, orderBy=None, fields=None, **kwargs):
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in dirnames + filenames:
+                file_id = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, "/")
+                meta = self._metadata(file_id)
+                if self._matches(meta, q):
+                    files.append(meta)
+        files.sort(key=lambda f: f["modifiedTime"], reverse=True)
+        start = int(pageToken or 0)
+        page = files[start:start + pageSize]
+        result = {"files": page}
+        if start + pageSize < len(files):
+            result["nextPageToken"] = str(start + pageSize)
+        return _LocalRequest(result)
+
+    def get(self, fileId, fields=None, **kwargs):
+        return _LocalRequest(self._metadata(fileId))
+
+    def get_media(self, fileId, **kwargs):
+        return _LocalRequest(path=self._path(fileId), uri=f"local://{fileId}")
+
+    def export_media(self, fileId, mimeType=None, **kwargs):
+        return self.get_media(fileId)
+
+
+class LocalDriveService:
+    """Drive v3 service look-alike over a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def files(self):
+        return _LocalFiles(self.root)
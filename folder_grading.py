@@ -0,0 +1,186 @@
+import os
+import queue
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from day6_grader import iter_evaluate
+from metrics import paper_metrics
+
+# ---------------------------
+# Bulk Grading of a Drive Folder
+# ---------------------------
+# One submission per student, pipelined through three stages:
+#   download (pooled Drive connections) → extract + parse (small thread pool)
+#   → grading (the model, one batch at a time).
+# Papers that are ready at the same time are graded together, so model
+# batches stay full even when each paper only has a few open questions.
+PARSE_WORKERS = int(os.environ.get("XAMINAI_FOLDER_PARSE_WORKERS", "4"))
+FOLDER_BATCH_QUESTIONS = int(os.environ.get("XAMINAI_FOLDER_BATCH_QUESTIONS", "32"))
+SUBMISSION_EXTENSIONS = (".pdf", ".docx", ".json")
+
+
+def student_name(file_name):
+    """Student label for a submission file ("jane_doe.pdf" → "jane_doe")."""
+    return os.path.splitext(file_name or "")[0] or "unknown"
+
+
+def summarise_student(file, entries, error=None, **timings):
+    """
+    Per-student result: graded entries plus totals.
+
+    timings (elapsed_seconds for grading, parse_seconds, ...) go into the
+    result's paper_metrics().
+    """
+    result = {
+        "student": student_name(file.get("name")),
+        "file_name": file.get("name"),
+        "file_id": file.get("id"),
+        "status": "failed" if error else "graded",
+        "error": error,
+        "results": entries or [],
+        "total_score": None,
+        "max_total": None,
+        "percentage": None,
+        "metrics": paper_metrics(entries, **timings) if entries else None
+    }
+    if entries:
+        total = sum(float(e.get("final_score") or 0) for e in entries)
+        max_total = sum(float(e.get("max_score") or 0) for e in entries)
+        result["total_score"] = round(total, 2)
+        result["max_total"] = round(max_total, 2)
+        result["percentage"] = round(100 * total / max_total, 1) if max_total else None
+    return result
+
+
+def class_summary(student_results):
+    """Class-level statistics over the graded students, plus the average per question."""
+    graded = [r for r in student_results if r and r["status"] == "graded" and r["percentage"] is not None]
+    percentages = [r["percentage"] for r in graded]
+
+    per_question = {}
+    for r in graded:
+        for i, entry in enumerate(r["results"], start=1):
+            key = entry.get("question_id") or f"Q{i}"
+            stats = per_question.setdefault(key, {"question": entry.get("question", ""), "scores": [], "max_score": entry.get("max_score")})
+            stats["scores"].append(float(entry.get("final_score") or 0))
+
+    return {
+        "students": len([r for r in student_results if r]),
+        "graded": len(graded),
+        "failed": len([r for r in student_results if r and r["status"] == "failed"]),
+        "mean_percentage": round(statistics.mean(percentages), 1) if percentages else None,
+        "median_percentage": round(statistics.median(percentages), 1) if percentages else None,
+        "min_percentage": min(percentages) if percentages else None,
+        "max_percentage": max(percentages) if percentages else None,
+        "questions": [
+            {
+                "question_id": key,
+                "question": stats["question"],
+                "average_score": round(statistics.mean(stats["scores"]), 2),
+                "max_score": stats["max_score"],
+                "answered_by": len(stats["scores"])
+            }
+            for key, stats in per_question.items()
+        ]
+    }
+
+
+def iter_grade_folder(drive, files, parse_document, answer_key=None, difficulty="medium", max_score=5,
+                      parse_workers=PARSE_WORKERS, batch_questions=FOLDER_BATCH_QUESTIONS, cancel_event=None):
+    """
+    Grade every submission in files, yielding each student's result as soon as it is done.
+
+    Args:
+        drive (DriveClient): Client used for the downloads.
+        files (list): Drive file metadata dicts (id, name) of the submissions.
+        parse_document (callable): (BytesIO, file_name, max_score=...) → list of question dicts.
+        answer_key (AnswerKey, optional): The exam's key, built once and shared by every submission.
+        difficulty (str): Grading difficulty (easy/medium/hard).
+        max_score (int): Default maximum score per question, also passed to parse_document.
+        parse_workers (int): Threads extracting and parsing downloaded files.
+        batch_questions (int): Soft cap on questions graded in one combined pass.
+        cancel_event (threading.Event, optional): Once set, finished downloads are no longer
+            parsed and the generator returns as soon as the next paper is ready.
+
+    Yields:
+        tuple: (index in files, per-student result dict from summarise_student).
+    """
+    ready = queue.Queue()
+
+    def parse_stage(idx, download):
+        try:
+            fh, name, error = download.result()
+            if error:
+                raise RuntimeError(f"Download failed: {error}")
+            start = time.perf_counter()
+            data = parse_document(fh, name, max_score=max_score)
+            if not data:
+                raise ValueError("No questions found in the file.")
+            parse_seconds = time.perf_counter() - start
+            ready.put((idx, answer_key.apply(data) if answer_key else data, None, parse_seconds))
+        except Exception as e:
+            ready.put((idx, None, str(e), None))
+
+    stopped = threading.Event()
+
+    def cancelled():
+        return stopped.is_set() or (cancel_event is not None and cancel_event.is_set())
+
+    def schedule_parse(idx, download):
+        # Runs on the download thread. Downloads finishing after a cancel are not parsed,
+        # but still reported, so the consumer below never waits for a paper that won't come
+        if download.cancelled() or cancelled():
+            ready.put((idx, None, "Cancelled.", None))
+            return
+        try:
+            parse_pool.submit(parse_stage, idx, download)
+        except RuntimeError:
+            ready.put((idx, None, "Cancelled.", None))  # parse_pool shut down in the meantime
+
+    download_pool = ThreadPoolExecutor(max_workers=max(1, drive.max_connections), thread_name_prefix="folder-download")
+    parse_pool = ThreadPoolExecutor(max_workers=max(1, parse_workers), thread_name_prefix="folder-parse")
+    try:
+        for idx, file in enumerate(files):
+            download = download_pool.submit(drive.download, file["id"])
+            download.add_done_callback(lambda d, idx=idx: schedule_parse(idx, d))
+
+        received = 0
+        while received < len(files):
+            # Take every paper that is ready (up to the soft cap) and grade them in one pass
+            batch = [ready.get()]
+            if cancelled():
+                return
+            while sum(len(p[1] or []) for p in batch) < batch_questions:
+                try:
+                    batch.append(ready.get_nowait())
+                except queue.Empty:
+                    break
+            received += len(batch)
+
+            flat, owners = [], []
+            for idx, data, error, _ in batch:
+                if error:
+                    yield idx, summarise_student(files[idx], None, error)
+                    continue
+                for q_idx, q in enumerate(data):
+                    flat.append(q)
+                    owners.append((idx, q_idx))
+
+            papers = {idx: [None] * len(data) for idx, data, error, _ in batch if not error}
+            parse_seconds = {idx: seconds for idx, _, error, seconds in batch if not error}
+            remaining = {idx: len(entries) for idx, entries in papers.items()}
+            start = time.perf_counter()
+            for flat_idx, entry in iter_evaluate(flat, difficulty, max_score):
+                idx, q_idx = owners[flat_idx]
+                papers[idx][q_idx] = entry
+                remaining[idx] -= 1
+                if remaining[idx] == 0:
+                    yield idx, summarise_student(files[idx], papers[idx], elapsed_seconds=time.perf_counter() - start,
+                                                 parse_seconds=parse_seconds[idx])
+    finally:
+        # Also reached when the consumer stops early (cancelled job)
+        stopped.set()
+        download_pool.shutdown(wait=False, cancel_futures=True)
+        parse_pool.shutdown(wait=False, cancel_futures=True)
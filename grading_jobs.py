@@ -0,0 +1,242 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from day6_grader import companion_feedback, iter_evaluate
+from folder_grading import class_summary, iter_grade_folder
+from metrics import metrics, paper_metrics
+
+# ---------------------------
+# Background Grading Jobs
+# ---------------------------
+# Grading runs on a small process-wide worker pool instead of the Streamlit
+# script thread. A session only keeps the job id, so widget interactions and
+# page reruns never interrupt or repeat the work.
+JOB_WORKERS = int(os.environ.get("XAMINAI_JOB_WORKERS", "2"))
+MAX_PENDING_JOBS = int(os.environ.get("XAMINAI_MAX_PENDING_JOBS", "16"))
+FINISHED_JOB_TTL = 60 * 60  # seconds a finished job stays available for polling
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class GradingJob:
+    """State of one submitted paper (or companion request), safe to read from any thread."""
+
+    def __init__(self, kind, items):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.items = items
+        self.status = QUEUED
+        self.total = len(items)
+        self.completed = 0
+        self.reused = 0  # entries carried over from an earlier run rather than graded
+        self.model_graded = 0  # items that took model time (not rules, cache hits or reused entries)
+        self.model_started_at = None
+        self.results = [None] * self.total
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.summary = None  # class summary, for folder jobs
+        self.metrics = None  # paper_metrics() totals once the job finishes
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def record(self, idx, result, model_time=True):
+        """Store a finished item; model_time=False for items graded without the model."""
+        self.results[idx] = result
+        self.completed += 1
+        if model_time:
+            self.model_graded += 1
+        elif not self.model_graded:
+            # iter_evaluate yields rule-graded and cached entries first; model work starts after them
+            self.model_started_at = time.time()
+
+    def eta_seconds(self):
+        """
+        Remaining time estimated from the observed time per model-graded item.
+
+        Rule-graded, cached and reused items finish almost instantly, so they
+        are left out of the rate; None until the first model-graded item.
+        """
+        if not self.model_started_at or not self.model_graded or self.finished:
+            return None
+        elapsed = time.time() - self.model_started_at
+        return elapsed / self.model_graded * (self.total - self.completed)
+
+    def snapshot(self):
+        """Copy of the results graded so far (None for items still pending)."""
+        return list(self.results)
+
+
+class JobManager:
+    """Bounded worker pool plus a registry of jobs by id."""
+
+    def __init__(self, max_workers=JOB_WORKERS, max_pending=MAX_PENDING_JOBS):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="grading-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _register(self, job):
+        with self._lock:
+            self._prune()
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                print(f"⚠️ Grading queue is full ({pending} jobs pending).")
+                return None
+            self._jobs[job.id] = job
+        return job
+
+    def _prune(self):
+        cutoff = time.time() - FINISHED_JOB_TTL
+        for job_id in [j.id for j in self._jobs.values() if j.finished and (j.finished_at or time.time()) < cutoff]:
+            del self._jobs[job_id]
+
+    def submit_grading(self, data, difficulty="medium", max_score=5, correct_answers=None, known_results=None):
+        """
+        Queue a paper for grading; returns the job id, or None if the queue is full.
+
+        known_results maps positions in data to entries that are already graded
+        (e.g. unchanged questions from an earlier run); only the rest go to the model.
+        """
+        job = self._register(GradingJob("grading", list(data)))
+        if job is None:
+            return None
+        for idx, entry in (known_results or {}).items():
+            job.results[idx] = dict(entry, question_id=data[idx].get("question_id", entry.get("question_id", "")),
+                                    metrics={"graded_by": "reused"})
+            job.completed += 1
+            job.reused += 1
+        self._executor.submit(self._run_grading, job, data, difficulty, max_score, correct_answers)
+        return job.id
+
+    def submit_companion(self, question, student_answer, correct_answer, max_score=5):
+        """Queue a companion feedback request; returns the job id, or None if the queue is full."""
+        job = self._register(GradingJob("companion", [{
+            "question": question,
+            "student_answer": student_answer,
+            "correct_answer": correct_answer
+        }]))
+        if job is None:
+            return None
+        self._executor.submit(self._run_companion, job, question, student_answer, correct_answer, max_score)
+        return job.id
+
+    def submit_folder(self, drive, files, parse_document, answer_key=None, difficulty="medium", max_score=5):
+        """
+        Queue every submission in a Drive folder; returns the job id, or None if the queue is full.
+
+        Each item is one student's file; results hold one per-student result
+        and job.summary the class summary once the job finishes.
+        """
+        job = self._register(GradingJob("folder", list(files)))
+        if job is None:
+            return None
+        self._executor.submit(self._run_folder, job, drive, parse_document, answer_key, difficulty, max_score)
+        return job.id
+
+    def _start(self, job):
+        if job.cancel_requested:
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            return False
+        job.status = RUNNING
+        job.started_at = job.model_started_at = time.time()
+        return True
+
+    def _run_grading(self, job, data, difficulty, max_score, correct_answers):
+        if not self._start(job):
+            return
+        try:
+            todo = [idx for idx, entry in enumerate(job.results) if entry is None]
+            subset = [data[idx] for idx in todo]
+            for sub_idx, entry in iter_evaluate(subset, difficulty, max_score, correct_answers):
+                entry_metrics = entry.get("metrics") or {}
+                job.record(todo[sub_idx], entry,
+                           model_time=entry_metrics.get("graded_by") == "model" and not entry_metrics.get("cache_hit"))
+                # Cancellation takes effect between model batches
+                if job.cancel_requested:
+                    job.status = CANCELLED
+                    break
+            else:
+                job.status = DONE
+            job.metrics = paper_metrics(job.results, time.time() - job.started_at)
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+            print(f"❌ Grading job {job.id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def _run_folder(self, job, drive, parse_document, answer_key, difficulty, max_score):
+        if not self._start(job):
+            return
+        try:
+            stream = iter_grade_folder(drive, job.items, parse_document, answer_key, difficulty, max_score,
+                                       cancel_event=job._cancel)
+            for idx, result in stream:
+                job.record(idx, result)
+                if job.cancel_requested:
+                    stream.close()
+                    job.status = CANCELLED
+                    break
+            else:
+                job.status = DONE
+            job.summary = class_summary(job.results)
+            job.metrics = paper_metrics([entry for r in job.results if r for entry in r["results"]],
+                                        time.time() - job.started_at)
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+            print(f"❌ Folder grading job {job.id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def _run_companion(self, job, question, student_answer, correct_answer, max_score):
+        if not self._start(job):
+            return
+        try:
+            job.results[0] = companion_feedback(question, student_answer, correct_answer, max_score)
+            job.completed = 1
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+            print(f"❌ Companion job {job.id} failed: {e}")
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        """Job for job_id, or None if unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Ask a job to stop; queued jobs never start, running ones stop after the current batch."""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job._cancel.set()
+        return True
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+
+# Shared by every Streamlit session in the process
+job_manager = JobManager()
+metrics.register_collector("jobs", job_manager.stats)
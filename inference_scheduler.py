@@ -0,0 +1,334 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from metrics import metrics
+
+# ---------------------------
+# Continuous Batching Scheduler
+# ---------------------------
+# One scheduler thread owns the model. Requests from every session and job
+# queue up here; at each decode step any waiting requests are prefilled and
+# merged into the running batch, and rows that finish (EOS, closed JSON
+# object or token budget) leave it and resolve their futures. So a new
+# request never waits for a whole batch to finish, and more concurrent
+# load means fuller batches rather than more contention for the cores.
+#
+# Every row keeps its own left-padded slice of one shared KV cache; the
+# attention mask hides padding, so rows of different lengths, and rows
+# admitted at different steps, can decode together. Decoding is greedy.
+
+
+def cache_to_layers(past_key_values):
+    """[(keys, values), ...] per layer from a Cache object or legacy tuples."""
+    if isinstance(past_key_values, (tuple, list)):
+        return [(k, v) for k, v in past_key_values]
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    if hasattr(past_key_values, "key_cache"):
+        return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+    return [(k, v) for k, v in past_key_values.to_legacy_cache()]
+
+
+def layers_to_cache(layers):
+    from transformers import DynamicCache
+
+    cache = DynamicCache()
+    for idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, idx)
+    return cache
+
+
+def length_buckets(lengths, ratio=1.5, slack=16, max_size=None):
+    """
+    Group positions into buckets of similar length, so padding to the longest stays cheap.
+
+    Positions are sorted by length; a bucket is closed when the next length
+    exceeds its shortest by more than ratio (plus a small absolute slack),
+    or when it reaches max_size. Returns lists of positions.
+    """
+    buckets, current, floor = [], [], 0
+    for position in sorted(range(len(lengths)), key=lambda p: lengths[p]):
+        length = lengths[position]
+        if current and (length > floor * ratio + slack or (max_size and len(current) >= max_size)):
+            buckets.append(current)
+            current = []
+        if not current:
+            floor = length
+        current.append(position)
+    if current:
+        buckets.append(current)
+    return buckets
+
+
+def _left_pad(layers, mask, width):
+    """Pad a batch's KV cache and attention mask on the left up to width positions."""
+    extra = width - mask.shape[1]
+    if extra <= 0:
+        return layers, mask
+    padded = []
+    for keys, values in layers:
+        pad_shape = list(keys.shape)
+        pad_shape[2] = extra
+        padded.append((
+            torch.cat([keys.new_zeros(pad_shape), keys], dim=2),
+            torch.cat([values.new_zeros(pad_shape), values], dim=2)
+        ))
+    return padded, torch.cat([mask.new_zeros((mask.shape[0], extra)), mask], dim=1)
+
+
+class _Request:
+    def __init__(self, prompt, max_new_tokens, processor, scanner, future):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.processor = processor
+        self.scanner = scanner
+        self.future = future
+        self.generated = []
+        self.finished = False
+        self.submitted_at = time.perf_counter()
+
+
+class ContinuousBatchingScheduler:
+    """
+    Token-level batching in front of one shared model.
+
+    Args:
+        load (callable): () → (tokenizer, model).
+        prefill_inputs (callable): prompts → dict with input_ids, attention_mask
+            and optionally past_key_values covering a shared cached prefix.
+        make_processor (callable): (schema, max_new_tokens) → logits processor or None;
+            it is called per request with that request's generated ids only.
+        make_scanner (callable): () → object with feed(text) → True once output is complete.
+        group_key (callable): prompt → key; requests admitted together are grouped by it
+            so each prefill can share a cached prefix.
+        length_key (callable): prompt → length (e.g. tokens); each group is further split
+            into length buckets so a prefill never pads short prompts to a long one.
+        max_rows (int): Upper bound on sequences decoding at once.
+        bucket_ratio (float): Longest/shortest prompt length allowed in one prefill.
+    """
+
+    def __init__(self, load, prefill_inputs, make_processor, make_scanner, group_key=None, length_key=None,
+                 max_rows=16, bucket_ratio=1.5):
+        self.load = load
+        self.prefill_inputs = prefill_inputs
+        self.make_processor = make_processor
+        self.make_scanner = make_scanner
+        self.group_key = group_key or (lambda prompt: None)
+        self.length_key = length_key or len
+        self.max_rows = max(1, max_rows)
+        self.bucket_ratio = bucket_ratio
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.tokenizer = None
+        self.model = None
+        # Running batch
+        self.rows = []
+        self.layers = None
+        self.mask = None
+        self.next_tokens = None
+        # Counters
+        self.steps = 0
+        self.row_steps = 0
+        self.admitted = 0
+        self.completed = 0
+        self.generated_tokens = 0
+        self.prefill_tokens = 0
+        self.prefill_padding = 0
+
+    def submit(self, prompt, max_new_tokens=200, schema=None):
+        """Queue one prompt; the returned Future resolves to the generated text."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((prompt, max_new_tokens, schema, future))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="inference-scheduler", daemon=True)
+                    self._thread.start()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "running": len(self.rows),
+            "steps": self.steps,
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "generated_tokens": self.generated_tokens,
+            "prefill_tokens": self.prefill_tokens,
+            "prefill_padding": self.prefill_padding,
+            "mean_batch_rows": round(self.row_steps / self.steps, 2) if self.steps else 0.0
+        }
+
+    # --- scheduler thread ---
+
+    def _drain(self, limit):
+        pending = []
+        while len(pending) < limit:
+            try:
+                pending.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return pending
+
+    def _load_model(self):
+        tokenizer, model = self.load()
+        eos = model.generation_config.eos_token_id
+        self.eos_ids = set(eos if isinstance(eos, (list, tuple)) else [eos]) | {tokenizer.eos_token_id}
+        self.tokenizer, self.model = tokenizer, model
+
+    def _loop(self):
+        while True:
+            pending = []
+            try:
+                if not self.rows:
+                    pending = [self._queue.get()] + self._drain(self.max_rows - 1)
+                else:
+                    pending = self._drain(self.max_rows - len(self.rows))
+                if self.model is None:
+                    self._load_model()
+                with torch.inference_mode():
+                    if pending:
+                        self._admit(pending)
+                    if self.rows:
+                        self._step()
+            except Exception as e:
+                print(f"❌ Inference scheduler step failed: {e}")
+                for request in self.rows:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                for *_, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                self.rows, self.layers, self.mask, self.next_tokens = [], None, None, None
+
+    def _admit(self, pending):
+        requests = []
+        for prompt, max_new_tokens, schema, future in pending:
+            if not future.set_running_or_notify_cancel():
+                continue
+            requests.append(_Request(prompt, max_new_tokens, self.make_processor(schema, max_new_tokens),
+                                     self.make_scanner(), future))
+
+        groups = {}
+        for request in requests:
+            groups.setdefault(self.group_key(request.prompt), []).append(request)
+        for group in groups.values():
+            lengths = [self.length_key(request.prompt) for request in group]
+            for bucket in length_buckets(lengths, self.bucket_ratio):
+                self._prefill([group[position] for position in bucket])
+
+    def _prefill(self, group):
+        inputs = self.prefill_inputs([request.prompt for request in group])
+        input_ids, mask = inputs["input_ids"], inputs["attention_mask"]
+        past = inputs.get("past_key_values")
+        cached = 0
+        if past is not None:
+            past = layers_to_cache(cache_to_layers(past))
+            cached = past.get_seq_length()
+
+        self.prefill_tokens += mask[:, cached:].numel()
+        self.prefill_padding += int((mask[:, cached:] == 0).sum())
+
+        position_ids = (mask.long().cumsum(-1) - 1).clamp(min=0)
+        with metrics.timer("prefill") as record:
+            outputs = self.model(
+                input_ids=input_ids[:, cached:],
+                attention_mask=mask,
+                position_ids=position_ids[:, cached:],
+                past_key_values=past,
+                use_cache=True
+            )
+            layers = cache_to_layers(outputs.past_key_values)
+            first_tokens = self._pick(group, outputs.logits[:, -1, :])
+            record.tokens = int(mask[:, cached:].sum())
+        self.admitted += len(group)
+
+        # Merge into the running batch, padding whichever side is shorter on the left
+        if self.rows:
+            width = max(self.mask.shape[1], mask.shape[1])
+            running_layers, running_mask = _left_pad(self.layers, self.mask, width)
+            layers, mask = _left_pad(layers, mask, width)
+            layers = [(torch.cat([rk, k]), torch.cat([rv, v])) for (rk, rv), (k, v) in zip(running_layers, layers)]
+            mask = torch.cat([running_mask, mask])
+            next_tokens = torch.cat([self.next_tokens, first_tokens])
+        else:
+            next_tokens = first_tokens
+        self.rows = self.rows + group
+        self.layers, self.mask, self.next_tokens = layers, mask, next_tokens
+        self._retire()
+
+    def _step(self):
+        # Position of the fed token = number of real tokens before it
+        position_ids = self.mask.long().sum(-1, keepdim=True)
+        self.mask = torch.cat([self.mask, self.mask.new_ones((self.mask.shape[0], 1))], dim=1)
+        with metrics.timer("decode") as record:
+            outputs = self.model(
+                input_ids=self.next_tokens[:, None],
+                attention_mask=self.mask,
+                position_ids=position_ids,
+                past_key_values=layers_to_cache(self.layers),
+                use_cache=True
+            )
+            self.layers = cache_to_layers(outputs.past_key_values)
+            self.next_tokens = self._pick(self.rows, outputs.logits[:, -1, :])
+            record.tokens = len(self.rows)
+        self.steps += 1
+        self.row_steps += len(self.rows)
+        self._retire()
+
+    def _pick(self, requests, logits):
+        """Greedy next token per row (after its schema processor); also records it on the request."""
+        logits = logits.float()
+        tokens = []
+        for row, request in enumerate(requests):
+            scores = logits[row:row + 1]
+            if request.processor is not None:
+                generated = torch.tensor([request.generated], dtype=torch.long).reshape(1, -1)
+                scores = request.processor(generated, scores)
+            token = int(scores.argmax(-1))
+            tokens.append(token)
+            if token in self.eos_ids:
+                request.finished = True
+                continue
+            request.generated.append(token)
+            self.generated_tokens += 1
+            request.finished = (
+                request.scanner.feed(self.tokenizer.decode([token], skip_special_tokens=True))
+                or len(request.generated) >= request.max_new_tokens
+            )
+        return torch.tensor(tokens, dtype=torch.long, device=logits.device)
+
+    def _retire(self):
+        """Resolve finished rows, drop them from the batch and trim all-padding columns."""
+        keep = [row for row, request in enumerate(self.rows) if not request.finished]
+        for request in self.rows:
+            if request.finished:
+                request.future.set_result(self.tokenizer.decode(request.generated, skip_special_tokens=True))
+                self.completed += 1
+        if len(keep) == len(self.rows):
+            return
+        if not keep:
+            self.rows, self.layers, self.mask, self.next_tokens = [], None, None, None
+            return
+
+        index = torch.tensor(keep, device=self.mask.device)
+        self.rows = [self.rows[row] for row in keep]
+        self.mask = self.mask.index_select(0, index)
+        self.next_tokens = self.next_tokens.index_select(0, index)
+        self.layers = [(k.index_select(0, index.to(k.device)), v.index_select(0, index.to(v.device)))
+                       for k, v in self.layers]
+
+        # Leading columns nobody attends to any more (left padding of departed rows)
+        used = self.mask.bool().any(dim=0).nonzero()
+        start = int(used[0]) if len(used) else 0
+        if start:
+            self.mask = self.mask[:, start:]
+            self.layers = [(k[:, :, start:], v[:, :, start:]) for k, v in self.layers]
@@ -0,0 +1,211 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# ---------------------------
+# Pipeline Metrics
+# ---------------------------
+# One process-wide registry of stage timings and event counters. Each stage
+# of the pipeline (extraction, parsing, tokenization, prefill, decode, JSON
+# extraction, retries, report generation) records how long it took and,
+# where it has one, how many tokens it handled. Modules with their own
+# gauges (result/extraction caches, token budgets, the job queue) register
+# a collector, so everything can be read in one place: as a dict with
+# snapshot(), or as Prometheus text with prometheus_text().
+STAGES = ("extraction", "parsing", "tokenization", "prefill", "decode", "json_extraction", "retry", "report")
+METRIC_PREFIX = "xaminai"
+
+
+class StageRecord:
+    """Yielded by Metrics.timer(); set tokens inside the block to count tokens for that stage."""
+
+    def __init__(self):
+        self.tokens = 0
+        self.seconds = 0.0
+
+
+class Metrics:
+    """Thread-safe stage timers, counters and registered collectors."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        self._collectors = {}
+        self.started_at = time.time()
+
+    def observe(self, stage, seconds, tokens=0):
+        """Record one run of stage that took seconds and handled tokens."""
+        with self._lock:
+            stats = self._stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "tokens": 0})
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["tokens"] += tokens
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the block as one run of stage."""
+        record = StageRecord()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - start
+            self.observe(stage, record.seconds, record.tokens)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def register_collector(self, name, collect):
+        """collect() → dict of gauges (nested dicts allowed), read on every snapshot/export."""
+        with self._lock:
+            self._collectors[name] = collect
+
+    def _collect(self):
+        with self._lock:
+            collectors = dict(self._collectors)
+        collected = {}
+        for name, collect in collectors.items():
+            try:
+                collected[name] = collect()
+            except Exception as e:
+                print(f"⚠️ Metrics collector {name} failed: {e}")
+        return collected
+
+    def snapshot(self):
+        """Stage timings (with means and tokens/sec), counters, derived rates and collector values."""
+        with self._lock:
+            stages = {stage: dict(stats) for stage, stats in self._stages.items()}
+            counters = dict(self._counters)
+        for stats in stages.values():
+            stats["mean_ms"] = round(1000 * stats["seconds"] / stats["count"], 2) if stats["count"] else 0.0
+            stats["tokens_per_second"] = round(stats["tokens"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+        model_questions = counters.get("model_questions", 0)
+        rates = {
+            "retry_rate": round(counters.get("retries", 0) / model_questions, 3) if model_questions else 0.0,
+            "result_cache_hit_rate": round(counters.get("result_cache_hits", 0) / model_questions, 3) if model_questions else 0.0
+        }
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "stages": stages,
+            "counters": counters,
+            "rates": rates,
+            "collectors": self._collect()
+        }
+
+    def drain(self):
+        """Stage timings and counters recorded so far, then reset (to ship them from a worker process)."""
+        with self._lock:
+            state = {"stages": self._stages, "counters": self._counters}
+            self._stages, self._counters = {}, {}
+        return state
+
+    def merge(self, state):
+        """Add the output of another process's drain() to this registry."""
+        with self._lock:
+            for stage, other in state.get("stages", {}).items():
+                stats = self._stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "tokens": 0})
+                stats["count"] += other["count"]
+                stats["seconds"] += other["seconds"]
+                stats["max_seconds"] = max(stats["max_seconds"], other["max_seconds"])
+                stats["tokens"] += other["tokens"]
+            for name, value in state.get("counters", {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def prometheus_text(self):
+        """Everything in snapshot() in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            if not samples:
+                return
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(val)}"' for key, val in labels.items())
+                lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {_format_value(value)}" if label_text
+                             else f"{METRIC_PREFIX}_{name} {_format_value(value)}")
+
+        stages = snapshot["stages"]
+        family("stage_seconds_total", "counter", "Time spent per pipeline stage.",
+               [({"stage": s}, v["seconds"]) for s, v in stages.items()])
+        family("stage_runs_total", "counter", "Runs per pipeline stage.",
+               [({"stage": s}, v["count"]) for s, v in stages.items()])
+        family("stage_tokens_total", "counter", "Tokens handled per pipeline stage.",
+               [({"stage": s}, v["tokens"]) for s, v in stages.items() if v["tokens"]])
+        family("stage_max_seconds", "gauge", "Slowest single run per pipeline stage.",
+               [({"stage": s}, v["max_seconds"]) for s, v in stages.items()])
+        family("events_total", "counter", "Pipeline event counts.",
+               [({"event": name}, value) for name, value in snapshot["counters"].items()])
+        family("rate", "gauge", "Derived pipeline rates.",
+               [({"rate": name}, value) for name, value in snapshot["rates"].items()])
+        family("uptime_seconds", "gauge", "Seconds since the metrics registry started.",
+               [({}, snapshot["uptime_seconds"])])
+        for collector, values in snapshot["collectors"].items():
+            for key, value in _flatten(values):
+                family(_metric_name(f"{collector}_{key}"), "gauge", f"{collector} {key}.", [({}, value)])
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(values, prefix=""):
+    """(key, number) pairs from a nested dict, nested keys joined with "_"; non-numeric values are skipped."""
+    if not isinstance(values, dict):
+        return
+    for key, value in values.items():
+        name = f"{prefix}_{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+def _metric_name(text):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", text).lower()
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def paper_metrics(entries, elapsed_seconds=None, **stage_seconds):
+    """
+    Per-paper totals from the per-question "metrics" of graded entries.
+
+    Extra keyword arguments (e.g. parse_seconds=0.4) are copied in as-is.
+    """
+    per_question = [entry.get("metrics") or {} for entry in entries or [] if entry]
+    model = [m for m in per_question if m.get("graded_by") == "model"]
+    generated = sum(m.get("generated_tokens", 0) for m in model)
+    cache_hits = sum(1 for m in model if m.get("cache_hit"))
+    retries = sum(m.get("retries", 0) for m in model)
+    result = {
+        "questions": len(per_question),
+        "model_questions": len(model),
+        "rule_questions": sum(1 for m in per_question if m.get("graded_by") in ("rule", "exact match")),
+        "reused_questions": sum(1 for m in per_question if m.get("graded_by") == "reused"),
+        "cache_hits": cache_hits,
+        "cache_hit_rate": round(cache_hits / len(model), 3) if model else 0.0,
+        "retries": retries,
+        "retry_rate": round(retries / len(model), 3) if model else 0.0,
+        "generated_tokens": generated
+    }
+    if elapsed_seconds is not None:
+        result["elapsed_seconds"] = round(elapsed_seconds, 3)
+        result["questions_per_second"] = round(len(per_question) / elapsed_seconds, 3) if elapsed_seconds else None
+        result["tokens_per_second"] = round(generated / elapsed_seconds, 1) if elapsed_seconds else None
+    result.update({key: round(value, 3) for key, value in stage_seconds.items() if value is not None})
+    return result
+
+
+# Shared by every module and session in the process
+metrics = Metrics()
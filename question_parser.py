@@ -0,0 +1,138 @@
+import re
+
+# ---------------------------
+# Single-pass Question Parser
+# ---------------------------
+# Splits extracted answer-script text into question records. A line starts
+# a new question when it is numbered ("1)", "2.", "Q3", "Q.4:", "Question 5",
+# "(6)") or reads like a question (ends with "?" or ":", or uses a question
+# word); every other line belongs to the current answer. Patterns are
+# compiled once and the text is walked exactly once, so cost is linear in
+# its length, and input can be fed page by page as it is extracted.
+QUESTION_WORDS = [
+    "define", "describe", "show", "illustrate", "elaborate", "explain", "give",
+    "who", "what", "where", "when", "why", "how"
+]
+QUESTION_WORD_RE = re.compile(r"\b(?:" + "|".join(QUESTION_WORDS) + r")\b", re.IGNORECASE)
+# Like answer_key.NUMBERED_LINE_RE, a plain number needs whitespace after its
+# separator, so decimals such as "9.8 m/s2" stay answer text
+NUMBERING_RE = re.compile(
+    r"^(?:(?P<plain>\d+)[\).](?=\s|$)"
+    r"|\((?P<paren>\d+)\)"
+    r"|Q(?:uestion)?\s*\.?\s*(?P<q>\d+)\b[\).:]?"
+    r")",
+    re.IGNORECASE
+)
+DEFAULT_MAX_SCORE = 5
+
+
+def question_number(line):
+    """Number of a numbered question line ("Q.3: ..." → "3"), or None."""
+    match = NUMBERING_RE.match(line)
+    if not match:
+        return None
+    return match.group("plain") or match.group("paren") or match.group("q")
+
+
+def is_question_line(line):
+    """True if a stripped, non-empty line starts a new question."""
+    if line[-1] in "?:":
+        return True
+    return NUMBERING_RE.match(line) is not None or QUESTION_WORD_RE.search(line) is not None
+
+
+class QuestionParser:
+    """
+    Incremental parser: feed() text in any chunks (e.g. one PDF page at a
+    time), then close(). Completed questions are available from feed()'s
+    return value as soon as the next question starts.
+
+    Each record has question_id, question, student_answer, correct_answer,
+    max_score, the detected question number (or None) and source_start /
+    source_end character offsets into the concatenated input.
+    """
+
+    def __init__(self, max_score=DEFAULT_MAX_SCORE):
+        self.max_score = max_score
+        self.questions = []
+        self._buffer = ""
+        self._buffer_offset = 0  # offset of _buffer[0] in the whole input
+        self._current = None     # (question line, number, start offset)
+        self._answer = []
+        self._end = 0
+
+    def feed(self, text):
+        """Consume a chunk of text; returns the questions completed by it."""
+        done_before = len(self.questions)
+        buffer = self._buffer + text
+        pos = 0
+        while True:
+            newline = buffer.find("\n", pos)
+            if newline < 0:
+                break
+            self._line(buffer, pos, newline)
+            pos = newline + 1
+        self._buffer = buffer[pos:]
+        self._buffer_offset += pos
+        return self.questions[done_before:]
+
+    def close(self):
+        """Flush the trailing line and the last open question; returns all questions."""
+        if self._buffer:
+            self._line(self._buffer, 0, len(self._buffer))
+            self._buffer_offset += len(self._buffer)
+            self._buffer = ""
+        self._finish()
+        return self.questions
+
+    def _line(self, buffer, start, end):
+        raw = buffer[start:end]
+        line = raw.strip()
+        if not line:
+            return
+        line_start = self._buffer_offset + start + (len(raw) - len(raw.lstrip()))
+        line_end = line_start + len(line)
+        if is_question_line(line):
+            self._finish()
+            self._current = (line, question_number(line), line_start)
+            self._answer = []
+        elif self._current is not None:
+            self._answer.append(line)
+        self._end = line_end
+
+    def _finish(self):
+        if self._current is None:
+            return
+        line, number, start = self._current
+        self.questions.append({
+            "question_id": f"Q{len(self.questions)+1}",
+            "question": line,
+            "student_answer": " ".join(self._answer).strip(),
+            "correct_answer": "",
+            "max_score": self.max_score,
+            "number": number,
+            "source_start": start,
+            "source_end": self._end
+        })
+        self._current = None
+        self._answer = []
+
+
+def parse_questions(text, max_score=DEFAULT_MAX_SCORE):
+    """Question records from a whole extracted text."""
+    parser = QuestionParser(max_score)
+    parser.feed(text)
+    return parser.close()
+
+
+def iter_questions(chunks, max_score=DEFAULT_MAX_SCORE):
+    """
+    Yield question records while text chunks (e.g. PDF pages) stream in.
+
+    Chunks are treated as separate lines, as if joined with newlines.
+    """
+    parser = QuestionParser(max_score)
+    for index, chunk in enumerate(chunks):
+        yield from parser.feed(("\n" if index else "") + chunk)
+    before = len(parser.questions)
+    yield from parser.close()[before:]
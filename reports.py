@@ -0,0 +1,52 @@
+from io import BytesIO
+
+from docx import Document
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+# ---------------------------
+# Graded Results Report (DOCX)
+# ---------------------------
+def generate_docx(results, max_score):
+    doc = Document()
+    doc.add_heading("Graded Results", 0)
+
+    for idx, q in enumerate(results, start=1):
+        doc.add_paragraph(f"Q{idx}: {q['question']}")
+        doc.add_paragraph(f"Student Answer: {q['student_answer']}")
+        doc.add_paragraph(f"Correct Answer: {q['correct_answer']}")
+        doc.add_paragraph(f"Model Score: {q['model_score']}")
+        doc.add_paragraph(f"Final Score: {q['final_score']} / {max_score}")
+        doc.add_paragraph(f"Feedback: {q.get('feedback', 'No feedback')}")
+        doc.add_paragraph("")
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+# ---------------------------
+# Graded Results Report (PDF)
+# ---------------------------
+def generate_pdf(results, max_score):
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer)
+    styles = getSampleStyleSheet()
+    story = []
+
+    story.append(Paragraph("Graded Results", styles["Title"]))
+    story.append(Spacer(1, 20))
+
+    for idx, q in enumerate(results, start=1):
+        story.append(Paragraph(f"Q{idx}: {q['question']}", styles["Heading3"]))
+        story.append(Paragraph(f"Student Answer: {q['student_answer']}", styles["Normal"]))
+        story.append(Paragraph(f"Correct Answer: {q['correct_answer']}", styles["Normal"]))
+        story.append(Paragraph(f"Model Score: {q['model_score']}", styles["Normal"]))
+        story.append(Paragraph(f"Final Score: {q['final_score']} / {max_score}", styles["Normal"]))
+        story.append(Paragraph(f"Feedback: {q.get('feedback', 'No feedback')}", styles["Normal"]))
+        story.append(Spacer(1, 12))
+
+    doc.build(story)
+    buffer.seek(0)
+    return buffer
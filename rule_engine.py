@@ -0,0 +1,252 @@
+import re
+
+# ---------------------------
+# Deterministic Rule-based Grading
+# ---------------------------
+# Mirrors the rules spelled out in the grading prompt: exact match for
+# integers, ±0.1 tolerance for decimals, exact chemical symbols and keyword
+# coverage. A verdict is "conclusive" when the model could not reasonably
+# disagree, in which case evaluate() skips the model call entirely. Keyword
+# coverage never is: it is only passed along as rule_score.
+DECIMAL_TOLERANCE = 0.1
+
+NUMBER_PATTERN = r"[-+−]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?(?:\s*[eE][-+]?\d+|\s*[x×\*]\s*10\s*\^\s*[-+]?\d+)?|[-+−]?\.\d+"
+# Unit tokens (letters, °, %) joined by "/", "·", "*", " per " or spaces, each with an optional exponent
+UNIT_TOKEN = r"(?:[A-Za-zµΩ°%]+\.?(?:\^?[-+−]?\d)?)"
+UNIT_PATTERN = rf"{UNIT_TOKEN}(?:\s*[/·*]\s*{UNIT_TOKEN}|\s+{UNIT_TOKEN})*"
+UNIT_PART_SPLIT_RE = re.compile(r"\s*[/·*]\s*|\s+")
+UNIT_EXPONENT_RE = re.compile(r"\^?[-+]?\d$")
+NUMERIC_ANSWER_RE = re.compile(
+    rf"^\s*(?P<number>{NUMBER_PATTERN})(?:\s*/\s*(?P<denominator>\d+))?\s*(?P<unit>{UNIT_PATTERN})?\s*$"
+)
+LEAD_IN_RE = re.compile(
+    r"^\s*(?:(?:the\s+)?(?:final\s+)?answer\s*(?:is|=|:)?|ans\.?\s*[:=]?|result\s*[:=]|[a-z]\s*=|=)\s*",
+    re.IGNORECASE
+)
+CHEMICAL_FORMULA_RE = re.compile(r"^(?:[A-Z][a-z]?\d*|\((?:[A-Z][a-z]?\d*)+\)\d*)+(?:[+-]\d*|\d*[+-])?$")
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+SUBSCRIPTS = str.maketrans("₀₁₂₃₄₅₆₇₈₉⁰¹²³⁴⁵⁶⁷⁸⁹⁺⁻", "0123456789" + "0123456789" + "+-")
+
+UNIT_ALIASES = {
+    "m": "m", "meter": "m", "meters": "m", "metre": "m", "metres": "m",
+    "cm": "cm", "centimeter": "cm", "centimeters": "cm", "centimetre": "cm", "centimetres": "cm",
+    "mm": "mm", "millimeter": "mm", "millimeters": "mm",
+    "km": "km", "kilometer": "km", "kilometers": "km", "kilometre": "km", "kilometres": "km",
+    "s": "s", "sec": "s", "secs": "s", "second": "s", "seconds": "s",
+    "min": "min", "mins": "min", "minute": "min", "minutes": "min",
+    "h": "h", "hr": "h", "hrs": "h", "hour": "h", "hours": "h",
+    "g": "g", "gram": "g", "grams": "g",
+    "kg": "kg", "kilogram": "kg", "kilograms": "kg",
+    "n": "N", "newton": "N", "newtons": "N",
+    "j": "J", "joule": "J", "joules": "J",
+    "w": "W", "watt": "W", "watts": "W",
+    "v": "V", "volt": "V", "volts": "V",
+    "a": "A", "amp": "A", "amps": "A", "ampere": "A", "amperes": "A",
+    "pa": "Pa", "pascal": "Pa", "pascals": "Pa",
+    "k": "K", "kelvin": "K",
+    "°c": "degC", "c": "degC", "degc": "degC", "celsius": "degC", "degreescelsius": "degC",
+    "°": "deg", "deg": "deg", "degree": "deg", "degrees": "deg",
+    "%": "%", "percent": "%",
+    "mol": "mol", "mole": "mol", "moles": "mol",
+    "l": "L", "litre": "L", "litres": "L", "liter": "L", "liters": "L",
+    "ml": "mL", "millilitre": "mL", "milliliters": "mL", "millilitres": "mL",
+    "m/s": "m/s", "mps": "m/s", "meterspersecond": "m/s", "metrespersecond": "m/s",
+    "m/s2": "m/s2", "meterspersecondsquared": "m/s2", "metrespersecondsquared": "m/s2",
+    "km/h": "km/h", "kmph": "km/h", "kph": "km/h", "kilometersperhour": "km/h",
+}
+UNIT_NAMES = set(UNIT_ALIASES.values())
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "of", "to", "in", "on", "at", "by", "for", "with",
+    "from", "into", "is", "are", "was", "were", "be", "been", "being", "it", "its", "this",
+    "that", "these", "those", "as", "which", "who", "whom", "what", "when", "where", "why",
+    "how", "their", "there", "they", "them", "he", "she", "his", "her", "we", "our", "you",
+    "your", "i", "my", "me", "can", "could", "will", "would", "should", "may", "might", "has",
+    "have", "had", "do", "does", "did", "so", "such", "than", "then", "also",
+    "very", "more", "most", "some", "any", "all", "each", "other", "if", "because",
+}
+# Kept out of STOPWORDS: "is not the powerhouse" must not cover the keywords of "is the powerhouse"
+ARTICLES = {"a", "an", "the"}
+NEGATIONS = {"not", "no", "never", "none", "nor", "neither", "nothing", "cannot"}
+
+
+def normalize_text(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    text = re.sub(r"\s+", " ", str(text or "")).strip().lower()
+    return text.rstrip(" .;,!")
+
+
+def normalize_unit(unit):
+    """Canonical unit name, or the squashed unit text if it is not a known alias."""
+    if not unit:
+        return ""
+    unit = unit.translate(SUBSCRIPTS).strip().rstrip(".").lower()
+    unit = unit.replace("^", "").replace(" per ", "/").replace("·", "").replace(" ", "")
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def is_known_unit(unit):
+    """True if unit is a UNIT_ALIASES entry or a product/quotient of them (N/m2, kg m/s^2, J/mol K)."""
+    unit = unit.translate(SUBSCRIPTS).strip().rstrip(".").lower().replace("−", "-")
+    if normalize_unit(unit) in UNIT_NAMES:
+        return True
+    parts = [p for p in UNIT_PART_SPLIT_RE.split(unit.replace(" per ", "/")) if p]
+    return bool(parts) and all(UNIT_ALIASES.get(UNIT_EXPONENT_RE.sub("", p).rstrip(".")) for p in parts)
+
+
+def parse_numeric_answer(text):
+    """
+    Parse an answer that is just a number with an optional unit.
+
+    Returns (value, is_integer, unit) or None if the text is anything more
+    than a bare quantity (working, sentences, several numbers, hedges,
+    words that are not a known unit, ...).
+    """
+    text = str(text or "").translate(SUBSCRIPTS).strip().rstrip(".")
+    text = LEAD_IN_RE.sub("", text, count=1)
+    match = NUMERIC_ANSWER_RE.match(text)
+    if not match:
+        return None
+
+    raw = match.group("number").replace("−", "-").replace(",", "").replace(" ", "")
+    raw = re.sub(r"[x×\*]10\^", "e", raw)
+    try:
+        value = float(raw)
+    except ValueError:
+        return None
+
+    is_integer = re.fullmatch(r"[-+]?\d+", raw) is not None
+    if match.group("denominator"):
+        denominator = float(match.group("denominator"))
+        if denominator == 0:
+            return None
+        value /= denominator
+        is_integer = False
+
+    unit = match.group("unit") or ""
+    # Trailing words that are not a unit ("2 or 3", "4 and 5", "5 probably") are more than a bare quantity
+    if unit and (len(unit.split()) > 3 or not is_known_unit(unit)):
+        return None
+    return value, is_integer, normalize_unit(unit)
+
+
+def normalize_formula(text):
+    """Chemical symbol/formula with whitespace removed and sub/superscripts flattened."""
+    return re.sub(r"\s+", "", str(text or "").translate(SUBSCRIPTS)).rstrip(".")
+
+
+def is_chemical_formula(text):
+    return bool(text) and len(text) <= 30 and CHEMICAL_FORMULA_RE.match(text) is not None
+
+
+def _stem(word):
+    for suffix in ("ations", "ation", "ings", "ing", "ies", "es", "ed", "ly", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            return word[:-len(suffix)]
+    return word
+
+
+def _content_stems(text):
+    return {_stem(w) for w in WORD_RE.findall(str(text or "").lower()) if w not in STOPWORDS}
+
+
+def count_negations(text):
+    """Number of negating words (not, never, isn't, ...) in text."""
+    return sum(1 for w in WORD_RE.findall(str(text or "").lower()) if w in NEGATIONS or w.endswith("n't"))
+
+
+def _word_sequence(text):
+    """Words of text in order, without articles: "The mitochondria." matches "mitochondria"."""
+    return [w for w in WORD_RE.findall(str(text or "").lower()) if w not in ARTICLES]
+
+
+def extract_keywords(correct_answer):
+    """
+    Keywords a full answer is expected to mention.
+
+    A comma/semicolon separated list of short phrases is taken to be an
+    examiner-supplied keyword list; otherwise every content word counts.
+    Each keyword is returned as a set of word stems.
+    """
+    parts = [p.strip() for p in re.split(r"[,;\n]", str(correct_answer or "")) if p.strip()]
+    if len(parts) >= 2 and all(len(p.split()) <= 4 for p in parts):
+        keywords = [_content_stems(p) for p in parts]
+    else:
+        keywords = [{stem} for stem in _content_stems(correct_answer)]
+    return [k for k in keywords if k]
+
+
+def round_to_half(value):
+    return round(value * 2) / 2
+
+
+def rule_based_score(student_answer, correct_answer, max_score=5):
+    """
+    Grade an answer with deterministic rules only.
+
+    Returns None when no rule applies, otherwise a dict with:
+        rule (str): which rule produced the verdict.
+        score (float): rule-based score between 0 and max_score.
+        conclusive (bool): True if the model call can be skipped.
+        feedback (str): short explanation for the examiner.
+    """
+    if not correct_answer or student_answer is None:
+        return None
+
+    student_norm = normalize_text(student_answer)
+    correct_norm = normalize_text(correct_answer)
+    if not student_norm:
+        return {"rule": "empty", "score": 0, "conclusive": True,
+                "feedback": "No answer was given."}
+    if student_norm == correct_norm or _word_sequence(student_answer) == _word_sequence(correct_answer):
+        return {"rule": "exact", "score": max_score, "conclusive": True,
+                "feedback": "✅ Perfect! Answer matches the correct answer exactly."}
+
+    # Numeric answers: exact for integers, ±0.1 for decimals
+    expected = parse_numeric_answer(correct_answer)
+    if expected is not None:
+        given = parse_numeric_answer(student_answer)
+        if given is None:
+            return None
+        expected_value, expected_integer, expected_unit = expected
+        given_value, _, given_unit = given
+        if expected_unit and given_unit and expected_unit != given_unit:
+            # Could be a valid conversion (cm vs m); leave it to the model
+            return None
+        if expected_integer:
+            correct = given_value == expected_value
+        else:
+            correct = abs(given_value - expected_value) <= DECIMAL_TOLERANCE + 1e-9
+        if correct:
+            return {"rule": "numeric", "score": max_score, "conclusive": True,
+                    "feedback": "✅ Correct value."}
+        return {"rule": "numeric", "score": 0, "conclusive": True,
+                "feedback": f"❌ Incorrect value: expected {correct_answer.strip()}, got {student_answer.strip()}."}
+
+    # Chemical symbols/formulae must match exactly (Au is not Ag, N is not Ne)
+    expected_formula = normalize_formula(correct_answer)
+    if is_chemical_formula(expected_formula):
+        given_formula = normalize_formula(student_answer)
+        if is_chemical_formula(given_formula):
+            if given_formula == expected_formula:
+                return {"rule": "chemical", "score": max_score, "conclusive": True,
+                        "feedback": "✅ Correct symbol/formula."}
+            return {"rule": "chemical", "score": 0, "conclusive": True,
+                    "feedback": f"❌ Incorrect symbol/formula: expected {expected_formula}, got {given_formula}."}
+        return None
+
+    # Keyword coverage for theory answers
+    keywords = extract_keywords(correct_answer)
+    if not keywords:
+        return None
+    student_stems = _content_stems(student_answer)
+    covered = sum(1 for keyword in keywords if keyword <= student_stems)
+    coverage = covered / len(keywords)
+    score = round_to_half(coverage * max_score)
+    # Only a hint: coverage ignores word order and contradictions ("the cell is the
+    # powerhouse of the mitochondria" covers every keyword), so the model always decides
+    feedback = f"Covers {covered} of {len(keywords)} expected keywords."
+    if count_negations(student_answer) > count_negations(correct_answer):
+        feedback += " The answer negates part of the key."
+    return {"rule": "keywords", "score": score, "conclusive": False, "feedback": feedback}
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The modules live at the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read at import time by disk_cache; keep test runs out of the working tree's cache
+os.environ.setdefault("XAMINAI_CACHE_DIR", tempfile.mkdtemp(prefix="xaminai-tests-"))
@@ -0,0 +1,52 @@
+from answer_key import AnswerKey
+from question_parser import parse_questions
+
+
+def correct_answers(key, data):
+    return [q["correct_answer"] for q in key.apply(data)]
+
+
+def test_numbered_key_aligns_by_question_number():
+    key = AnswerKey.from_text("1) Newton\n2) Joule\n3) Watt\n")
+    # The student skipped question 2 and answered 3 before 1
+    paper = parse_questions("3) Unit of power?\nwatt\n1) Unit of force?\nnewton\n")
+    assert [q["number"] for q in paper] == ["3", "1"]
+    assert correct_answers(key, paper) == ["Watt", "Newton"]
+
+
+def test_unnumbered_key_aligns_by_position():
+    key = AnswerKey.from_text("Newton\n\nJoule\n")
+    paper = parse_questions("What is the unit of force?\nnewton\nWhat is the unit of energy?\njoule\n")
+    assert correct_answers(key, paper) == ["Newton", "Joule"]
+
+
+def test_unnumbered_questions_fall_back_to_position():
+    key = AnswerKey.from_text("1) Newton\n2) Joule\n")
+    paper = [{"question": "Unit of force?", "student_answer": "newton", "correct_answer": ""}]
+    assert correct_answers(key, paper) == ["Newton"]
+
+
+def test_decimal_answers_are_not_question_numbers():
+    key = AnswerKey.from_text("1. 9.8 m/s2\n2. 3.5 m/s\n")
+    assert key.answers == ["9.8 m/s2", "3.5 m/s"]
+    assert key.by_number == {"1": 0, "2": 1}
+
+    unnumbered = AnswerKey.from_text("9.8 m/s2\n3.5 m/s\n")
+    assert unnumbered.answers == ["9.8 m/s2", "3.5 m/s"]
+    assert unnumbered.by_number == {}
+
+    paper = parse_questions("2) Give the speed of the cart\n3.5 m/s\n1) State g\n9.8 m/s2\n")
+    assert [(q["number"], q["student_answer"]) for q in paper] == [("2", "3.5 m/s"), ("1", "9.8 m/s2")]
+    assert correct_answers(key, paper) == ["3.5 m/s", "9.8 m/s2"]
+    assert correct_answers(unnumbered, paper) == ["9.8 m/s2", "3.5 m/s"]
+
+
+def test_record_key_aligns_by_question_id_only():
+    key = AnswerKey.from_records([
+        {"question_id": "Q2", "correct_answer": "Joule"},
+        {"question_id": "Q1", "correct_answer": "Newton"},
+    ])
+    paper = [{"question_id": "Q1"}, {"question_id": "Q2"}, {"question_id": "Q3"}]
+    applied = key.apply(paper)
+    assert [q.get("correct_answer") for q in applied] == ["Newton", "Joule", None]
+    assert key.as_correct_answers() == {"Q2": "Joule", "Q1": "Newton"}
@@ -0,0 +1,46 @@
+import json
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("torch")
+docx = pytest.importorskip("docx")
+
+from answer_key import AnswerKey  # noqa: E402
+from batch_grade import grade_submission  # noqa: E402
+
+KEY = "1) newton\n2) Na"
+
+
+def write_docx(path, lines):
+    doc = docx.Document()
+    for line in lines:
+        doc.add_paragraph(line)
+    buffer = BytesIO()
+    doc.save(buffer)
+    path.write_bytes(buffer.getvalue())
+    return str(path)
+
+
+def settings(max_score):
+    # Exact answers are graded by rules, so the model is never loaded
+    return {"answer_key": AnswerKey.from_text(KEY), "difficulty": "medium", "max_score": max_score, "batch_size": 8}
+
+
+def test_max_score_applies_to_parsed_documents(tmp_path):
+    path = write_docx(tmp_path / "jane.docx", ["1) What is the unit of force?", "newton", "2) What is the symbol of sodium?", "Na"])
+    result = grade_submission(path, settings(max_score=10))
+    assert result["status"] == "graded", result["error"]
+    assert [e["max_score"] for e in result["results"]] == [10, 10]
+    assert result["total_score"] == 20 and result["max_total"] == 20
+
+
+def test_json_records_keep_their_own_max_score(tmp_path):
+    path = tmp_path / "joe.json"
+    path.write_text(json.dumps([
+        {"question_id": "Q1", "question": "1) What is the unit of force?", "student_answer": "newton", "max_score": 3},
+        {"question_id": "Q2", "question": "2) What is the symbol of sodium?", "student_answer": "Na"}
+    ]))
+    result = grade_submission(str(path), settings(max_score=10))
+    assert result["status"] == "graded", result["error"]
+    assert [e["max_score"] for e in result["results"]] == [3, 10]
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from transformers import LogitsProcessorList  # noqa: E402
+
+from benchmarks.fake_backend import FakeModel, fake_tokenizer  # noqa: E402
+from constrained_decoding import (  # noqa: E402
+    COMPANION_SCHEMA, GRADING_SCHEMA, JsonSchemaLogitsProcessor, SchemaMatcher
+)
+
+GRADING_OBJECT = '{"score": 4.5, "feedback": "Cites \\"Ohm\'s law\\" by name"}'
+COMPANION_OBJECT = '{"feedback": "Good start", "keywords": ["force", "mass"], "improvement_steps": []}'
+
+
+def feed(schema, text):
+    matcher = SchemaMatcher(schema)
+    return matcher.feed(text), matcher
+
+
+@pytest.mark.parametrize("schema, text", [(GRADING_SCHEMA, GRADING_OBJECT), (COMPANION_SCHEMA, COMPANION_OBJECT)])
+def test_every_prefix_of_a_valid_object_is_accepted(schema, text):
+    for end in range(len(text) + 1):
+        accepted, matcher = feed(schema, text[:end])
+        assert accepted, text[:end]
+        assert matcher.complete == (end == len(text))
+    json.loads(text)
+
+
+@pytest.mark.parametrize("text", [
+    '{"feedback"',                      # keys out of order
+    '{"score":5',                       # spacing is fixed by the schema
+    '{"score": "5"',                    # score is a number
+    '{"score": -1',
+    '{"score": 1.2.3',
+    '{"score": 123456',                 # longer than MAX_NUMBER_CHARS
+    '{"score": 5, "feedback": "bad \\x',
+    '{"score": 5, "feedback": "line\nbreak',
+    '{"score": 5, "feedback": "ok"}x',  # nothing after the object
+])
+def test_grading_schema_rejects(text):
+    accepted, _ = feed(GRADING_SCHEMA, text)
+    assert not accepted
+
+
+@pytest.mark.parametrize("text", [
+    '{"feedback": "ok", "keywords": "force"',
+    '{"feedback": "ok", "keywords": ["force",]',
+    '{"feedback": "ok", "improvement_steps": []',
+    '{"feedback": "ok", "keywords": [], "improvement_steps": [1]',
+])
+def test_companion_schema_rejects(text):
+    accepted, _ = feed(COMPANION_SCHEMA, text)
+    assert not accepted
+
+
+@pytest.mark.parametrize("schema, prefix", [
+    (GRADING_SCHEMA, '{"score": 3'),
+    (GRADING_SCHEMA, '{"score": 3, "feedback": "Half \\'),
+    (COMPANION_SCHEMA, '{"feedback": "ok", "keywords": ["force", "ma'),
+])
+def test_closing_text_completes_the_object(schema, prefix):
+    _, matcher = feed(schema, prefix)
+    closing = matcher.closing_text()
+    accepted, completed = feed(schema, prefix + closing)
+    assert accepted and completed.complete
+    json.loads(prefix + closing)
+
+
+@pytest.mark.parametrize("prompt, schema, keys", [
+    ("Max Score: 5\nQ: Define force\nA: A push or a pull", GRADING_SCHEMA, {"score", "feedback"}),
+    ("Give feedback with improvement_steps for: Define inertia", COMPANION_SCHEMA,
+     {"feedback", "keywords", "improvement_steps"}),
+])
+def test_greedy_decode_of_malformed_model_is_valid_json(prompt, schema, keys):
+    tokenizer = fake_tokenizer()
+    model = FakeModel(tokenizer, token_latency=0, prefill_latency=0, malformed_rate=1.0, seed=0)
+    input_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+    prompt_len, max_new_tokens = input_ids.shape[1], 60
+    assert not model.respond(prompt).startswith("{")  # unconstrained, the model answers in prose
+
+    processor = JsonSchemaLogitsProcessor(tokenizer, schema, prompt_len, max_new_tokens)
+    output = model.generate(input_ids, max_new_tokens=max_new_tokens, logits_processor=LogitsProcessorList([processor]))
+    text = tokenizer.decode(output[0, prompt_len:], skip_special_tokens=True)
+
+    assert set(json.loads(text)) == keys
@@ -0,0 +1,89 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import disk_cache
+from disk_cache import DiskLRUCache, make_cache_key
+
+VALUE = "x" * 8  # 10 bytes once stored as JSON
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """Strictly increasing access times, so the LRU order never depends on timer resolution."""
+    ticks = itertools.count(1)
+    monkeypatch.setattr(disk_cache, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+def make_cache(tmp_path, max_bytes=30):
+    return DiskLRUCache(str(tmp_path / "cache" / "test.sqlite"), max_bytes=max_bytes)
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = make_cache(tmp_path)
+    for key in "abc":
+        cache.set(key, VALUE)
+    assert cache.get("a") == VALUE  # now "b" is the least recently used
+    cache.set("d", VALUE)
+
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == [VALUE] * 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_total_size_stays_within_max_bytes(tmp_path):
+    cache = make_cache(tmp_path)
+    for n in range(10):
+        cache.set(f"key{n}", VALUE)
+    stats = cache.stats()
+    assert stats["entries"] == 3
+    assert stats["bytes"] == 30
+    assert stats["evictions"] == 7
+
+
+def test_value_larger_than_the_cache_is_not_stored(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("a", VALUE)
+    cache.set("big", "y" * 40)
+    assert cache.get("big") is None
+    assert cache.get("a") == VALUE
+
+
+def test_replacing_a_key_does_not_double_count(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("a", VALUE)
+    cache.set("a", "z" * 8)
+    assert cache.get("a") == "z" * 8
+    assert cache.stats()["bytes"] == 10
+
+
+def test_entries_persist_across_instances(tmp_path):
+    first = make_cache(tmp_path)
+    first.set("a", [4, "ok"])
+    first.set("b", VALUE)
+    first.set("c", VALUE)
+    first.get("a")
+
+    second = make_cache(tmp_path)
+    assert second.get("a") == [4, "ok"]
+    assert second.stats()["entries"] == 3
+    # The LRU order is stored too: "b" was used least recently by the first instance
+    second.set("d", VALUE)
+    assert second.get("b") is None
+    assert second.get("c") == VALUE
+
+
+def test_hit_and_miss_counters(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("a", VALUE)
+    cache.get("a")
+    assert cache.get("missing", "default") == "default"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_make_cache_key_is_stable():
+    assert make_cache_key("questions", "3", 5, "abc") == make_cache_key("questions", "3", 5, "abc")
+    assert make_cache_key("questions", "3", 5, "abc") != make_cache_key("questions", "3", 10, "abc")
+    assert make_cache_key({"b": 1, "a": 2}) == make_cache_key({"a": 2, "b": 1})
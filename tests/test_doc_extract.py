@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("fitz")
+pytest.importorskip("docx")
+
+from doc_extract import detect_question, smart_parse_text_to_json  # noqa: E402
+
+
+@pytest.mark.parametrize("line", ["", "   ", "\t\n", None])
+def test_detect_question_blank_line(line):
+    assert not detect_question(line)
+
+
+@pytest.mark.parametrize("line", ["1) Define force", "What is inertia?", "  Explain the process:  "])
+def test_detect_question(line):
+    assert detect_question(line)
+
+
+def test_detect_question_answer_line():
+    assert not detect_question("The force is 5 N.")
+
+
+def test_parse_skips_blank_lines():
+    text = "1) What is the unit of force?\n\n   \nnewton\n\n2) What is the symbol of sodium?\nNa\n"
+    questions = smart_parse_text_to_json(text, use_cache=False)
+    assert [(q["question"], q["student_answer"]) for q in questions] == [
+        ("1) What is the unit of force?", "newton"),
+        ("2) What is the symbol of sodium?", "Na")
+    ]
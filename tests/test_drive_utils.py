@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+import drive_utils
+from drive_utils import DriveClient, LocalDriveService
+
+pytest.importorskip("googleapiclient")
+
+
+class CountingService(LocalDriveService):
+    """LocalDriveService that records every list query and media request."""
+
+    def __init__(self, root, calls):
+        super().__init__(root)
+        self.calls = calls
+
+    def files(self):
+        files = super().files()
+        calls = self.calls
+        list_files, get_media = files.list, files.get_media
+
+        def counted_list(q=None, **kwargs):
+            calls.append(("list", q, kwargs.get("pageToken")))
+            return list_files(q=q, **kwargs)
+
+        def counted_get_media(fileId, **kwargs):
+            calls.append(("get_media", fileId, None))
+            return get_media(fileId, **kwargs)
+
+        files.list, files.get_media = counted_list, counted_get_media
+        return files
+
+
+def write_file(root, name, content, mtime):
+    path = os.path.join(root, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    os.utime(path, (mtime, mtime))
+    return name
+
+
+@pytest.fixture
+def drive(tmp_path):
+    calls = []
+    root = str(tmp_path)
+    for n in range(5):
+        write_file(root, f"paper_{n}.pdf", b"%PDF " + bytes([n]) * 10, 1_700_000_000 + n)
+
+    def client(**kwargs):
+        return DriveClient(lambda: CountingService(root, calls), **kwargs)
+
+    return root, calls, client
+
+
+def lists(calls):
+    return [call for call in calls if call[0] == "list"]
+
+
+def test_listing_follows_every_page(drive, monkeypatch):
+    _, calls, client = drive
+    monkeypatch.setattr(drive_utils, "LIST_PAGE_SIZE", 2)
+    files = client().list_files()
+    assert [f["name"] for f in files] == [f"paper_{n}.pdf" for n in range(4, -1, -1)]
+    assert [token for _, _, token in lists(calls)] == [None, "2", "4"]
+
+
+def test_listing_is_served_from_memory_within_ttl(drive):
+    root, calls, client = drive
+    drive_client = client(list_ttl=3600)
+    first = drive_client.list_files()
+    write_file(root, "late.pdf", b"%PDF late", 1_700_000_100)
+    assert drive_client.list_files() == first
+    assert len(lists(calls)) == 1
+
+    # refresh=True bypasses the TTL
+    assert "late.pdf" in {f["name"] for f in drive_client.list_files(refresh=True)}
+    assert len(lists(calls)) == 2
+
+
+def test_expired_listing_is_refreshed_incrementally(drive):
+    root, calls, client = drive
+    drive_client = client(list_ttl=0)
+    drive_client.list_files()
+    write_file(root, "late.pdf", b"%PDF late", 1_700_000_100)
+
+    files = drive_client.list_files()
+    assert [f["name"] for f in files][0] == "late.pdf"
+    assert len(files) == 6
+    _, query, _ = lists(calls)[-1]
+    assert "modifiedTime > '2023-11-14T22:13:24.000Z'" in query
+
+
+def test_download_is_cached_per_revision(drive):
+    root, calls, client = drive
+    drive_client = client()
+    fh, name, error = drive_client.download("paper_0.pdf")
+    assert error is None and name == "paper_0.pdf"
+    assert fh.read() == b"%PDF " + bytes([0]) * 10
+
+    fh, _, _ = drive_client.download("paper_0.pdf")
+    assert fh.read() == b"%PDF " + bytes([0]) * 10
+    media = [call for call in calls if call[0] == "get_media"]
+    assert len(media) == 1
+
+    # A new modifiedTime is a new revision and is fetched again
+    write_file(root, "paper_0.pdf", b"%PDF revised", 1_700_000_200)
+    fh, _, _ = drive_client.download("paper_0.pdf")
+    assert fh.read() == b"%PDF revised"
+    assert len([call for call in calls if call[0] == "get_media"]) == 2
+
+
+def test_download_many(drive):
+    _, _, client = drive
+    results = client().download_many(["paper_1.pdf", "paper_2.pdf", "paper_1.pdf", "missing.pdf"])
+    assert set(results) == {"paper_1.pdf", "paper_2.pdf", "missing.pdf"}
+    assert results["paper_2.pdf"][1] == "paper_2.pdf"
+    assert results["missing.pdf"][0] is None and results["missing.pdf"][2]
@@ -0,0 +1,61 @@
+import threading
+import time
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("torch")
+
+from folder_grading import iter_grade_folder  # noqa: E402
+
+
+class SlowDrive:
+    """Drive client whose downloads each take a while."""
+
+    max_connections = 2
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def download(self, file_id):
+        time.sleep(self.delay)
+        return BytesIO(b""), file_id, None
+
+
+def files(count):
+    return [{"id": f"paper_{n}.pdf", "name": f"paper_{n}.pdf"} for n in range(count)]
+
+
+def consume(stream, results):
+    for item in stream:
+        results.append(item)
+
+
+def test_cancel_during_downloads_ends_the_generator():
+    cancel = threading.Event()
+    results = []
+    stream = iter_grade_folder(SlowDrive(0.2), files(6), lambda fh, name, max_score: [], cancel_event=cancel)
+    consumer = threading.Thread(target=consume, args=(stream, results), daemon=True)
+    consumer.start()
+    time.sleep(0.05)  # cancel while the first downloads are in flight
+    cancel.set()
+    consumer.join(timeout=5)
+    assert not consumer.is_alive()
+    assert results == []
+
+
+def test_failed_papers_are_reported():
+    results = list(iter_grade_folder(SlowDrive(0.01), files(3), lambda fh, name, max_score: []))
+    assert sorted(idx for idx, _ in results) == [0, 1, 2]
+    assert all(r["status"] == "failed" and r["error"] == "No questions found in the file." for _, r in results)
+
+
+def test_max_score_reaches_the_parser():
+    seen = []
+
+    def parse_document(fh, name, max_score):
+        seen.append(max_score)
+        return []
+
+    list(iter_grade_folder(SlowDrive(0.01), files(2), parse_document, max_score=8))
+    assert seen == [8, 8]
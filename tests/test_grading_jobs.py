@@ -0,0 +1,31 @@
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+
+from grading_jobs import RUNNING, GradingJob  # noqa: E402
+
+
+def running_job(total):
+    job = GradingJob("grading", [{}] * total)
+    job.status = RUNNING
+    job.started_at = job.model_started_at = time.time()
+    return job
+
+
+def test_eta_waits_for_a_model_graded_item():
+    job = running_job(4)
+    job.record(0, {}, model_time=False)
+    job.record(1, {}, model_time=False)
+    assert job.eta_seconds() is None
+
+
+def test_eta_ignores_rule_graded_items():
+    job = running_job(10)
+    for idx in range(8):
+        job.record(idx, {}, model_time=False)
+    job.model_started_at -= 2.0
+    job.record(8, {})
+    # one model item took ~2s, one is left
+    assert job.eta_seconds() == pytest.approx(2.0, abs=0.5)
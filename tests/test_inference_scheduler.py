@@ -0,0 +1,87 @@
+from concurrent.futures import Future
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from benchmarks.fake_backend import FakeModel, fake_tokenizer  # noqa: E402
+from day6_grader import JsonObjectScanner  # noqa: E402
+from inference_scheduler import ContinuousBatchingScheduler  # noqa: E402
+
+# Short and long prompts land in different length buckets, so the second
+# prefill is merged into the running batch with left padding
+PROMPTS = [
+    ("Max Score: 5\nQ: Define force", 200),
+    ("Max Score: 3\nQ: Define work", 12),
+    ("Max Score: 10\nQ: Explain, step by step and with the relevant law, why the sky is blue " * 3, 200),
+    ("Give feedback with improvement_steps for: Define inertia " * 4, 30),
+    ("Max Score: 2\nQ: Name the gas", 5),
+]
+
+
+def make_model(malformed_rate=0.3):
+    tokenizer = fake_tokenizer()
+    return tokenizer, FakeModel(tokenizer, token_latency=0, prefill_latency=0, malformed_rate=malformed_rate, seed=3)
+
+
+def reference(tokenizer, model, prompt, max_new_tokens):
+    """Text model.generate() produces for prompt on its own, cut where the scheduler stops a row."""
+    input_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+    new_ids = model.generate(input_ids, max_new_tokens=max_new_tokens)[0, input_ids.shape[1]:].tolist()
+    scanner = JsonObjectScanner()
+    for idx, token_id in enumerate(new_ids):
+        if scanner.feed(tokenizer.decode([token_id], skip_special_tokens=True)):
+            new_ids = new_ids[:idx + 1]
+            break
+    return tokenizer.decode(new_ids, skip_special_tokens=True)
+
+
+def make_scheduler(tokenizer, model, **kwargs):
+    return ContinuousBatchingScheduler(
+        load=lambda: (tokenizer, model),
+        prefill_inputs=lambda prompts: tokenizer(prompts, return_tensors="pt", padding=True),
+        make_processor=lambda schema, max_new_tokens: None,
+        make_scanner=JsonObjectScanner,
+        **kwargs
+    )
+
+
+def test_scheduler_matches_generate_row_by_row():
+    tokenizer, model = make_model()
+    scheduler = make_scheduler(tokenizer, model, max_rows=8)
+    futures = [scheduler.submit(prompt, max_new_tokens) for prompt, max_new_tokens in PROMPTS]
+    outputs = [future.result(timeout=30) for future in futures]
+
+    assert outputs == [reference(tokenizer, model, prompt, n) for prompt, n in PROMPTS]
+    assert scheduler.stats()["completed"] == len(PROMPTS)
+
+
+def test_rows_admitted_mid_decode_match_generate():
+    tokenizer, model = make_model()
+    scheduler = make_scheduler(tokenizer, model)
+    scheduler._load_model()
+    first, later = PROMPTS[:3], PROMPTS[3:]
+    futures = {}
+
+    def admit(prompts):
+        pending = []
+        for prompt, max_new_tokens in prompts:
+            future = futures[prompt] = Future()
+            pending.append((prompt, max_new_tokens, None, future))
+        scheduler._admit(pending)
+
+    with torch.inference_mode():
+        admit(first)
+        for _ in range(8):  # the short-budget row retires in the meantime
+            scheduler._step()
+        admit(later)
+        while scheduler.rows:
+            scheduler._step()
+            # Retired rows leave no all-padding columns behind
+            if scheduler.rows:
+                assert scheduler.mask[:, 0].any()
+                assert scheduler.layers[0][0].shape[2] == scheduler.mask.shape[1]
+
+    for prompt, max_new_tokens in PROMPTS:
+        assert futures[prompt].result(timeout=0) == reference(tokenizer, model, prompt, max_new_tokens)
@@ -0,0 +1,39 @@
+import pytest
+
+from question_parser import is_question_line, parse_questions, question_number
+
+
+@pytest.mark.parametrize("line, number", [
+    ("1) Define force", "1"),
+    ("2. State Newton's first law", "2"),
+    ("Q1: Define inertia", "1"),
+    ("Q.4 State Ohm's law", "4"),
+    ("Question 5. Name the gas", "5"),
+    ("(1) Define work", "1"),
+])
+def test_numbered_question_lines(line, number):
+    assert is_question_line(line)
+    assert question_number(line) == number
+
+
+@pytest.mark.parametrize("line", ["9.8 m/s2", "3.5 m/s is the answer", "1.5"])
+def test_decimals_are_not_numbering(line):
+    assert question_number(line) is None
+    assert not is_question_line(line)
+
+
+def test_decimal_answers_stay_with_their_question():
+    text = "1) State the acceleration due to gravity\n9.8 m/s2\n2) Give the speed of the cart\n3.5 m/s is the answer\n"
+    questions = parse_questions(text, max_score=4)
+    assert [(q["number"], q["student_answer"], q["max_score"]) for q in questions] == [
+        ("1", "9.8 m/s2", 4),
+        ("2", "3.5 m/s is the answer", 4)
+    ]
+
+
+def test_q_and_parenthesised_numbering():
+    questions = parse_questions("Q1: Define force\nA push or a pull\n(2) Define work\nForce times distance")
+    assert [(q["number"], q["question"], q["student_answer"]) for q in questions] == [
+        ("1", "Q1: Define force", "A push or a pull"),
+        ("2", "(2) Define work", "Force times distance")
+    ]
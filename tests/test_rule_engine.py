@@ -0,0 +1,64 @@
+import pytest
+
+from rule_engine import count_negations, parse_numeric_answer, rule_based_score
+
+
+def test_near_exact_answer_is_conclusive():
+    verdict = rule_based_score("The mitochondria is the powerhouse of the cell.", "Mitochondria is the powerhouse of the cell")
+    assert verdict["rule"] == "exact"
+    assert verdict["conclusive"]
+    assert verdict["score"] == 5
+
+
+@pytest.mark.parametrize("student, key", [
+    ("The cell is the powerhouse of the mitochondria", "Mitochondria is the powerhouse of the cell"),
+    ("Water boils at 50 degrees and ice melts at 100", "Water boils at 100 degrees"),
+    ("Noble gases do not react readily", "Noble gases do not react"),
+])
+def test_keyword_coverage_is_only_a_hint(student, key):
+    verdict = rule_based_score(student, key)
+    assert verdict["rule"] == "keywords"
+    assert not verdict["conclusive"]
+
+
+def test_negated_answer_is_left_to_the_model():
+    verdict = rule_based_score("Mitochondria is not the powerhouse of the cell", "Mitochondria is the powerhouse of the cell")
+    assert verdict is not None and not verdict["conclusive"]
+
+
+def test_contracted_negation_is_left_to_the_model():
+    verdict = rule_based_score("Mitochondria isn't the powerhouse of the cell", "Mitochondria is the powerhouse of the cell")
+    assert verdict is not None and not verdict["conclusive"]
+
+
+def test_count_negations():
+    assert count_negations("It is not, and never was, true") == 2
+    assert count_negations("It doesn't move") == 1
+    assert count_negations("Notably, nothing else") == 1
+
+
+def test_numeric_with_units():
+    assert parse_numeric_answer("9.8 m/s²") == (9.8, False, "m/s2")
+    assert parse_numeric_answer("Answer: 100 °C") == (100.0, True, "degC")
+    assert parse_numeric_answer("12 kg m/s^2")[2] == "kgm/s2"
+    assert parse_numeric_answer("5 N") == (5.0, True, "N")
+
+
+def test_hedged_and_multi_value_answers_are_not_numeric():
+    for answer in ("2 or 3", "4 and 5", "2 or maybe 3", "5 probably", "about 5 or so", "3, 4"):
+        assert parse_numeric_answer(answer) is None, answer
+
+
+def test_hedged_answer_is_left_to_the_model():
+    assert rule_based_score("2 or 3", "2") is None
+    assert rule_based_score("4 and 5", "4") is None
+    assert rule_based_score("9.8 or 10 m/s2", "9.8 m/s2") is None
+
+
+def test_numeric_verdicts():
+    assert rule_based_score("4", "4")["score"] == 5
+    assert rule_based_score("9.85 m/s2", "9.8 m/s2") == {
+        "rule": "numeric", "score": 5, "conclusive": True, "feedback": "✅ Correct value."
+    }
+    wrong = rule_based_score("6 N", "5 N")
+    assert wrong["score"] == 0 and wrong["conclusive"]